@@ -3,21 +3,80 @@ from __future__ import unicode_literals
 
 
 from future.builtins import object
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import namedtuple
 from copy import copy
 from itertools import product
 from operator import itemgetter
+import json
 
-from limpyd.utils import make_key, unique_key
+from limpyd.utils import is_bucket_pattern, make_key, unique_key
 from limpyd.exceptions import *
-from limpyd.fields import SingleValueField
+from limpyd.fields import SingleValueField, BytesField
+from limpyd.indexes import EqualIndex
 
 ParsedFilter = namedtuple('ParsedFilter', ['index', 'suffix', 'extra_field_parts', 'value', 'related_filters'])
 
+ParsedQ = namedtuple('ParsedQ', ['connector', 'negated', 'filters', 'pks', 'children'])
+
+CollectionPage = namedtuple('CollectionPage', ['results', 'cursor'])
+
 
 NONE_SLICE = slice(None, None, None)
 
 
+class Q(object):
+    """
+    A filter expression, to combine filters with ``&`` (and), ``|`` (or) and
+    ``~`` (not), to be passed to a collection.
+    Filters passed to the same ``Q`` are and-ed.
+
+    Example:
+    MyModel.collection(Q(foo=1) | Q(bar=2), baz=3)
+    """
+
+    AND = 'AND'
+    OR = 'OR'
+
+    def __init__(self, *q_filters, **filters):
+        for q_filter in q_filters:
+            if not isinstance(q_filter, Q):
+                raise ValueError('Only `Q` objects can be passed as positional filters, not %s' % (q_filter, ))
+        self.connector = self.AND
+        self.negated = False
+        self.children = list(q_filters) + sorted(filters.items(), key=itemgetter(0))
+
+    def _combine(self, other, connector):
+        if not isinstance(other, Q):
+            return NotImplemented
+        combined = Q()
+        combined.connector = connector
+        combined.children = [self, other]
+        return combined
+
+    def __and__(self, other):
+        return self._combine(other, self.AND)
+
+    def __or__(self, other):
+        return self._combine(other, self.OR)
+
+    def __invert__(self):
+        inverted = Q()
+        inverted.connector = self.connector
+        inverted.children = list(self.children)
+        inverted.negated = not self.negated
+        return inverted
+
+    def __repr__(self):
+        result = '(%s: %s)' % (self.connector, ', '.join(
+            repr(child) if isinstance(child, Q) else '%s=%r' % child
+            for child in self.children
+        ))
+        if self.negated:
+            result = '(NOT %s)' % result
+        return result
+
+
 class CollectionResults(object):
     def __init__(self, data, func=None):
         self.data = data
@@ -104,6 +163,136 @@ class CollectionResults(object):
         return '<%s %r>' % (self.__class__.__name__, data)
 
 
+class Aggregate(object):
+    """
+    Base class of the aggregations that can be computed on a collection with
+    its ``aggregate`` method. The values of the field must be numbers, other
+    values are ignored.
+    """
+
+    function = None  # name of the function in the ``aggregate`` lua script
+    field_required = True
+
+    def __init__(self, field_name=None):
+        if field_name is None and self.field_required:
+            raise ValueError('A field name is required for %s' % self.__class__.__name__)
+        self.field_name = field_name
+
+    def get_script_args(self, model):
+        """Return the arguments for the ``aggregate`` lua script
+
+        Parameters
+        ----------
+        model : Type[RedisModel]
+            The model of the collection on which the aggregation is done
+
+        Returns
+        -------
+        List[str]
+            Five arguments: the function, the prefix and suffix of the keys holding the
+            values (around the pk), the field of the hash holding the values (or an empty string
+            if the keys are not hashes), and the sorted set of an index having the values as
+            scores, to get minimum and maximum values (or an empty string).
+
+        Raises
+        ------
+        ImplementationError
+            If the field is not a single value field
+
+        """
+        if self.field_name is None:
+            return [self.function, '', '', '', '']
+
+        field = model.get_field(self.field_name)
+        if not isinstance(field, SingleValueField):
+            raise ImplementationError('Field %s.%s cannot be aggregated' % (model.__name__, field.name))
+
+        pattern, __, hash_field = field.sort_wildcard.partition('->')
+        prefix, __, suffix = pattern.partition('*')
+
+        score_key = ''
+        for index in field._indexes:
+            # a partial index (with ``only_if``) does not have the values of all instances
+            if getattr(index, 'ordering', None) == 'score' and not index.transform and not index.only_if:
+                score_key = index.get_ordering_key()
+                break
+
+        return [self.function, prefix, suffix, hash_field, score_key]
+
+    def prepare_result(self, result):
+        """Convert the result returned by the lua script"""
+        return None if result is None else float(result)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, repr(self.field_name) if self.field_name else '')
+
+
+class Count(Aggregate):
+    """Number of entries in the collection, or having a numeric value for the given field"""
+    function = 'count'
+    field_required = False
+
+    def prepare_result(self, result):
+        return 0 if result is None else int(result)
+
+
+class Sum(Aggregate):
+    """Sum of the values of the given field"""
+    function = 'sum'
+
+
+class Avg(Aggregate):
+    """Average of the values of the given field"""
+    function = 'avg'
+
+
+class Min(Aggregate):
+    """Minimum value of the given field"""
+    function = 'min'
+
+
+class Max(Aggregate):
+    """Maximum value of the given field"""
+    function = 'max'
+
+
+class PkInFilter(object):
+    """
+    Act as an index to filter a collection on many primary keys, with the
+    ``pk__in`` filter. The pks are added in a temporary set, by chunks, in a
+    single pipeline, and this set is intersected with the set of all the pks of
+    the model, to ignore the ones that do not exist.
+    """
+
+    filter_single_field = True
+    chunk_size = 1000  # number of pks added to the temporary set in each ``SADD``
+
+    def __init__(self, model):
+        self.model = model
+        self.field = model.get_field('pk')
+
+    def get_filtered_keys(self, suffix, *args, **kwargs):
+        """Return the temporary set with the given pks (the last entry of `args`),
+        and the set of all pks of the model
+
+        For the parameters, see ``BaseIndex.get_filtered_keys``
+
+        """
+        pks = sorted(set(self.field.normalize(pk) for pk in args[-1]))
+
+        tmp_key = unique_key(
+            self.field.connection,
+            prefix=make_key(self.model._name, '__index__', 'pk', 'tmp')
+        )
+        if pks:
+            with self.field.connection.pipeline(transaction=False) as pipe:
+                for start in range(0, len(pks), self.chunk_size):
+                    pipe.sadd(tmp_key, *pks[start:start + self.chunk_size])
+                pipe.execute()
+
+        return [(tmp_key, 'set', True), (self.field.collection_key, 'set', False)]
+
+
 class CollectionManager(object):
     """
     Retrieve objects collection, optionnaly slice and order it.
@@ -115,6 +304,7 @@ class CollectionManager(object):
     MyModel.collection().sort(by='field') => return the collection sorted.
     MyModel.collection().sort(by='field')[:10] => slice the sorted collection.
     MyModel.collection().instances() => return the instances
+    MyModel.collection(Q(foo=1) | Q(bar=2)).exclude(baz=3) => combine filters
 
     Note:
     Slicing a collection will force a sort.
@@ -125,6 +315,624 @@ class CollectionManager(object):
     # time between a first call to __len__ followed by a collection retrieval
     FINAL_SET_TTL = 300
 
+    # if filtered collections can be fetched in one call to redis, via the ``fetch`` lua script
+    FETCH_IN_ONE_CALL = True
+
+    # default number of entries to retrieve at once when using ``iterator``
+    ITERATOR_CHUNK_SIZE = 1000
+
+    # number of members read at once from the sorted-set used by ``after``
+    AFTER_BLOCK_SIZE = 100
+
+    scripts = {
+        'page_after': {
+            # read the sorted-set used to order the collection, by blocks, starting after the
+            # cursor (a member and its score), and keep members that are in all the filter keys
+            # until we have one more than the limit (to know if there is a next page)
+            # for a "lex" sorted-set, the pk is extracted from the member, on the separator
+            # return: has_more flag, last member, its score, then the pks
+            'lua': """
+                local order_key, mode, desc = KEYS[1], ARGV[1], ARGV[2] == '1'
+                local limit, block_size = tonumber(ARGV[3]), tonumber(ARGV[4])
+                local has_cursor, cursor_member, cursor_score = ARGV[5] == '1', ARGV[6], ARGV[7]
+                local separator = ARGV[8]
+
+                -- byte-wise comparison, as done by redis for members with the same score
+                local function compare(a, b)
+                    for i = 1, math.min(a:len(), b:len()) do
+                        local byte_a, byte_b = a:byte(i), b:byte(i)
+                        if byte_a ~= byte_b then
+                            return byte_a - byte_b
+                        end
+                    end
+                    return a:len() - b:len()
+                end
+
+                -- command to use to check if a pk is in each filter key
+                local checks = {}
+                for i = 2, #KEYS do
+                    local key_type = redis.call('type', KEYS[i])['ok']
+                    if key_type == 'set' then
+                        checks[#checks + 1] = {'sismember', KEYS[i]}
+                    elseif key_type == 'zset' then
+                        checks[#checks + 1] = {'zscore', KEYS[i]}
+                    else  -- a key that does not exist is an empty set
+                        return {0, '', ''}
+                    end
+                end
+
+                local command, range_start, range_end
+                local with_scores = mode == 'score'
+                if with_scores then
+                    -- the cursor score is included, members with the same score are checked below
+                    command = desc and 'zrevrangebyscore' or 'zrangebyscore'
+                    range_start = has_cursor and cursor_score or (desc and '+inf' or '-inf')
+                    range_end = desc and '-inf' or '+inf'
+                else
+                    -- members are unique so we can exclude the cursor
+                    command = desc and 'zrevrangebylex' or 'zrangebylex'
+                    range_start = has_cursor and ('(' .. cursor_member) or (desc and '+' or '-')
+                    range_end = desc and '-' or '+'
+                end
+                local step = with_scores and 2 or 1
+
+                local results, nb_results, offset = {0, '', ''}, 0, 0
+                while true do
+                    local members
+                    if with_scores then
+                        members = redis.call(command, order_key, range_start, range_end, 'withscores', 'limit', offset, block_size)
+                    else
+                        members = redis.call(command, order_key, range_start, range_end, 'limit', offset, block_size)
+                    end
+                    for i = 1, #members, step do
+                        local member, score = members[i], with_scores and members[i + 1] or ''
+                        local keep = true
+                        if has_cursor and with_scores and tonumber(score) == tonumber(cursor_score) then
+                            local diff = compare(member, cursor_member)
+                            keep = (desc and diff < 0) or (not desc and diff > 0)
+                        end
+                        local pk = member
+                        if keep and separator:len() == 1 then
+                            -- compact index: the value cannot contain the separator
+                            pk = member:sub(member:find(separator, 1, true) + 1)
+                        elseif keep and separator ~= '' then
+                            -- split on the last separator to get the pk
+                            local first_pos, last_pos = member:reverse():find(separator:reverse(), 1, true)
+                            pk = member:sub(member:len() - last_pos + separator:len() + 1)
+                        end
+                        if keep then
+                            for _, check in ipairs(checks) do
+                                local found = redis.call(check[1], check[2], pk)
+                                if not found or found == 0 then
+                                    keep = false
+                                    break
+                                end
+                            end
+                        end
+                        if keep then
+                            if nb_results == limit then
+                                -- one more than the limit: we have a next page
+                                results[1] = 1
+                                return results
+                            end
+                            nb_results = nb_results + 1
+                            results[2], results[3], results[nb_results + 3] = member, score, pk
+                        end
+                    end
+                    -- if we got less than the max, it means we are done
+                    if #members < block_size * step then
+                        return results
+                    end
+                    offset = offset + block_size
+                end
+            """,
+        },
+        'sort_by_index': {
+            # return the wanted slice of the final set, ordered by the sorted-set of a sort index,
+            # the same way the SORT command would do
+            # - "score" sorted-set: intersect it with the final set (weights 0 1), then add the
+            #   entries of the final set not in the index with a score of 0, and use zrange
+            # - "lex" sorted-set: read it by blocks, keeping members in the final set, and stop
+            #   as soon as we have the wanted slice. Entries not in the index are the first ones
+            #   (last ones if `desc`), ordered by pk. When not `desc`, the final set must be the
+            #   whole collection, so all the pks of the index are in it and we know how many are
+            #   not in the index (else the SORT command is used, see `_can_sort_with_index`)
+            # a list is first copied in a set, as it cannot be intersected
+            'lua': """
+                local final_key, order_key, tmp_key, tmp_set_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+                local mode, desc = ARGV[1], ARGV[2] == '1'
+                local start, num, separator = tonumber(ARGV[3]), tonumber(ARGV[4]), ARGV[5]
+                if num == 0 then
+                    return {}
+                end
+                local stop = num < 0 and -1 or start + num - 1
+
+                local final_type = redis.call('type', final_key)['ok']
+                if final_type == 'none' then
+                    return {}
+                elseif final_type == 'list' then
+                    local members = redis.call('lrange', final_key, 0, -1)
+                    final_key, final_type = tmp_set_key, 'set'
+                    for i = 1, #members, 1000 do
+                        redis.call('sadd', final_key, unpack(members, i, math.min(i + 999, #members)))
+                    end
+                end
+
+                local results = {}
+
+                if mode == 'score' then
+                    redis.call('zinterstore', tmp_key, 2, final_key, order_key, 'weights', 0, 1)
+                    redis.call('zunionstore', tmp_key, 2, final_key, tmp_key, 'weights', 0, 1)
+                    results = redis.call(desc and 'zrevrange' or 'zrange', tmp_key, start, stop)
+                    redis.call('del', tmp_key)
+
+                else
+                    local check = final_type == 'set' and 'sismember' or 'zscore'
+                    local command = desc and 'zrevrange' or 'zrange'
+                    local total = redis.call(final_type == 'set' and 'scard' or 'zcard', final_key)
+
+                    -- read the index to have at least `count` pks in `ordered` (all if `count` is -1)
+                    local ordered, seen, offset, block_size, walk_done = {}, {}, 0, 100, false
+                    local function walk(count)
+                        while not walk_done and (count < 0 or #ordered < count) do
+                            local members = redis.call(command, order_key, offset, offset + block_size - 1)
+                            for _, member in ipairs(members) do
+                                local pk
+                                if separator:len() == 1 then
+                                    -- compact index: the value cannot contain the separator
+                                    pk = member:sub(member:find(separator, 1, true) + 1)
+                                else
+                                    -- split on the last separator to get the pk
+                                    local first_pos, last_pos = member:reverse():find(separator:reverse(), 1, true)
+                                    pk = member:sub(member:len() - last_pos + separator:len() + 1)
+                                end
+                                local found = redis.call(check, final_key, pk)
+                                if found and found ~= 0 then
+                                    ordered[#ordered + 1] = pk
+                                    seen[pk] = true
+                                end
+                            end
+                            walk_done = #members < block_size
+                            offset = offset + block_size
+                        end
+                    end
+
+                    -- get the pks in the final set but not in the index, ordered
+                    local function get_missing()
+                        walk(-1)
+                        local members
+                        if final_type == 'set' then
+                            members = redis.call('smembers', final_key)
+                        else
+                            members = redis.call('zrange', final_key, 0, -1)
+                        end
+                        local missing = {}
+                        for _, pk in ipairs(members) do
+                            if not seen[pk] then
+                                missing[#missing + 1] = pk
+                            end
+                        end
+                        if desc then
+                            table.sort(missing, function(a, b) return a > b end)
+                        else
+                            table.sort(missing)
+                        end
+                        return missing
+                    end
+
+                    -- add to the results the entries of `list` for the positions `first` to `last`
+                    -- (0-based, `last` being -1 for "until the end"), `list` starting at `position`
+                    local function add_results(list, position, first, last)
+                        local from = math.max(first - position, 0) + 1
+                        local to = last < 0 and #list or math.min(last - position + 1, #list)
+                        for i = from, to do
+                            results[#results + 1] = list[i]
+                        end
+                    end
+
+                    if desc then
+                        -- entries not in the index are the last ones
+                        walk(stop < 0 and -1 or stop + 1)
+                        add_results(ordered, 0, start, stop)
+                        if walk_done and (stop < 0 or stop >= #ordered) then
+                            add_results(get_missing(), #ordered, start, stop)
+                        end
+                    else
+                        -- entries not in the index are the first ones (all the pks of the
+                        -- index are in the final set)
+                        local nb_missing = total - redis.call('zcard', order_key)
+                        if start < nb_missing then
+                            add_results(get_missing(), 0, start, stop)
+                        end
+                        if stop < 0 or stop >= nb_missing then
+                            walk(stop < 0 and -1 or stop - nb_missing + 1)
+                            add_results(ordered, nb_missing, start, stop)
+                        end
+                    end
+                end
+
+                if final_key == tmp_set_key then
+                    redis.call('del', tmp_set_key)
+                end
+                return results
+            """,
+        },
+        'aggregate': {
+            # compute aggregations (count, sum, avg, min, max) on the values of some fields for all
+            # the pks of the final set (a set, sorted set, or list)
+            # KEYS: the final set
+            # ARGV: "1" if the final set is the whole collection, the number of aggregations, then
+            # five arguments for each one (see ``Aggregate.get_script_args``)
+            # return the result of each aggregation, as a string, or false if there is no values
+            'lua': """
+                local final_key = KEYS[1]
+                local all_in_collection = ARGV[1] == '1'
+                local nb_aggregates = tonumber(ARGV[2])
+
+                local final_type = redis.call('type', final_key)['ok']
+                local members
+                if final_type == 'set' then
+                    members = redis.call('smembers', final_key)
+                elseif final_type == 'zset' then
+                    members = redis.call('zrange', final_key, 0, -1)
+                elseif final_type == 'list' then
+                    members = redis.call('lrange', final_key, 0, -1)
+                else
+                    members = {}
+                end
+
+                local lookup
+                local function is_member(pk)
+                    if all_in_collection then
+                        return true
+                    elseif final_type == 'set' then
+                        return redis.call('sismember', final_key, pk) == 1
+                    end
+                    if not lookup then
+                        lookup = {}
+                        for _, member in ipairs(members) do
+                            lookup[member] = true
+                        end
+                    end
+                    return lookup[pk] == true
+                end
+
+                -- the numeric values of a field for all the members, read only once per field
+                local values_cache = {}
+                local function get_values(prefix, suffix, hash_field)
+                    local cache_key = prefix .. '*' .. suffix .. '->' .. hash_field
+                    if not values_cache[cache_key] then
+                        local values = {}
+                        for _, pk in ipairs(members) do
+                            local value
+                            if string.find(hash_field, '*', 1, true) then
+                                -- field of a model using buckets: the suffix is "/<bucket size>"
+                                local bucket = math.floor(tonumber(pk) / tonumber(string.sub(suffix, 2)))
+                                value = redis.call('hget', prefix .. string.format('%d', bucket),
+                                                   (string.gsub(hash_field, '%*', pk, 1)))
+                            elseif hash_field ~= '' then
+                                value = redis.call('hget', prefix .. pk .. suffix, hash_field)
+                            else
+                                value = redis.call('get', prefix .. pk .. suffix)
+                            end
+                            value = tonumber(value)
+                            if value then
+                                values[#values + 1] = value
+                            end
+                        end
+                        values_cache[cache_key] = values
+                    end
+                    return values_cache[cache_key]
+                end
+
+                -- the minimum or maximum score in the sorted set of an index, for the members
+                local function get_boundary(score_key, is_max)
+                    local total = redis.call('zcard', score_key)
+                    local result = false
+                    if not all_in_collection and #members * 4 < total then
+                        -- few members: get their scores
+                        for _, pk in ipairs(members) do
+                            local score = redis.call('zscore', score_key, pk)
+                            if score and (not result or (is_max and tonumber(score) > tonumber(result))
+                                                    or (not is_max and tonumber(score) < tonumber(result))) then
+                                result = score
+                            end
+                        end
+                        return result
+                    end
+                    -- else walk the sorted set from the wanted end until we find a member
+                    local command = is_max and 'zrevrange' or 'zrange'
+                    local start, block_size = 0, 100
+                    while start < total do
+                        local block = redis.call(command, score_key, start, start + block_size - 1, 'withscores')
+                        for i = 1, #block, 2 do
+                            if is_member(block[i]) then
+                                return block[i + 1]
+                            end
+                        end
+                        start = start + block_size
+                    end
+                    return result
+                end
+
+                local results = {}
+                for i = 0, nb_aggregates - 1 do
+                    local position = 3 + i * 5
+                    local func, prefix, suffix = ARGV[position], ARGV[position + 1], ARGV[position + 2]
+                    local hash_field, score_key = ARGV[position + 3], ARGV[position + 4]
+                    local result = false
+                    if func == 'count' and prefix == '' then
+                        result = #members
+                    elseif (func == 'min' or func == 'max') and score_key ~= '' then
+                        result = get_boundary(score_key, func == 'max')
+                    else
+                        local values = get_values(prefix, suffix, hash_field)
+                        if func == 'count' then
+                            result = #values
+                        elseif #values > 0 then
+                            result = values[1]
+                            for j = 2, #values do
+                                local value = values[j]
+                                if func == 'min' then
+                                    result = math.min(result, value)
+                                elseif func == 'max' then
+                                    result = math.max(result, value)
+                                else
+                                    result = result + value
+                                end
+                            end
+                            if func == 'avg' then
+                                result = result / #values
+                            end
+                        end
+                    end
+                    if type(result) == 'number' then
+                        result = string.format('%.17g', result)
+                    end
+                    results[#results + 1] = result
+                end
+                return results
+            """,
+        },
+        'facet_counts': {
+            # count the members of the final set in each given set
+            # KEYS: the final set, then the sets in which to count
+            # ARGV: "1" if the final set is the whole collection
+            # return the counts, in the order of the sets
+            'lua': """
+                local final_key = KEYS[1]
+                local all_in_collection = ARGV[1] == '1'
+                local final_type = redis.call('type', final_key)['ok']
+
+                -- sintercard can't be used for other types than sets
+                local lookup
+                if not all_in_collection and (final_type == 'zset' or final_type == 'list') then
+                    lookup = {}
+                    local members
+                    if final_type == 'zset' then
+                        members = redis.call('zrange', final_key, 0, -1)
+                    else
+                        members = redis.call('lrange', final_key, 0, -1)
+                    end
+                    for _, member in ipairs(members) do
+                        lookup[member] = true
+                    end
+                end
+
+                local has_sintercard  -- only available since redis 7
+                local counts = {}
+                for i = 2, #KEYS do
+                    local count
+                    if all_in_collection then
+                        count = redis.call('scard', KEYS[i])
+                    elseif lookup then
+                        count = 0
+                        for _, member in ipairs(redis.call('smembers', KEYS[i])) do
+                            if lookup[member] then
+                                count = count + 1
+                            end
+                        end
+                    else
+                        if has_sintercard == nil then
+                            local result = redis.pcall('sintercard', 2, final_key, KEYS[i])
+                            has_sintercard = type(result) == 'number'
+                            if has_sintercard then
+                                count = result
+                            end
+                        end
+                        if count == nil then
+                            if has_sintercard then
+                                count = redis.call('sintercard', 2, final_key, KEYS[i])
+                            else
+                                count = #redis.call('sinter', final_key, KEYS[i])
+                            end
+                        end
+                    end
+                    counts[#counts + 1] = count
+                end
+                return counts
+            """,
+        },
+        'fetch': {
+            # intersect the filter sets, then return their members, or the result of the SORT
+            # command, and delete the temporary keys, all in one call
+            # KEYS: the key where to store the intersection, the keys to intersect, and then the
+            # temporary keys to delete (the last keys to intersect may be temporary ones too)
+            # ARGV: the number of keys to intersect, the number of them that are temporary, then
+            # "smembers" or "sort" followed by the arguments to pass to the SORT command
+            # return false (and do nothing) if the key to store the intersection already exists
+            'lua': """
+                local dest_key = KEYS[1]
+                local nb_sets, nb_tmp_sets = tonumber(ARGV[1]), tonumber(ARGV[2])
+                local final_key = KEYS[2]
+                if nb_sets > 1 then
+                    if redis.call('exists', dest_key) == 1 then
+                        return false
+                    end
+                    redis.call('sinterstore', dest_key, unpack(KEYS, 2, nb_sets + 1))
+                    final_key = dest_key
+                end
+
+                local results
+                if ARGV[3] == 'smembers' then
+                    results = redis.call('smembers', final_key)
+                else
+                    results = redis.call('sort', final_key, unpack(ARGV, 4))
+                end
+
+                local to_delete = {}
+                if final_key == dest_key then
+                    to_delete[1] = dest_key
+                end
+                for i = nb_sets - nb_tmp_sets + 2, #KEYS do
+                    to_delete[#to_delete + 1] = KEYS[i]
+                end
+                if #to_delete > 0 then
+                    redis.call('del', unpack(to_delete))
+                end
+                return results
+            """,
+        },
+        'sort': {
+            # do what the SORT command does, but also supporting the patterns of fields of models
+            # using buckets (``prefix*/<bucket size>->*:field``, see ``RedisModel.bucket_size``)
+            # in ``BY`` and ``GET``
+            # KEYS: the set, sorted set or list to sort
+            # ARGV: the arguments of the SORT command (see ``_get_sort_args``)
+            # return the same as the SORT command
+            'lua': """
+                local key = KEYS[1]
+                local by, start, num, desc, alpha, store = nil, 0, -1, false, false, nil
+                local get = {}
+                local i = 1
+                while i <= #ARGV do
+                    local arg = ARGV[i]
+                    if arg == 'BY' then
+                        by = ARGV[i + 1]
+                        i = i + 2
+                    elseif arg == 'LIMIT' then
+                        start, num = tonumber(ARGV[i + 1]), tonumber(ARGV[i + 2])
+                        i = i + 3
+                    elseif arg == 'GET' then
+                        get[#get + 1] = ARGV[i + 1]
+                        i = i + 2
+                    elseif arg == 'STORE' then
+                        store = ARGV[i + 1]
+                        i = i + 2
+                    else
+                        desc = desc or arg == 'DESC'
+                        alpha = alpha or arg == 'ALPHA'
+                        i = i + 1
+                    end
+                end
+
+                local key_type = redis.call('type', key)['ok']
+                local members
+                if key_type == 'set' then
+                    members = redis.call('smembers', key)
+                elseif key_type == 'zset' then
+                    members = redis.call('zrange', key, 0, -1)
+                elseif key_type == 'list' then
+                    members = redis.call('lrange', key, 0, -1)
+                else
+                    members = {}
+                end
+
+                -- replace the first "*" of the text by the pk
+                local function replace_star(text, pk)
+                    local position = string.find(text, '*', 1, true)
+                    if not position then
+                        return text
+                    end
+                    return string.sub(text, 1, position - 1) .. pk .. string.sub(text, position + 1)
+                end
+
+                local function get_value(pattern, pk)
+                    if pattern == '#' then
+                        return pk
+                    end
+                    local pattern_key, hash_field = pattern, nil
+                    local arrow = string.find(pattern, '->', 1, true)
+                    if arrow then
+                        pattern_key, hash_field = string.sub(pattern, 1, arrow - 1), string.sub(pattern, arrow + 2)
+                    end
+                    if hash_field and string.find(hash_field, '*', 1, true) then
+                        -- field of a model using buckets
+                        local position = string.find(pattern_key, '*/', 1, true)
+                        local bucket_size = tonumber(string.sub(pattern_key, position + 2))
+                        local bucket = string.format('%d', math.floor(tonumber(pk) / bucket_size))
+                        return redis.call('hget', string.sub(pattern_key, 1, position - 1) .. bucket,
+                                          replace_star(hash_field, pk))
+                    elseif hash_field then
+                        return redis.call('hget', replace_star(pattern_key, pk), hash_field)
+                    end
+                    return redis.call('get', replace_star(pattern_key, pk))
+                end
+
+                if by ~= 'nosort' then
+                    local values = {}
+                    for _, pk in ipairs(members) do
+                        local value = pk
+                        if by then
+                            value = get_value(by, pk)
+                        end
+                        if alpha then
+                            value = value or ''
+                        elseif value then
+                            value = tonumber(value)
+                            if not value then
+                                return redis.error_reply("One or more scores can't be converted into double")
+                            end
+                        else
+                            value = 0
+                        end
+                        values[pk] = value
+                    end
+                    -- ties are broken by comparing the pks, to always return the same order
+                    table.sort(members, function(a, b)
+                        local value_a, value_b = values[a], values[b]
+                        if value_a == value_b then
+                            value_a, value_b = a, b
+                        end
+                        if desc then
+                            return value_a > value_b
+                        end
+                        return value_a < value_b
+                    end)
+                end
+
+                local last = #members
+                if num >= 0 then
+                    last = math.min(last, start + num)
+                end
+
+                local results = {}
+                for position = start + 1, last do
+                    local pk = members[position]
+                    if #get == 0 then
+                        results[#results + 1] = pk
+                    end
+                    for _, pattern in ipairs(get) do
+                        local value = get_value(pattern, pk)
+                        if store then
+                            value = value or ''
+                        end
+                        results[#results + 1] = value
+                    end
+                end
+
+                if not store then
+                    return results
+                end
+                redis.call('del', store)
+                for position = 1, #results, 1000 do
+                    redis.call('rpush', store, unpack(results, position, math.min(position + 999, #results)))
+                end
+                return #results
+            """,
+        },
+    }
+
     def __init__(self, model):
         self.model = model
         self._lazy_collection = {  # Store infos to make the requested collection
@@ -407,7 +1215,18 @@ class CollectionManager(object):
             final_set, delete_set_later = self._final_set, self._final_set_deletable
         else:
             self._final_set, self._final_set_deletable = None, False
-            final_set, delete_set_later = self._get_final_set(
+            sets = self._get_filtering_sets() if pk is None and not self._len_mode else None
+            if sets and self._can_fetch_in_one_call(sort_options):
+                all_sets, tmp_keys = self._prepare_sets(sets)
+                if self._can_fetch_keys_in_one_call(all_sets, tmp_keys):
+                    collection = self._fetch_in_one_call(all_sets, tmp_keys, sort_options)
+                    self._collection_cache, self._cache_iterator_function = self._prepare_results(
+                                                        collection, apply_slice=apply_slice)
+                    self._len = len(self._collection_cache)
+                    return
+                final_set, delete_set_later = self._combine_prepared_sets(all_sets, tmp_keys)
+            else:
+                final_set, delete_set_later = self._get_final_set(
                                                 self._lazy_collection['sets'],
                                                 pk, sort_options)
         try:
@@ -451,12 +1270,350 @@ class CollectionManager(object):
 
         conn = self.connection
         if sort_options is not None:
+            sort_index = self._get_sort_index(sort_options)
+            if sort_index is not None and self._can_sort_with_index(final_set, sort_index, sort_options):
+                # use the sorted-set of the index instead of the SORT command
+                return self._sort_with_index(final_set, sort_index, sort_options)
+            if self._must_sort_with_script(sort_options):
+                return self._sort_with_script(final_set, sort_options)
             # a sort, or values, call the SORT command on the set
             return conn.sort(final_set, **sort_options)
         else:
             # no sort, nor values, simply return the full set
             return conn.smembers(final_set)
 
+    def aggregate(self, **aggregates):
+        """
+        Compute the given aggregations on the collection, in redis, and return
+        them in a dict.
+
+        Example:
+        MyModel.collection(foo=1).aggregate(total=Sum('bar'), top=Max('baz'))
+        => {'total': 12.0, 'top': 5.0}
+
+        Parameters
+        ----------
+        aggregates : Dict[str, Aggregate]
+            The aggregations to compute (``Count``, ``Sum``, ``Avg``, ``Min`` or
+            ``Max``), with the names to use in the result.
+
+        Returns
+        -------
+        dict
+            The result of each aggregation: a float, or ``None`` if there is no
+            numeric values, except for ``Count`` that returns an integer.
+
+        """
+        names = list(aggregates)
+        args = []
+        for name in names:
+            if not isinstance(aggregates[name], Aggregate):
+                raise ValueError('%s is not a valid aggregation' % (aggregates[name], ))
+            args.extend(aggregates[name].get_script_args(self.model))
+
+        final_set, delete_set_later = self._get_final_set_to_compute()
+        if final_set is None:
+            results = [None] * len(names)
+        else:
+            try:
+                results = self.model.database.call_script(
+                    # be sure to use the script dict at the class level
+                    # to avoid registering it many times
+                    script_dict=self.__class__.scripts['aggregate'],
+                    keys=[final_set],
+                    args=[int(final_set == self.model.get_field('pk').collection_key), len(names)] + args,
+                )
+            finally:
+                if delete_set_later:
+                    self.connection.delete(final_set)
+
+        return {name: aggregates[name].prepare_result(result) for name, result in zip(names, results)}
+
+    def facet_counts(self, *field_names):
+        """
+        Return, for each given field, the number of entries of the collection
+        for each value of the field.
+
+        Example:
+        MyModel.collection(foo=1).facet_counts('bar')
+        => {'bar': {'a': 10, 'b': 2}}
+
+        Parameters
+        ----------
+        field_names : str
+            The names of the fields to count values for. Each field must have an
+            ``EqualIndex``.
+
+        Returns
+        -------
+        Dict[str, Dict[str, int]]
+            For each field, the number of entries for each value (normalized, as
+            stored in the index), only for values having at least one entry.
+
+        """
+        indexes = [(field_name, self._get_facet_index(field_name)) for field_name in field_names]
+
+        counts = {field_name: {} for field_name in field_names}
+
+        final_set, delete_set_later = self._get_final_set_to_compute()
+        if final_set is None:
+            return counts
+
+        try:
+            is_collection_key = final_set == self.model.get_field('pk').collection_key
+
+            values_keys = []
+            for field_name, index in indexes:
+                if is_collection_key and index.registry:
+                    # no filters: the registry already has the counts
+                    counts[field_name] = index.get_values_counts()
+                else:
+                    values_keys.extend(
+                        (field_name, value, key) for value, key in sorted(index.get_all_values_keys().items())
+                    )
+
+            if not values_keys:
+                return counts
+
+            results = self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['facet_counts'],
+                keys=[final_set] + [key for __, __, key in values_keys],
+                args=[int(is_collection_key)],
+            )
+        finally:
+            if delete_set_later:
+                self.connection.delete(final_set)
+
+        for (field_name, value, __), count in zip(values_keys, results):
+            if count:
+                counts[field_name][value] = count
+        return counts
+
+    def distinct(self, field_name):
+        """
+        Return the distinct values of the given field for the entries of the collection.
+
+        Example:
+        MyModel.collection(foo=1).distinct('bar')
+        => ['a', 'b']
+
+        Parameters
+        ----------
+        field_name : str
+            The name of the field to get the values for. The field must have an
+            ``EqualIndex``. If it uses a ``registry``, and the collection is not
+            filtered, the values are read from the registry in one call.
+
+        Returns
+        -------
+        List[str]
+            The sorted values (normalized, as stored in the index) having at least one
+            entry in the collection.
+
+        """
+        return sorted(self.facet_counts(field_name)[field_name])
+
+    def _get_facet_index(self, field_name):
+        """Return the index to use to count the values of the given field in ``facet_counts``
+
+        Raises
+        ------
+        ImplementationError
+            If the field has many parts (like a ``HashField``), or has no ``EqualIndex``
+            using sets and indexing all the instances (partial indexes, using ``only_if``,
+            cannot be used)
+
+        """
+        field = self.model.get_field(field_name)
+        if field._field_parts == 1:
+            for index in field._indexes:
+                if (isinstance(index, EqualIndex) and index.filter_single_field
+                        and index.supported_key_types == {'set'} and not index.only_if):
+                    return index
+        raise ImplementationError(
+            'No index found to count values of field %s.%s' % (field._model.__name__, field.name)
+        )
+
+    def _get_final_set_to_compute(self):
+        """Return the final set of pks to compute aggregations or facets, and if it must be deleted after"""
+        try:
+            pk = self._get_pk()
+        except ValueError:
+            return None, False
+        if pk is not None and not self.model.get_field('pk').exists(pk):
+            return None, False
+        if pk is not None and not self._get_filtering_sets():
+            # only a pk, we need a set with it
+            tmp_key = self._unique_key('tmp')
+            self.connection.sadd(tmp_key, pk)
+            return tmp_key, True
+        return self._get_final_set(self._lazy_collection['sets'], pk, None)
+
+    def _can_fetch_in_one_call(self, sort_options):
+        """Tell if the filtered collection can be fetched with the ``fetch`` lua script,
+        ie if a sort index is not used"""
+        if not self.FETCH_IN_ONE_CALL:
+            return False
+        if sort_options is not None and self._must_sort_with_script(sort_options):
+            return False
+        return sort_options is None or self._get_sort_index(sort_options) is None
+
+    def _can_fetch_keys_in_one_call(self, keys, tmp_keys):
+        """Tell if the ``fetch`` lua script is useful for the keys returned by ``_prepare_sets``
+
+        If there is only one key, and not a temporary one, only one command is needed without
+        the script.
+
+        """
+        return len(keys) > 1 or bool(keys and tmp_keys)
+
+    def _fetch_in_one_call(self, keys, tmp_keys, sort_options):
+        """Fetch the collection with only one call to redis (not counting the calls
+        done by indexes to get their filter keys)
+
+        The intersection of the filter sets, the final ``SMEMBERS`` or ``SORT`` command
+        and the deletion of the temporary keys are done by the ``fetch`` lua script.
+
+        Parameters
+        ----------
+        keys : set
+            The keys of the sets to intersect, as returned by ``_prepare_sets``
+        tmp_keys : set
+            The temporary keys to delete, as returned by ``_prepare_sets``
+        sort_options : Optional[dict]
+            The options to pass to the ``SORT`` command, if any
+
+        Returns
+        -------
+        Union[list, int]
+            The result of the final command
+
+        """
+        # the temporary keys to intersect are at the end, to be deleted with the other ones
+        sets = sorted(keys - tmp_keys) + sorted(keys & tmp_keys)
+        other_tmp_keys = sorted(tmp_keys - keys)
+        args = [len(sets), len(keys & tmp_keys)]
+        args.extend(['smembers'] if sort_options is None else ['sort'] + self._get_sort_args(sort_options))
+
+        while True:
+            # the script checks the existence of this key, so we don't need to do it here
+            dest_key = self._unique_key('final', check_exists=False)
+            result = self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['fetch'],
+                keys=[dest_key] + sets + other_tmp_keys,
+                args=args,
+            )
+            if result is not None:
+                return result
+
+    @staticmethod
+    def _get_sort_args(sort_options):
+        """Return the arguments for the ``SORT`` command for the given sort options,
+        as expected by the ``sort`` method of redis-py"""
+        args = []
+        if sort_options.get('by') is not None:
+            args.extend(['BY', sort_options['by']])
+        if sort_options.get('start') is not None and sort_options.get('num') is not None:
+            args.extend(['LIMIT', sort_options['start'], sort_options['num']])
+        get = sort_options.get('get')
+        if get is not None:
+            for pattern in ([get] if isinstance(get, str) else get):
+                args.extend(['GET', pattern])
+        if sort_options.get('desc'):
+            args.append('DESC')
+        if sort_options.get('alpha'):
+            args.append('ALPHA')
+        if sort_options.get('store') is not None:
+            args.extend(['STORE', sort_options['store']])
+        return args
+
+    @staticmethod
+    def _must_sort_with_script(sort_options):
+        """Tell if the ``sort`` lua script must be used instead of the ``SORT`` command, ie if
+        a pattern in ``by`` or ``get`` is one of a field of a model using buckets, that cannot
+        be used by ``SORT``"""
+        get = sort_options.get('get') or []
+        patterns = [get] if isinstance(get, str) else list(get)
+        if sort_options.get('by'):
+            patterns.append(sort_options['by'])
+        return any(is_bucket_pattern(pattern) for pattern in patterns)
+
+    def _sort_with_script(self, final_set, sort_options):
+        """Do the same as the ``SORT`` command with the given sort options, with the ``sort``
+        lua script, supporting patterns of fields of models using buckets"""
+        return self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.scripts['sort'],
+            keys=[final_set],
+            args=self._get_sort_args(sort_options),
+        )
+
+    def _can_use_sort_index(self, sort_options):
+        """Tell if a sort index can replace a ``SORT`` call with the given sort options"""
+        return not sort_options.get('get') and not sort_options.get('store')
+
+    def _get_sort_index(self, sort_options):
+        """Return the index to use to sort the collection instead of the ``SORT`` command
+
+        Parameters
+        ----------
+        sort_options : dict
+            The options that would be passed to the ``SORT`` command
+
+        Returns
+        -------
+        Union[BaseIndex, None]
+            The first index of the field used to sort the collection, having ``use_for_sort``
+            and ordering its sorted-set the way the collection is sorted (``alpha`` or not), or
+            ``None`` if there is no such index, or if it cannot be used.
+
+        """
+        if not sort_options.get('by') or not self._can_use_sort_index(sort_options):
+            return None
+        field = self._get_sort_field()
+        if field is None or field.sort_wildcard != sort_options['by']:
+            return None
+        ordering = 'lex' if sort_options.get('alpha') else 'score'
+        for index in field._indexes:
+            if index.use_for_sort and index.ordering == ordering:
+                return index
+        return None
+
+    def _can_sort_with_index(self, final_set, index, sort_options):
+        """Tell if the sort index can be used to sort the final set instead of the ``SORT`` command
+
+        To sort in ascending order with a ``lex`` sorted-set, the entries of the final set not
+        in the index come first, so to know how many they are, the whole index would have to be
+        read, except if the final set is the whole collection. In this case the ``SORT``
+        command, depending only on the size of the final set, is used.
+
+        """
+        if index.ordering != 'lex' or sort_options.get('desc'):
+            return True
+        return final_set == self.model.get_field('pk').collection_key
+
+    def _sort_with_index(self, final_set, index, sort_options):
+        """Return the slice of the final set asked in ``sort_options``, sorted with the index
+
+        It's done in a lua script, see the ``sort_by_index`` script for details.
+
+        """
+        tmp_key = self._unique_key('tmp')
+        pks = self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.scripts['sort_by_index'],
+            keys=[final_set, index.get_ordering_key(), tmp_key, make_key(tmp_key, 'set')],
+            args=[index.ordering, int(bool(sort_options.get('desc'))), sort_options.get('start', 0),
+                  sort_options.get('num', -1), getattr(index, 'separator', '')]
+        )
+        return self._get_raw_results_for_pks(pks)
+
     def _collection_length(self, final_set):
         """
         Return the length of the final collection, directly asking redis for the
@@ -468,6 +1625,335 @@ class CollectionManager(object):
         meth = self.model.lazy_connect if self._lazy_instances else self.model
         return meth(pk)
 
+    def _to_instances(self, pks):
+        """Return instances for the given pks, with only one redis call for all existence checks
+
+        Parameters
+        ----------
+        pks : List[str]
+            The primary keys of the instances to return
+
+        Returns
+        -------
+        List[RedisModel]
+            The instances, without the ones that do not exist (except for lazy instances, for which
+            existence is not checked)
+
+        """
+        if not self._lazy_instances and pks:
+            collection_key = self.model.get_field('pk').collection_key
+            with self.connection.pipeline(transaction=False) as pipe:
+                for pk in pks:
+                    pipe.sismember(collection_key, pk)
+                existing = pipe.execute()
+            pks = [pk for pk, pk_exists in zip(pks, existing) if pk_exists]
+
+        instances = []
+        for pk in pks:
+            instance = self.model.lazy_connect(pk)
+            instance._connected = not self._lazy_instances
+            instances.append(instance)
+        return instances
+
+    def iterator(self, chunk_size=None):
+        """Iterate on the collection, retrieving entries from redis chunk by chunk
+
+        The final set is computed only once, and kept alive during the whole iteration. Entries
+        are then retrieved by chunks of ``chunk_size`` (via ``SORT`` with ``LIMIT`` if the
+        collection is sorted, or ``SSCAN`` if not), and the final set, if temporary, is deleted
+        at the end. Nothing is cached, so the memory used does not depend on the size of the
+        collection.
+
+        Parameters
+        ----------
+        chunk_size : int
+            The number of entries to retrieve from redis at once. Default to ``ITERATOR_CHUNK_SIZE``
+
+        Returns
+        -------
+        Iterator
+            An iterator on the entries of the collection (pks, instances...)
+
+        Raises
+        ------
+        ValueError
+            If ``chunk_size`` is not a positive number
+
+        """
+        if chunk_size is None:
+            chunk_size = self.ITERATOR_CHUNK_SIZE
+        if chunk_size < 1:
+            raise ValueError('The chunk size of an iterator must be a positive number')
+        collection = self.clone()
+        collection._len_mode = False
+        collection._sort_limits = None
+        return collection._iterate_by_chunks(chunk_size)
+
+    def _iterate_by_chunks(self, chunk_size):
+        """Generator used by ``iterator`` to yield entries of the collection
+
+        Parameters
+        ----------
+        chunk_size : int
+            The number of entries to retrieve from redis at once.
+
+        Yields
+        ------
+        Any
+            The entries of the collection (pks, instances...)
+
+        """
+        try:
+            pk = self._get_pk()
+        except ValueError:
+            return
+        if pk is not None and not self.model.get_field('pk').exists(pk):
+            return
+
+        final_set, delete_set_later = self._get_final_set(
+            self._lazy_collection['sets'], pk, self._prepare_sort_options(bool(pk)))
+
+        if final_set is None:
+            if pk and not self._lazy_collection['sets']:
+                # we have a pk without other sets
+                for entry in self._prepare_chunk([pk]):
+                    yield entry
+            return
+
+        try:
+            for chunk in self._iter_final_set_chunks(final_set, bool(pk), chunk_size):
+                if delete_set_later:
+                    # keep the final set alive while we work on it
+                    self.connection.expire(final_set, self.FINAL_SET_TTL)
+                for entry in self._prepare_chunk(chunk):
+                    yield entry
+        finally:
+            if delete_set_later:
+                self.connection.delete(final_set)
+
+    def _must_sort_chunks(self, has_pk):
+        """Tell if ``_iter_final_set_chunks`` has to use the redis ``SORT`` command"""
+        return not has_pk and self._sort is not None and self._sort.get('by') != 'nosort'
+
+    def _iter_final_set_chunks(self, final_set, has_pk, chunk_size):
+        """Yield the raw results from redis for the given final set, chunk by chunk
+
+        Parameters
+        ----------
+        final_set : str
+            The key of the redis set holding the primary keys of the collection
+        has_pk : bool
+            If the collection is filtered on a primary key
+        chunk_size : int
+            The number of entries to retrieve from redis at once.
+
+        Yields
+        ------
+        List
+            The raw results from redis for each chunk
+
+        """
+        if not self._must_sort_chunks(has_pk):
+            for chunk in self._iter_unsorted_chunks(final_set, chunk_size):
+                yield chunk
+            return
+
+        start = 0
+        while True:
+            self._sort_limits = {'start': start, 'num': chunk_size}
+            sort_options = self._prepare_sort_options(has_pk)
+            chunk = list(self._final_redis_call(final_set, sort_options))
+            if chunk:
+                yield chunk
+            # the ``get`` option of ``SORT`` returns many values for each entry
+            if len(chunk) < chunk_size * len(sort_options.get('get') or [None]):
+                break
+            start += chunk_size
+
+    def _iter_unsorted_chunks(self, final_set, chunk_size):
+        """Yield chunks of primary keys from the given final set, using ``SSCAN``"""
+        cursor = None
+        while cursor != 0:
+            cursor, pks = self.connection.sscan(final_set, cursor or 0, count=chunk_size)
+            if pks:
+                yield pks
+
+    def _prepare_chunk(self, chunk):
+        """Convert a chunk of raw results from redis into entries to return from ``iterator``"""
+        results, iterator_function = self._prepare_results(chunk)
+        if self._instances:
+            return self._to_instances(results)
+        if iterator_function is not None:
+            return [iterator_function(result) for result in results]
+        return results
+
+    def _get_raw_results_for_pks(self, pks):
+        """Return the raw results, as returned by redis for the collection, for the given pks"""
+        return pks
+
+    def after(self, cursor=None, limit=50):
+        """Return a page of the sorted collection, starting after the given cursor
+
+        Contrary to slicing, the whole collection is not sorted for each page: the sorted-set
+        of an index on the field used in ``sort(by=...)`` (``NumberRangeIndex``, or, with
+        ``alpha=True``, a compact ``TextRangeIndex``) is read from the cursor, and only entries
+        matching the filters are kept, until we have ``limit`` of them. It's done in one lua
+        script on the redis side.
+
+        Parameters
+        ----------
+        cursor : str
+            ``None`` to get the first page, else the ``cursor`` returned with the previous page.
+        limit : int
+            The maximum number of entries in the page.
+
+        Returns
+        -------
+        CollectionPage
+            A named tuple with two entries: ``results``, the list of entries of the page (pks,
+            instances...) and ``cursor``, an opaque string to pass to ``after`` to get the next
+            page, or ``None`` if there is no next page.
+
+        Raises
+        ------
+        ValueError
+            If the collection is not sorted, if ``limit`` is not a positive number or if
+            ``cursor`` is not valid.
+        ImplementationError
+            If no index with a sorted-set can be used to order the collection.
+
+        Notes
+        -----
+        Instances without value for the sort field are not in the sorted-set, so they are not
+        returned.
+
+        """
+        if limit < 1:
+            raise ValueError('The limit of a page must be a positive number')
+
+        order_key, ordering, separator, desc, used_filter = self._get_ordering_source()
+
+        cursor_member, cursor_score = self._decode_cursor(cursor) if cursor else ('', '')
+
+        try:
+            pk = self._get_pk()
+        except ValueError:
+            return CollectionPage([], None)
+
+        conn = self.connection
+        sets = [set_ for set_ in self._get_filtering_sets() if set_ is not used_filter]
+        filter_keys, tmp_keys = self._prepare_filtering_keys(sets)
+        try:
+            if pk is not None:
+                tmp_key = self._unique_key('tmp')
+                conn.sadd(tmp_key, pk)
+                filter_keys.add(tmp_key)
+                tmp_keys.add(tmp_key)
+
+            result = self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['page_after'],
+                keys=[order_key] + list(filter_keys),
+                args=[ordering, int(bool(desc)), limit, self.AFTER_BLOCK_SIZE,
+                      int(bool(cursor)), cursor_member, cursor_score, separator or '']
+            )
+        finally:
+            if tmp_keys:
+                conn.delete(*tmp_keys)
+
+        has_more, last_member, last_score, pks = result[0], result[1], result[2], result[3:]
+        return CollectionPage(
+            self._prepare_chunk(self._get_raw_results_for_pks(pks)),
+            self._encode_cursor(last_member, last_score) if has_more else None
+        )
+
+    def _get_sort_field(self):
+        """Return the field used to sort the collection, or ``None``"""
+        by = self._sort.get('by') if self._sort else None
+        if not by:
+            return None
+        for field in self.model.get_fields():
+            if isinstance(field, SingleValueField) and field.sort_wildcard == by:
+                return field
+        return None
+
+    def _get_ordering_source(self):
+        """Get the sorted-set to use to order the collection in ``after``
+
+        Returns
+        -------
+        tuple
+            Five entries:
+            - the key of the sorted-set
+            - its ordering: ``'score'`` or ``'lex'``
+            - the separator between the value and the pk in a ``'lex'`` sorted-set
+            - if the order must be reversed
+            - a filter from the collection already applied by using this sorted-set, or ``None``
+
+        Raises
+        ------
+        ValueError
+            If the collection is not sorted by a field
+        ImplementationError
+            If the field used to sort the collection has no index with a sorted-set ordered
+            the same way as the collection: by score if not ``alpha``, else lexicographically
+            with a single character between values and pks (like ``TextRangeIndex`` with
+            ``compact=True`` or ``SortIndex`` with ``alpha=True``), so that a value is before
+            the longer ones starting with it. The index must not use ``transform``, nor be
+            partial (with ``only_if``: it does not have all the instances).
+
+        """
+        field = self._get_sort_field()
+        if field is None:
+            raise ValueError('The collection must be sorted by a field to use `after`')
+
+        ordering = 'lex' if self._sort.get('alpha') else 'score'
+        for index in field._indexes:
+            if index.ordering != ordering or index.transform or index.only_if:
+                continue
+            separator = getattr(index, 'separator', None)
+            if ordering == 'lex' and len(separator) != 1:
+                continue
+            return index.get_ordering_key(), ordering, separator, self._sort.get('desc', False), None
+
+        raise ImplementationError(
+            'No index with a sorted-set found to order by the field %s.%s%s' % (
+                field._model.__name__, field.name, ' lexicographically' if ordering == 'lex' else ''
+            )
+        )
+
+    def _get_filtering_sets(self):
+        """Return the "sets" to filter the collection, as expected by ``_prepare_sets``"""
+        return list(self._lazy_collection['sets'])
+
+    def _prepare_filtering_keys(self, sets):
+        """Return the keys and the temporary ones for the given sets, to check members in ``after``"""
+        if not sets:
+            return set(), set()
+        return self._prepare_sets(sets)
+
+    @staticmethod
+    def _encode_cursor(member, score):
+        """Return an opaque cursor for the given member and score of an ordering sorted-set"""
+        return urlsafe_b64encode(json.dumps([member, score]).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        """Return the member and score of an ordering sorted-set saved in the given cursor
+
+        Raises
+        ------
+        ValueError
+            If the cursor is not valid
+
+        """
+        try:
+            member, score = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (AttributeError, TypeError, ValueError, UnicodeError):
+            raise ValueError('Invalid cursor: %s' % cursor)
+        return member, score
+
     def _prepare_results(self, results, _len_hint=None, apply_slice=None):
         """
         Called in _collection to prepare results from redis before returning
@@ -521,6 +2007,7 @@ class CollectionManager(object):
 
         final_sets = set()
         tmp_keys = set()
+        excluded_sets = []
 
         for set_ in self._reduce_related_filters(sets):
             if isinstance(set_, str):
@@ -530,11 +2017,177 @@ class CollectionManager(object):
                     final_sets.add(index_key)
                     if is_tmp:
                         tmp_keys.add(index_key)
+            elif isinstance(set_, ParsedQ):
+                q_key = self._get_set_for_parsed_q(set_, tmp_keys)
+                if set_.negated:
+                    excluded_sets.append(q_key)
+                else:
+                    final_sets.add(q_key)
             else:
                 raise ValueError('Invalid filter type')
 
+        if excluded_sets:
+            self._exclude_sets(final_sets, final_sets, excluded_sets, tmp_keys)
+
         return final_sets, tmp_keys
 
+    def _exclude_sets(self, final_sets, candidates, excluded_sets, tmp_keys):
+        """Remove the members of the excluded sets from the final intersection
+
+        As the final sets will be intersected, we only need to remove the
+        excluded members from one of them.
+
+        Parameters
+        ----------
+        final_sets : set
+            The keys of the sets that will be intersected, updated in place
+        candidates : Iterable[str]
+            The keys in `final_sets` that are real sets, from which one will be
+            replaced by a new set without the excluded members. If empty, a new set
+            with all the collection without the excluded members will be added.
+        excluded_sets : List[str]
+            The keys of the sets with the members to exclude
+        tmp_keys : set
+            The temporary keys, updated in place
+
+        """
+        candidates = sorted(candidates)
+        if candidates:
+            base_key = candidates[0]
+            final_sets.discard(base_key)
+        else:
+            base_key = self.model.get_field('pk').collection_key
+        final_sets.add(self._store_sets_operation('sdiffstore', [base_key] + excluded_sets, tmp_keys))
+
+    def _store_sets_operation(self, command, keys, tmp_keys):
+        """Store in a new temporary key the result of a set command on the given keys
+
+        Parameters
+        ----------
+        command : str
+            The set command to use: ``sinterstore``, ``sunionstore`` or ``sdiffstore``
+        keys : List[str]
+            The keys of the sets to use
+        tmp_keys : set
+            The temporary keys, updated in place with the new one
+
+        Returns
+        -------
+        str
+            The new temporary key
+
+        """
+        tmp_key = self._unique_key('tmp')
+        getattr(self.connection, command)(tmp_key, keys)
+        tmp_keys.add(tmp_key)
+        return tmp_key
+
+    def _prepare_q_filters(self, parsed_filters):
+        """Prepare the filters of a ``Q`` to be and-ed together. See ``_reduce_related_filters``"""
+        return self._reduce_related_filters(parsed_filters)
+
+    def _get_parsed_filter_set_keys(self, parsed_filter, tmp_keys):
+        """Return the keys of the redis sets to intersect to apply the given filter
+
+        Parameters
+        ----------
+        parsed_filter : ParsedFilter
+            The filter for which we want the keys
+        tmp_keys : set
+            The temporary keys, updated in place
+
+        Returns
+        -------
+        List[str]
+            The keys of the sets
+
+        """
+        keys = []
+        for index_key, key_type, is_tmp in self._prepare_parsed_filter(parsed_filter):
+            keys.append(index_key)
+            if is_tmp:
+                tmp_keys.add(index_key)
+        return keys
+
+    def _resolve_pk_filter_value(self, value):
+        """Return the pk to use for a filter on the pk with the given value"""
+        return self.model.get_field('pk').normalize(value)
+
+    def _get_set_for_parsed_q(self, parsed_q, tmp_keys):
+        """Compute in redis the set of pks matching the given ``Q``, without its negation
+
+        Each node of the ``Q`` is computed in a temporary set, using ``SINTERSTORE``,
+        ``SUNIONSTORE`` and ``SDIFFSTORE``, so no data leaves redis.
+
+        Parameters
+        ----------
+        parsed_q : ParsedQ
+            The ``Q`` to compute, as parsed by ``_parse_q``
+        tmp_keys : set
+            The temporary keys, updated in place
+
+        Returns
+        -------
+        str
+            The key of the set holding the matching pks. It may be a key of an
+            index, so it must not be altered.
+
+        """
+        is_and = parsed_q.connector == Q.AND
+        positive_keys = []
+        negative_keys = []
+
+        def add_key(key, negated=False):
+            if not negated:
+                positive_keys.append(key)
+            elif is_and:
+                negative_keys.append(key)
+            else:
+                # a "not" in a "or": we need all the pks not in this set
+                positive_keys.append(self._store_sets_operation(
+                    'sdiffstore', [self.model.get_field('pk').collection_key, key], tmp_keys))
+
+        if is_and:
+            # filters of a "and" can be handled together by a multi-fields index
+            groups_of_filters = [self._prepare_q_filters(parsed_q.filters)]
+        else:
+            groups_of_filters = [self._prepare_q_filters([parsed_filter]) for parsed_filter in parsed_q.filters]
+
+        for parsed_filters in groups_of_filters:
+            for parsed_filter in parsed_filters:
+                keys = self._get_parsed_filter_set_keys(parsed_filter, tmp_keys)
+                add_key(keys[0] if len(keys) == 1 else self._store_sets_operation('sinterstore', keys, tmp_keys))
+
+        if parsed_q.pks:
+            pks = set(self._resolve_pk_filter_value(pk) for pk in parsed_q.pks)
+            pk_field = self.model.get_field('pk')
+            tmp_key = self._unique_key('tmp')
+            tmp_keys.add(tmp_key)
+            if not is_and or len(pks) == 1:
+                pks = [pk for pk in pks if pk_field.exists(pk)]
+                if pks:
+                    self.connection.sadd(tmp_key, *pks)
+            # else: many pks "and"-ed, nothing can match: we use the empty tmp key
+            add_key(tmp_key)
+
+        for child in parsed_q.children:
+            add_key(self._get_set_for_parsed_q(child, tmp_keys), child.negated)
+
+        if not is_and:
+            if len(positive_keys) == 1:
+                return positive_keys[0]
+            return self._store_sets_operation('sunionstore', positive_keys, tmp_keys)
+
+        if not positive_keys:
+            positive_keys.append(self.model.get_field('pk').collection_key)
+        if len(positive_keys) == 1:
+            base_key = positive_keys[0]
+        else:
+            base_key = self._store_sets_operation('sinterstore', positive_keys, tmp_keys)
+        if negative_keys:
+            return self._store_sets_operation('sdiffstore', [base_key] + negative_keys, tmp_keys)
+        return base_key
+
     def _reduce_related_filters(self, sets):
         """Try to replace single fields filters by multi-fields ones
 
@@ -653,6 +2306,16 @@ class CollectionManager(object):
             # no sets or pk, use the whole collection instead
             all_sets.add(self.model.get_field('pk').collection_key)
 
+        return self._combine_prepared_sets(all_sets, tmp_keys)
+
+    def _combine_prepared_sets(self, all_sets, tmp_keys):
+        """
+        Combine the given sets to get the final set to work on, and delete the
+        temporary keys. Return the name of this set (or None if no sets), and if
+        it must be deleted once the collection is really called.
+        """
+        conn = self.connection
+
         if not all_sets:
             delete_set_later = False
             final_set = None
@@ -686,8 +2349,15 @@ class CollectionManager(object):
         self.connection.sinterstore(final_set, list(sets))
         return final_set
 
-    def __call__(self, **filters):
-        return self.clone()._add_filters(**filters)
+    def __call__(self, *q_filters, **filters):
+        return self.clone()._add_filters(*q_filters, **filters)
+
+    def exclude(self, *q_filters, **filters):
+        """
+        Exclude from the collection the entries matching the given filters
+        (and-ed together).
+        """
+        return self.clone()._add_filters(~Q(*q_filters, **filters))
 
     def _field_is_pk(self, field_name):
         """Check if the given name is the pk field, suffixed or not with "__eq" """
@@ -697,12 +2367,19 @@ class CollectionManager(object):
             return True
         return False
 
+    def _field_is_pk_in(self, field_name):
+        """Check if the given name is the pk field, suffixed with "__in" """
+        return field_name.endswith('__in') and self.model._field_is_pk(field_name[:-4])
+
     def _parse_filter_key(self, key):
         # Each key can have optional subpath
         # We pass it as args to the field, which is responsable
         # from handling them
         # We only manage here the suffix handled by a filter
 
+        if self._field_is_pk_in(key):
+            return PkInFilter(self.model), 'in', []
+
         key_path = key.split('__')
         field_name = key_path.pop(0)
         field = self.model.get_field(field_name)
@@ -746,8 +2423,29 @@ class CollectionManager(object):
 
         return index_to_use, index_suffix, other_field_parts
 
-    def _add_filters(self, **filters):
+    def _parse_q(self, q_filter):
+        """Parse the filters of the given ``Q``, and its children, in a ``ParsedQ``"""
+        parsed_filters, pks, children = [], [], []
+        for child in q_filter.children:
+            if isinstance(child, Q):
+                children.append(self._parse_q(child))
+                continue
+            key, value = child
+            if self._field_is_pk(key):
+                pks.append(value)
+            else:
+                index, suffix, extra_field_parts = self._parse_filter_key(key)
+                parsed_filters.append(ParsedFilter(index, suffix, extra_field_parts, value, None))
+        return ParsedQ(q_filter.connector, q_filter.negated, parsed_filters, pks, children)
+
+    def _add_filters(self, *q_filters, **filters):
         """Define self._lazy_collection according to filters."""
+        for q_filter in q_filters:
+            if not isinstance(q_filter, Q):
+                raise ValueError('Only `Q` objects can be passed as positional filters, not %s' % (q_filter, ))
+            # store the parsed expression, it will be computed in ``_prepare_sets``
+            self._lazy_collection['sets'].append(self._parse_q(q_filter))
+
         for key, value in filters.items():
             if self._field_is_pk(key):
                 pk = self.model.get_field('pk').normalize(value)
@@ -800,11 +2498,11 @@ class CollectionManager(object):
         """
         Return a list of the names of all fields that handle simple values
         (StringField or InstanceHashField), that redis can use to return values via
-        the sort command
+        the sort command (so not BytesField, as values are decoded)
         """
         return [
             field.name for field in self.model.get_fields()
-            if isinstance(field, SingleValueField)
+            if isinstance(field, SingleValueField) and not isinstance(field, BytesField)
         ]
 
     def primary_keys(self):
@@ -854,14 +2552,99 @@ class CollectionManager(object):
     def sort(self, **parameters):
         return self.clone()._apply_sort(**parameters)
 
-    def _unique_key(self, prefix=None):
+    def _unique_key(self, prefix=None, check_exists=True):
         """
         Create a unique key.
+        If `check_exists` is False, the existence of the key is not checked in
+        redis, it must be done by the caller.
         """
         prefix_parts = [self.model._name, '__collection__']
         if prefix:
             prefix_parts.append(prefix)
         return unique_key(
-            self.connection,
+            self.connection if check_exists else None,
             prefix=make_key(*prefix_parts)
         )
+
+
+class PreparedCollection(object):
+    """
+    A collection with filters parsed only once, to be executed many times with
+    different values.
+
+    API:
+    prepared = MyModel.prepare_collection('foo', 'bar__in', sort='-baz')
+    prepared.execute(foo=1, bar__in=[2, 3]) => return a new collection, as
+        MyModel.collection(foo=1, bar__in=[2, 3]).sort(by='-baz')
+
+    The fields, indexes and suffixes to use for the filters are resolved when
+    preparing the collection, as well as the sort options, so executing it
+    only has to create a new collection with the values.
+    """
+
+    def __init__(self, model, filter_keys, manager=None, sort=None):
+        """
+        Parameters
+        ----------
+        model : Type[RedisModel]
+            The model on which the collection will be executed
+        filter_keys : Iterable[str]
+            The filters, as passed to ``collection``, but without values
+        manager : Optional[Type[CollectionManager]]
+            The collection manager to use. Default to the one of the model
+        sort : Union[str, dict, None]
+            If set, the collection will be sorted by this field (prefixed by
+            ``-`` for a desc sort), or with these parameters if it is a dict,
+            as for the ``sort`` method of the collection
+
+        Raises
+        ------
+        ImplementationError
+            If a filter cannot be handled by an index of its field
+        ValueError
+            If a filter key is given many times
+
+        """
+        self.model = model
+        self.filter_keys = tuple(filter_keys)
+        if len(set(self.filter_keys)) != len(self.filter_keys):
+            raise ValueError('A filter cannot be prepared many times')
+
+        # the collection that will be cloned for each execution, with the sort options
+        self._collection = (manager or model.collection_manager)(model)
+        if sort is not None:
+            self._collection = self._collection.sort(**(sort if isinstance(sort, dict) else {'by': sort}))
+
+        self._pk_keys = set()
+        self._parsed_keys = {}
+        for key in self.filter_keys:
+            if self._collection._field_is_pk(key):
+                self._pk_keys.add(key)
+            else:
+                self._parsed_keys[key] = self._collection._parse_filter_key(key)
+
+    def execute(self, **values):
+        """
+        Return a new collection, filtered with the given values for the prepared
+        filters.
+
+        Raises
+        ------
+        ValueError
+            If the values do not match the prepared filters
+
+        """
+        if len(values) != len(self.filter_keys) or not all(key in values for key in self.filter_keys):
+            raise ValueError('Values must be given for exactly these filters: %s' % ', '.join(self.filter_keys))
+
+        collection = self._collection.clone()
+        for key, (index, suffix, extra_field_parts) in self._parsed_keys.items():
+            collection._lazy_collection['sets'].append(
+                ParsedFilter(index, suffix, extra_field_parts, values[key], None)
+            )
+        if self._pk_keys:
+            collection._add_filters(**{key: values[key] for key in self._pk_keys})
+        return collection
+
+    def __repr__(self):
+        return '<%s %s(%s)>' % (self.__class__.__name__, self.model.__name__, ', '.join(self.filter_keys))
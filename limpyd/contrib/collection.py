@@ -4,17 +4,15 @@ from future.builtins import str
 from future.builtins import zip
 from future.builtins import object
 
-from itertools import islice, chain
 from collections import namedtuple
 from copy import copy, deepcopy
 
 from limpyd.model import RedisModel
-from limpyd.collection import CollectionManager, ParsedFilter
+from limpyd.collection import CollectionManager, ParsedFilter, ParsedQ
 from limpyd.fields import (SetField, ListField, SortedSetField, MultiValuesField,
-                           RedisField, SingleValueField)
+                           RedisField, SingleValueField, BytesField)
 from limpyd.exceptions import DoesNotExist
-from limpyd.contrib.database import PipelineDatabase
-from limpyd.utils import make_key
+from limpyd.utils import resolve_pattern
 
 SORTED_SCORE = 'sorted_score'
 DEFAULT_STORE_TTL = 60
@@ -22,12 +20,15 @@ DEFAULT_STORE_TTL = 60
 
 RawFilter = namedtuple('RawFilter', ['name', 'value'])
 
+# a sorted set (field or key) passed to ``intersect`` with score bounds and/or a limit
+SortedSetWindow = namedtuple('SortedSetWindow', ['sortedset', 'min', 'max', 'limit'])
+
 
 class ExtendedCollectionManager(CollectionManager):
 
     _accepted_key_types = {'set', 'zset', 'list'}  # Type of keys indexes are allowed to return
 
-    scripts = {
+    scripts = dict(CollectionManager.scripts, **{
         'list_to_set': {
             # add all members of the list in a new set
             'lua': """
@@ -38,7 +39,90 @@ class ExtendedCollectionManager(CollectionManager):
                 return 1
             """,
         },
-    }
+        'zset_to_set': {
+            # add all members of the sorted set in a new set
+            'lua': """
+                redis.call('del', KEYS[2])
+                for i, member in ipairs(redis.call('zrange', KEYS[1], 0, -1)) do
+                    redis.call('sadd', KEYS[2], member)
+                end
+                return 1
+            """,
+        },
+        'scores_to_zset': {
+            # store in a new sorted set all members of the final set (a set, a sorted set or a
+            # list), with their score in the sorted set used to sort, or "-inf" if not in it
+            # return the number of members in the new sorted set
+            'lua': """
+                local final_key, score_key, dest_key = KEYS[1], KEYS[2], KEYS[3]
+                local final_type = redis.call('type', final_key)['ok']
+                local members
+                if final_type == 'none' then
+                    return 0
+                elseif final_type == 'list' then
+                    members = redis.call('lrange', final_key, 0, -1)
+                else
+                    -- use the scores of the sorted set (weight 0 for the final set)
+                    local nb = redis.call('zinterstore', dest_key, 2, final_key, score_key, 'weights', 0, 1)
+                    local total = redis.call(final_type == 'set' and 'scard' or 'zcard', final_key)
+                    if nb == total then
+                        return nb
+                    end
+                    -- some members are not in the sorted set, we'll have to add them
+                    if final_type == 'set' then
+                        members = redis.call('smembers', final_key)
+                    else
+                        members = redis.call('zrange', final_key, 0, -1)
+                    end
+                end
+                for _, member in ipairs(members) do
+                    if not redis.call('zscore', dest_key, member) then
+                        redis.call('zadd', dest_key, redis.call('zscore', score_key, member) or '-inf', member)
+                    end
+                end
+                return redis.call('zcard', dest_key)
+            """,
+        },
+        'sorted_set_window': {
+            # copy in a new sorted set the members of a sorted set with a score between
+            # min and max, limited to `count` members (all if -1) starting at `offset`
+            # use ZRANGESTORE if available (redis 6.2+), else copy them by blocks
+            # return the number of copied members
+            'lua': """
+                local source_key, dest_key = KEYS[1], KEYS[2]
+                local min, max, offset, count = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4])
+                local stored = redis.pcall('zrangestore', dest_key, source_key, min, max,
+                                           'byscore', 'limit', offset, count)
+                if type(stored) == 'number' then
+                    return stored
+                end
+                local block_size, copied = 100, 0
+                while count < 0 or copied < count do
+                    local size = block_size
+                    if count >= 0 then
+                        size = math.min(block_size, count - copied)
+                    end
+                    local members = redis.call('zrangebyscore', source_key, min, max, 'withscores',
+                                               'limit', offset + copied, size)
+                    local nb = #members / 2
+                    if nb == 0 then
+                        break
+                    end
+                    local zadd_args = {}
+                    for i = 1, #members, 2 do
+                        zadd_args[#zadd_args + 1] = members[i + 1]
+                        zadd_args[#zadd_args + 1] = members[i]
+                    end
+                    redis.call('zadd', dest_key, unpack(zadd_args))
+                    copied = copied + nb
+                    if nb < size then
+                        break
+                    end
+                end
+                return copied
+            """,
+        },
+    })
 
     def __init__(self, model):
         super(ExtendedCollectionManager, self).__init__(model)
@@ -54,6 +138,8 @@ class ExtendedCollectionManager(CollectionManager):
 
         self._values = None  # Will store parameters used to retrieve values
 
+        self._slicing_unsorted = None  # Set while slicing, to know if a sort was asked
+
     def clone(self):
         new = super(ExtendedCollectionManager, self).clone()
         new._has_sortedsets = self._has_sortedsets
@@ -77,6 +163,18 @@ class ExtendedCollectionManager(CollectionManager):
             keys=[list_key, set_key]
         )
 
+    def _zset_to_set(self, zset_key, set_key):
+        """
+        Store all members of the given sorted set in a redis set, using lua
+        scripting, as for ``_list_to_set``
+        """
+        self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.scripts['zset_to_set'],
+            keys=[zset_key, set_key]
+        )
+
     def _fetch_collection(self, apply_slice=None):
         """
         Effectively retrieve data according to lazy_collection.
@@ -94,6 +192,33 @@ class ExtendedCollectionManager(CollectionManager):
 
         super(ExtendedCollectionManager, self)._fetch_collection(apply_slice=apply_slice)
 
+    def _getitem(self, arg):
+        """
+        The original `_getitem` may reverse the sort (for negative indexes), so
+        we need to know if a sort was asked, to keep the order of the sorted
+        sets, and we restore the sort parameters once the slice is fetched
+        """
+        sort = copy(self._sort)
+        sort_by_sortedset = copy(self._sort_by_sortedset)
+        self._slicing_unsorted = self._sort is None and not self._sort_by_sortedset
+        try:
+            return super(ExtendedCollectionManager, self)._getitem(arg)
+        finally:
+            self._sort, self._sort_by_sortedset = sort, sort_by_sortedset
+            self._slicing_unsorted = None
+
+    @property
+    def _keep_sortedsets_order(self):
+        """
+        Return True if the final set is a sorted set and no sort was asked, so
+        we want the entries in the order of the sorted set
+        """
+        if not self._has_sortedsets or self._sort_by_sortedset:
+            return False
+        if self._slicing_unsorted is not None:
+            return self._slicing_unsorted
+        return self._sort is None
+
     def _prepare_sets(self, sets):
         """
         The original "_prepare_sets" method simply return the list of sets in
@@ -111,12 +236,15 @@ class ExtendedCollectionManager(CollectionManager):
         all_sets = set()
         tmp_keys = set()
         lists = []
+        plain_sets = set()  # keys of real redis sets, to remove excluded members from
+        excluded_sets = []
 
         def add_key(key, key_type=None, is_tmp=False):
             if not key_type:
                 key_type = conn.type(key)
             if key_type == 'set':
                 all_sets.add(key)
+                plain_sets.add(key)
             elif key_type == 'zset':
                 all_sets.add(key)
                 self._has_sortedsets = True
@@ -134,25 +262,29 @@ class ExtendedCollectionManager(CollectionManager):
             if is_tmp:
                 tmp_keys.add(key)
 
-        prepared_sets = []
-        for set_ in sets:
-            if isinstance(set_, ParsedFilter):
-                # We have a RedisModel and we'll use its pk, or a RedisField
-                # (single value) and we'll use its value
-                if isinstance(set_.value, RedisModel):
-                    set_ = ParsedFilter(set_.index, set_.suffix, set_.extra_field_parts, set_.value.pk.get(), set_.related_filters)
-                elif isinstance(set_.value, SingleValueField):
-                    set_ = ParsedFilter(set_.index, set_.suffix, set_.extra_field_parts, set_.value.proxy_get(), set_.related_filters)
-                elif isinstance(set_.value, RedisField):
-                    raise ValueError(u'Invalid filter value for %s: %s' % (set_.index.field.name, set_.value))
-            prepared_sets.append(set_)
+        prepared_sets = [
+            self._resolve_filter_value(set_) if isinstance(set_, ParsedFilter) else set_
+            for set_ in sets
+        ]
 
         for set_ in self._reduce_related_filters(prepared_sets):
-            if isinstance(set_, str):
+            if isinstance(set_, SortedSetWindow):
+                # copy only the wanted part of the sorted set
+                tmp_key = self._unique_key('tmp')
+                self._sorted_set_window(set_, tmp_key)
+                add_key(tmp_key, 'zset', True)
+            elif isinstance(set_, str):
                 add_key(set_)
             elif isinstance(set_, ParsedFilter):
                 for index_key, key_type, is_tmp in self._prepare_parsed_filter(set_):
                     add_key(index_key, key_type, is_tmp)
+            elif isinstance(set_, ParsedQ):
+                # the key is a set, and its temporary keys are already in `tmp_keys`
+                q_key = self._get_set_for_parsed_q(set_, tmp_keys)
+                if set_.negated:
+                    excluded_sets.append(q_key)
+                else:
+                    add_key(q_key, 'set')
             elif isinstance(set_, SetField):
                 # Use the set key. If we need to intersect, we'll use
                 # sunionstore, and if not, store accepts set
@@ -172,7 +304,7 @@ class ExtendedCollectionManager(CollectionManager):
                 raise ValueError('Invalid filter type')
 
         if lists:
-            if not len(all_sets) and len(lists) == 1:
+            if not len(all_sets) and len(lists) == 1 and not excluded_sets:
                 # only one list, nothing else, we can return the list key
                 all_sets = {lists[0]}
             else:
@@ -183,15 +315,77 @@ class ExtendedCollectionManager(CollectionManager):
                     self._list_to_set(list_key, tmp_key)
                     add_key(tmp_key, 'set', True)
 
+        if excluded_sets:
+            self._exclude_sets(all_sets, plain_sets, excluded_sets, tmp_keys)
+
         return all_sets, tmp_keys
 
-    def filter(self, **filters):
+    def _prepare_q_filters(self, parsed_filters):
+        """
+        Resolve the values of the filters of a ``Q`` (fields and instances) before
+        preparing them
+        """
+        return super(ExtendedCollectionManager, self)._prepare_q_filters(
+            [self._resolve_filter_value(parsed_filter) for parsed_filter in parsed_filters]
+        )
+
+    def _get_parsed_filter_set_keys(self, parsed_filter, tmp_keys):
+        """
+        Indexes may return lists or sorted sets, that we convert to sets to be
+        able to combine them with other sets in a ``Q``
+        """
+        keys = []
+        for index_key, key_type, is_tmp in self._prepare_parsed_filter(parsed_filter):
+            if key_type in ('list', 'zset'):
+                tmp_key = self._unique_key('tmp')
+                if key_type == 'list':
+                    self._list_to_set(index_key, tmp_key)
+                else:
+                    self._zset_to_set(index_key, tmp_key)
+                if is_tmp:
+                    self.connection.delete(index_key)
+                index_key, is_tmp = tmp_key, True
+            keys.append(index_key)
+            if is_tmp:
+                tmp_keys.add(index_key)
+        return keys
+
+    def _resolve_pk_filter_value(self, value):
+        """
+        Accept a model instance or a single value field as pk filter value, as
+        done in ``_get_pk``
+        """
+        if isinstance(value, RedisModel):
+            return value.pk.get()
+        elif isinstance(value, SingleValueField):
+            return value.proxy_get()
+        return super(ExtendedCollectionManager, self)._resolve_pk_filter_value(value)
+
+    @staticmethod
+    def _resolve_filter_value(parsed_filter):
+        """
+        Return the parsed filter with the real value to filter on
+        """
+        value = parsed_filter.value
+        # We have a RedisModel and we'll use its pk, or a RedisField
+        # (single value) and we'll use its value
+        if isinstance(value, RedisModel):
+            value = value.pk.get()
+        elif isinstance(value, SingleValueField):
+            value = value.proxy_get()
+        elif isinstance(value, RedisField):
+            raise ValueError(u'Invalid filter value for %s: %s' % (parsed_filter.index.field.name, value))
+        else:
+            return parsed_filter
+        return parsed_filter._replace(value=value)
+
+    def filter(self, *q_filters, **filters):
         """
         Add more filters to the collection
         """
-        return self.clone()._add_filters(**filters)
+        return self.clone()._add_filters(*q_filters, **filters)
 
-    def _apply_intersect(self, *sets):
+    def _apply_intersect(self, *sets, **window):
         """
         Add a list of sets to the existing list of sets to check. Returns self
         for chaining.
@@ -205,9 +399,38 @@ class ExtendedCollectionManager(CollectionManager):
         - a ListField or SortedSetField: values will be stored in a temporary
             set (except if we want a sort or values and it's the only "set" to
             use)
+        If 'min', 'max' and/or 'limit' are passed, all the sets must be sorted
+        sets (SortedSetField or key of a redis sorted set), and only their
+        members with a score between 'min' and 'max' (included by default, or
+        excluded if prefixed by '('), limited to 'limit' members with the lowest
+        scores, will be used.
         """
+        min_score = window.pop('min', None)
+        max_score = window.pop('max', None)
+        limit = window.pop('limit', None)
+        if window:
+            raise ValueError('Unexpected keyword arguments for the intersect method: %s'
+                             % list(window))
+        use_window = min_score is not None or max_score is not None or limit is not None
+
         sets_ = set()
         for set_ in sets:
+            if use_window:
+                if not isinstance(set_, (str, SortedSetField)):
+                    raise ValueError('Only sorted sets can be passed to "intersect" with '
+                                     '"min", "max" or "limit", not %s' % (set_, ))
+                if isinstance(set_, SortedSetField) and not getattr(set_, '_instance', None):
+                    raise ValueError('%s passed to "intersect" must be bound'
+                                     % set_.__class__.__name__)
+                self._has_sortedsets = True
+                sets_.add(SortedSetWindow(
+                    set_,
+                    '-inf' if min_score is None else min_score,
+                    '+inf' if max_score is None else max_score,
+                    -1 if limit is None else limit,
+                ))
+                continue
+
             if isinstance(set_, (list, set)):
                 set_ = tuple(set_)
             elif isinstance(set_, MultiValuesField) and not getattr(set_, '_instance', None):
@@ -227,8 +450,22 @@ class ExtendedCollectionManager(CollectionManager):
         self._lazy_collection['intersects'].update(sets_)
         return self
 
-    def intersect(self, *sets):
-        return self.clone()._apply_intersect(*sets)
+    def intersect(self, *sets, **window):
+        return self.clone()._apply_intersect(*sets, **window)
+
+    def _sorted_set_window(self, window, dest_key):
+        """
+        Copy in `dest_key` the members of the sorted set of the given
+        SortedSetWindow, with a score in its bounds, and limited to its limit
+        """
+        key = window.sortedset.key if isinstance(window.sortedset, SortedSetField) else window.sortedset
+        self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.scripts['sorted_set_window'],
+            keys=[key, dest_key],
+            args=[window.min, window.max, 0, window.limit],
+        )
 
     def _combine_sets(self, sets, final_set):
         """
@@ -246,16 +483,26 @@ class ExtendedCollectionManager(CollectionManager):
         """
         The final redis call to obtain the values to return from the "final_set"
         with some sort options.
-        IIf we have at leaset a sorted set and if we don't have any sort
-        options, call zrange on the final set wich is the result of a call to
-        zinterstore.
+        If we have to sort by the score of a sorted set, do it without SORT.
+        If we have at least a sorted set and if we don't have to sort, call
+        zrange (or zrevrange) on the final set which is the result of a call to
+        zinterstore, with the limits of the slice, if any.
         """
         conn = self.connection
 
-        # we have a sorted set without need to sort, use zrange
-        if self._has_sortedsets and sort_options is None:
+        # sort by the score of a sorted set
+        if self._sort_by_sortedset:
+            return self._sort_by_score(final_set, sort_options)
 
-            return conn.zrange(final_set, 0, -1)
+        # we have a sorted set without need to sort, use zrange
+        if self._keep_sortedsets_order:
+            sort_options = sort_options or {}
+            start, num = sort_options.get('start', 0), sort_options.get('num', -1)
+            if num == 0:
+                return []
+            stop = -1 if num < 0 else start + num - 1
+            command = conn.zrevrange if sort_options.get('desc') else conn.zrange
+            return self._get_raw_results_for_pks(command(final_set, start, stop))
 
         # we have a stored collection, without other filter, and no need to
         # sort, use lrange
@@ -265,23 +512,38 @@ class ExtendedCollectionManager(CollectionManager):
 
             return conn.lrange(final_set, 0, -1)
 
-        keys_to_delete_after = set()
-        try:
-            if final_set and self._sort_by_sortedset_before:
-                # TODO: if we have filters, maybe apply _zet_to_keys to only
-                #       intersected values
-                base_tmp_key, tmp_keys = self._prepare_sort_by_score(None, sort_options)
-                # new keys have to be deleted once the final sort is done
-                keys_to_delete_after.add(base_tmp_key)
-                keys_to_delete_after |= tmp_keys
-
-            # normal call
-            return super(ExtendedCollectionManager, self)._final_redis_call(
-                                                            final_set, sort_options)
+        # normal call
+        return super(ExtendedCollectionManager, self)._final_redis_call(
+                                                        final_set, sort_options)
 
-        finally:
-            if keys_to_delete_after:
-                conn.delete(*keys_to_delete_after)
+    def _can_fetch_in_one_call(self, sort_options):
+        """
+        The ``fetch`` lua script is not used when sorting by score, or for a
+        stored collection
+        """
+        if self._sort_by_sortedset or self.stored_key:
+            return False
+        return super(ExtendedCollectionManager, self)._can_fetch_in_one_call(sort_options)
+
+    def _can_fetch_keys_in_one_call(self, keys, tmp_keys):
+        """
+        The ``fetch`` lua script only works with sets, so it is not used if we
+        have sorted sets, or only one key, that may be a list
+        """
+        if self._has_sortedsets or len(keys) < 2:
+            return False
+        return super(ExtendedCollectionManager, self)._can_fetch_keys_in_one_call(keys, tmp_keys)
+
+    def _can_use_sort_index(self, sort_options):
+        """
+        A sort index cannot be used when sorting by score, but can be used
+        with values, that are then retrieved for the sorted pks
+        """
+        if self._sort_by_sortedset or sort_options.get('store'):
+            return False
+        return not sort_options.get('get') or (
+            self._values is not None and sort_options['get'] == self._values['fields']['keys']
+        )
 
     def _collection_length(self, final_set):
         """
@@ -345,115 +607,67 @@ class ExtendedCollectionManager(CollectionManager):
 
         return self
 
-    def _zset_to_keys(self, key, values=None, alpha=False):
+    def _scores_to_zset(self, final_set):
         """
-        Convert a redis sorted set to a list of keys, to be used by sort.
-        Each key is on the following format, for each value in the sorted set:
-            ramdom_string:value-in-the-sorted-set => score-of-the-value
-        The random string is the same for all keys.
-        If values is not None, only these values from the sorted set are saved
-        as keys.
-        If a value in values is not on the sorted set, it's still saved as a key
-        but with a default value ('' is alpha is True, else '-inf')
+        Create a temporary sorted set with all the members of the final set,
+        with their score in the sorted set used to sort (``-inf`` if not in it)
+        Return the name of this new sorted set.
+        """
+        tmp_key = self._unique_key('tmp')
+        self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.scripts['scores_to_zset'],
+            keys=[final_set, self._sort_by_sortedset['by'], tmp_key]
+        )
+        return tmp_key
+
+    def _get_sorted_by_score_range(self, zset_key, start, stop):
+        """
+        Return the raw results (pks or values) for the given range of the
+        sorted set created by ``_scores_to_zset``
         """
         conn = self.connection
-        default = '' if alpha else '-inf'
-        if values is None:
-            # no values given, we get scores from the whole sorted set
-            result = conn.zrange(key, start=0, end=-1, withscores=True)
-            values = list(islice(chain.from_iterable(result), 0, None, 2))
-        else:
-            # we have values, we'll get only their scores
-
-            if isinstance(self.model.database, PipelineDatabase):
-                # if available, use the pipeline of our database to get all
-                # scores in one redis call
-                with self.model.database.pipeline(transaction=False) as pipe:
-                    for value in values:
-                        pipe.zscore(key, value)
-                    scores = pipe.execute()
-            else:
-                # no pipeline, we have to do a call for each value
-                scores = []
-                for value in values:
-                    scores.append(conn.zscore(key, value))
-
-            # combine values and scores in one list
-            result = []
-            for index, value in enumerate(values):
-                score = scores[index]
-                if score is None:
-                    score = default
-                result.append((value, score))
-
-        # create a temporary key for each (value,score) tuple
-        base_tmp_key = self._unique_key('tmp')
-        conn.set(base_tmp_key, 'working...')  # only to "reserve" the main tmp key
-        tmp_keys = set()
-        # use a mapping dict (tmp_key_with_value=>score) to use in mset
-        mapping = {}
-        for value, score in result:
-            tmp_key = make_key(base_tmp_key, value)
-            tmp_keys.add(tmp_key)
-            mapping[tmp_key] = score
-        # set all keys in one call
-        conn.mset(mapping)
-
-        return base_tmp_key, tmp_keys
-
-    def _prepare_sort_by_score(self, values, sort_options):
-        """
-        Create the key to sort on the sorted set references in
-        self._sort_by_sortedset and adapte sort options
-        """
-        # create the keys
-        base_tmp_key, tmp_keys = self._zset_to_keys(
-                                    key=self._sort_by_sortedset['by'],
-                                    values=values,
-                                    )
-        # ask to sort on our new keys
-        sort_options['by'] = '%s:*' % base_tmp_key
-
-        # retrieve original sort parameters
-        for key in ('desc', 'alpha', 'get', 'store'):
-            if key in self._sort_by_sortedset:
-                sort_options[key] = self._sort_by_sortedset[key]
-
-        # if we want to get the score with values/values_list
-        if sort_options.get('get'):
-            try:
-                pos = sort_options['get'].index(SORTED_SCORE)
-            except:
-                pass
-            else:
-                sort_options['get'][pos] = '%s:*' % base_tmp_key
+        command = conn.zrevrange if self._sort_by_sortedset.get('desc') else conn.zrange
+        if not self._want_score_value:
+            return self._get_raw_results_for_pks(command(zset_key, start, stop))
+        pks, scores = [], []
+        for pk, score in command(zset_key, start, stop, withscores=True):
+            pks.append(pk)
+            scores.append(str(score))
+        return self._get_values_for_pks(pks, scores)
+
+    def _sort_by_score(self, final_set, sort_options):
+        """
+        Sort the final set by the score of the sorted set given to ``sort``
+        (``by_score``), by creating a temporary sorted set with these scores and
+        getting only the wanted range from it.
+        If asked, store the pks in a list, like the SORT command would do.
+        """
+        sort_options = sort_options or {}
+        start, num = sort_options.get('start', 0), sort_options.get('num', -1)
+        if num == 0:
+            return []
+        stop = -1 if num < 0 else start + num - 1
 
-        return base_tmp_key, tmp_keys
+        conn = self.connection
+        tmp_key = self._scores_to_zset(final_set)
+        try:
+            if sort_options.get('store'):
+                command = conn.zrevrange if self._sort_by_sortedset.get('desc') else conn.zrange
+                pks = command(tmp_key, start, stop)
+                conn.delete(sort_options['store'])
+                if pks:
+                    conn.rpush(sort_options['store'], *pks)
+                return len(pks)
+            return self._get_sorted_by_score_range(tmp_key, start, stop)
+        finally:
+            conn.delete(tmp_key)
 
     def _prepare_results(self, results, apply_slice=None):
         """
-        Sort results by score if not done before (faster, if we have no values to
-        retrieve, or slice)
+        Regroup values by entry if needed, and use the `values` mode
         """
-        # if we want a result sorted by a score, and if we have a full result
-        # (no slice), we can do it know, by creating keys for each values with
-        # the sorted set score, and sort on them
-        if self._sort_by_sortedset_after and (len(results) > 1 or self._values):
-            conn = self.connection
-
-            sort_params = {}
-            base_tmp_key, tmp_keys = self._prepare_sort_by_score(results, sort_params)
-
-            # compose the set to sort
-            final_set = '%s_final_set' % base_tmp_key
-            conn.sadd(final_set, *results)
-
-            # apply the sort
-            results = list(conn.sort(final_set, **sort_params))
-
-            # finally delete all temporary keys
-            conn.delete(*(tmp_keys | {final_set, base_tmp_key}))
-
         if self._store:
             # if store, redis doesn't return result, so don't return anything here
             _len_hint = 0
@@ -462,6 +676,9 @@ class ExtendedCollectionManager(CollectionManager):
         else:
             results = list(results)
 
+            if self._values:
+                results = self._convert_values(results)
+
             if self._values and self._values['mode'] != 'flat':
                 # regroup results by tuples when we have many values by entry
                 results = list(zip(*([iter(results)] * len(self._values['fields']['names']))))
@@ -477,26 +694,152 @@ class ExtendedCollectionManager(CollectionManager):
 
         return results, iterator_function
 
+    def _convert_values(self, results):
+        """
+        Convert (and decompress if needed), with their ``to_python_many``
+        method, all the values of the fields converting their values, one field
+        at a time, in the flat list of results
+        """
+        names = self._values['fields']['names']
+        for position, name in enumerate(names):
+            if name == SORTED_SCORE or self._field_is_pk(name):
+                continue
+            field = self.model.get_field(name)
+            if field.converts_values:
+                results[position::len(names)] = field._values_from_redis(results[position::len(names)])
+        return results
+
     def _to_values_dict(self, collection_entry):
         return dict(zip(self._values['fields']['names'], collection_entry))
 
-    @property
-    def _sort_by_sortedset_before(self):
+    def _get_values_for_pks(self, pks, scores=None):
+        """Retrieve the values asked via ``values``/``values_list`` for the given pks
+
+        All values are fetched in a single pipeline. The result is a flat list, like the one
+        returned by the redis ``SORT`` command when called with the ``get`` option.
+
+        Parameters
+        ----------
+        pks : List[str]
+            The primary keys for which we want the values
+        scores : Optional[List[str]]
+            The scores, in the sorted set used to sort, of the given pks, to use for
+            ``SORTED_SCORE``
+
+        Returns
+        -------
+        List
+            The values of each wanted field, for each pk.
+
         """
-        Return True if we have to sort by set and do the stuff *before* asking
-        redis for the sort
+        keys = self._values['fields']['keys']
+        fetched = iter([])
+        if pks:
+            with self.connection.pipeline(transaction=False) as pipe:
+                for pk in pks:
+                    for key in keys:
+                        if key in ('#', SORTED_SCORE):
+                            continue
+                        key, hash_field = resolve_pattern(key, pk)
+                        if hash_field is not None:
+                            pipe.hget(key, hash_field)
+                        else:
+                            pipe.get(key)
+                fetched = iter(pipe.execute())
+
+        results = []
+        for index, pk in enumerate(pks):
+            for key in keys:
+                if key == '#':
+                    results.append(pk)
+                elif key == SORTED_SCORE:
+                    # None if not sorted by score
+                    results.append(scores[index] if scores is not None else None)
+                else:
+                    results.append(next(fetched))
+        return results
+
+    def _iterate_by_chunks(self, chunk_size):
+        """
+        If we have a stored collection, without any result, there is nothing to
+        iterate on
         """
-        return self._sort_by_sortedset and self._sort_limits and (not self._lazy_collection['pks']
-                                                            or self._want_score_value)
+        if self.stored_key and not self._stored_len:
+            return iter([])
+        return super(ExtendedCollectionManager, self)._iterate_by_chunks(chunk_size)
 
-    @property
-    def _sort_by_sortedset_after(self):
+    def _must_sort_chunks(self, has_pk):
         """
-        Return True if we have to sort by set and do the stuff *after* asking
-        redis for the sort
+        When sorting by score, chunks are always read from the sorted set
+        holding the scores
         """
-        return self._sort_by_sortedset and not self._sort_limits and (not self._lazy_collection['pks']
-                                                                or self._want_score_value)
+        if self._sort_by_sortedset:
+            return True
+        return super(ExtendedCollectionManager, self)._must_sort_chunks(has_pk)
+
+    def _iter_final_set_chunks(self, final_set, has_pk, chunk_size):
+        """
+        When sorting by score, the sorted set with the scores is created only
+        once, then chunks are read from it
+        """
+        if not self._sort_by_sortedset:
+            for chunk in super(ExtendedCollectionManager, self)._iter_final_set_chunks(final_set, has_pk, chunk_size):
+                yield chunk
+            return
+
+        tmp_key = self._scores_to_zset(final_set)
+        try:
+            start = 0
+            while True:
+                chunk = self._get_sorted_by_score_range(tmp_key, start, start + chunk_size - 1)
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size * len(self._values['fields']['keys'] if self._values else [None]):
+                    break
+                start += chunk_size
+        finally:
+            self.connection.delete(tmp_key)
+
+    def _iter_unsorted_chunks(self, final_set, chunk_size):
+        """
+        Use zrange for sorted sets, and lrange for stored collections, to
+        keep their order, and retrieve values for each chunk if asked
+        """
+        conn = self.connection
+
+        if self._has_sortedsets:
+            get_chunk = conn.zrange
+        elif self.stored_key and not self._lazy_collection['sets']\
+                and len(self._lazy_collection['intersects']) == 1:
+            get_chunk = conn.lrange
+        else:
+            get_chunk = None
+
+        if get_chunk is None:
+            chunks = super(ExtendedCollectionManager, self)._iter_unsorted_chunks(final_set, chunk_size)
+        else:
+            chunks = self._iter_ranged_chunks(get_chunk, final_set, chunk_size)
+
+        for chunk in chunks:
+            yield self._get_raw_results_for_pks(chunk)
+
+    def _get_raw_results_for_pks(self, pks):
+        """If values are asked, fetch them for the given pks"""
+        if self._values:
+            return self._get_values_for_pks(pks)
+        return super(ExtendedCollectionManager, self)._get_raw_results_for_pks(pks)
+
+    @staticmethod
+    def _iter_ranged_chunks(get_chunk, key, chunk_size):
+        """Yield chunks of a list or sorted set using the given ``get_chunk`` (``lrange`` or ``zrange``)"""
+        start = 0
+        while True:
+            chunk = get_chunk(key, start, start + chunk_size - 1)
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                break
+            start += chunk_size
 
     @property
     def _want_score_value(self):
@@ -509,9 +852,6 @@ class ExtendedCollectionManager(CollectionManager):
     def _prepare_sort_options(self, has_pk):
         """
         Prepare sort options for _values attributes.
-        If we manager sort by score after getting the result, we do not want to
-        get values from the first sort call, but only from the last one, after
-        converting results in zset into keys
         """
         sort_options = super(ExtendedCollectionManager, self)._prepare_sort_options(has_pk)
 
@@ -522,24 +862,16 @@ class ExtendedCollectionManager(CollectionManager):
                 sort_options = {}
             sort_options['get'] = self._values['fields']['keys']
 
-        if self._sort_by_sortedset_after:
-            for key in ('get', 'store'):
-                if key in self._sort_by_sortedset:
-                    del self._sort_by_sortedset[key]
-            if sort_options and (not has_pk or self._want_score_value):
-                for key in ('get', 'store'):
-                    if key in sort_options:
-                        self._sort_by_sortedset[key] = sort_options.pop(key)
-            if not sort_options:
-                sort_options = None
         return sort_options
 
     def _get_final_set(self, sets, pk, sort_options):
         """
         Add intersects fo sets and call parent's _get_final_set.
-        If we have to sort by sorted score, and we have a slice, we have to
-        convert the whole sorted set to keys now.
         """
+        return super(ExtendedCollectionManager, self)._get_final_set(self._add_intersects(sets), pk, sort_options)
+
+    def _add_intersects(self, sets):
+        """Return a new list of sets with the ones passed to ``intersect``"""
         if self._lazy_collection['intersects']:
             # if the intersect method was called, we had new sets to intersect
             # to the global set of sets.
@@ -550,10 +882,59 @@ class ExtendedCollectionManager(CollectionManager):
             sets.extend(self._lazy_collection['intersects'])
             if not self._lazy_collection['sets'] and not self.stored_key:
                 sets.append(self.model.get_field('pk').collection_key)
+        return sets
 
-        return super(ExtendedCollectionManager, self)._get_final_set(sets, pk, sort_options)
+    def _get_filtering_sets(self):
+        """
+        Add intersects to the filtering sets, and, when sorting by score
+        without filters, the whole collection because we cannot be sure that
+        entries in the sorted set are all real primary keys
+        """
+        sets = self._add_intersects(super(ExtendedCollectionManager, self)._get_filtering_sets())
+        if self._sort_by_sortedset and not sets:
+            sets.append(self.model.get_field('pk').collection_key)
+        return sets
 
-    def _add_filters(self, **filters):
+    def _prepare_filtering_keys(self, sets):
+        """
+        Lists cannot be used to check members in ``after``, so we convert
+        them to sets
+        """
+        filter_keys, tmp_keys = super(ExtendedCollectionManager, self)._prepare_filtering_keys(sets)
+        if len(filter_keys) == 1 and self.connection.type(list(filter_keys)[0]) == 'list':
+            list_key = filter_keys.pop()
+            tmp_key = self._unique_key('tmp')
+            self._list_to_set(list_key, tmp_key)
+            filter_keys.add(tmp_key)
+            tmp_keys.add(tmp_key)
+        return filter_keys, tmp_keys
+
+    def _get_ordering_source(self):
+        """
+        When sorting by score, use the sorted set given to ``sort``.
+        When filtering on a ``ScoredEqualIndex`` with the sort field as
+        score field, use the sorted set of this index, that also applies the
+        filter.
+        """
+        if self._sort_by_sortedset:
+            return (self._sort_by_sortedset['by'], 'score', None,
+                    self._sort_by_sortedset.get('desc', False), None)
+
+        field = self._get_sort_field()
+        if field is not None and not self._sort.get('alpha'):
+            for set_ in self._lazy_collection['sets']:
+                if not isinstance(set_, ParsedFilter) or set_.suffix not in (None, 'eq') or set_.related_filters:
+                    continue
+                score_field = getattr(set_.index, 'score_field', None)
+                if score_field is None or score_field.name != field.name:
+                    continue
+                (key, __, is_tmp), = self._prepare_parsed_filter(self._resolve_filter_value(set_))
+                if not is_tmp:
+                    return key, 'score', None, self._sort.get('desc', False), set_
+
+        return super(ExtendedCollectionManager, self)._get_ordering_source()
+
+    def _add_filters(self, *q_filters, **filters):
         """
         In addition to the normal _add_filters, this one accept RedisField objects
         on the right part of a filter. The value will be fetched from redis when
@@ -593,7 +974,7 @@ class ExtendedCollectionManager(CollectionManager):
 
                 string_filters.pop(key)
 
-        super(ExtendedCollectionManager, self)._add_filters(**string_filters)
+        super(ExtendedCollectionManager, self)._add_filters(*q_filters, **string_filters)
 
         return self
 
@@ -650,6 +1031,9 @@ class ExtendedCollectionManager(CollectionManager):
                 if isinstance(field, MultiValuesField):
                     raise ValueError("It's not possible to get a MultiValuesField"
                                      " from a collection (asked: %s" % field_name)
+                if isinstance(field, BytesField):
+                    raise ValueError("It's not possible to get a BytesField"
+                                     " from a collection (asked: %s" % field_name)
                 final_fields['names'].append(field_name)
                 final_fields['keys'].append(field.sort_wildcard)
 
@@ -391,7 +391,7 @@ class ScoredEqualIndex(EqualIndex):
     supported_key_types = {'zset'}
 
     score_field = None
-    configurable_attrs = EqualIndex.configurable_attrs | {'score_field'}
+    configurable_attrs = (EqualIndex.configurable_attrs - {'registry'}) | {'score_field'}
 
     RelatedIndex = _ScoredEqualIndex_RelatedIndex
 
@@ -615,7 +615,7 @@ class EqualIndexWith(_MultiFieldsIndexMixin, EqualIndex):
     handled_suffixes = {None, 'eq', 'in'}
     supported_key_types = {'set', 'zset'}
     other_fields = {}
-    configurable_attrs = (EqualIndex.configurable_attrs | {'other_fields', 'unique'})
+    configurable_attrs = (EqualIndex.configurable_attrs - {'registry'}) | {'other_fields', 'unique'}
 
     RelatedIndex = _EqualIndexWith_RelatedIndex
 
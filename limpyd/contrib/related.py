@@ -7,10 +7,12 @@ from future.utils import with_metaclass
 
 import re
 from copy import copy
+from functools import partial
 
 from limpyd import model, fields
 from limpyd.exceptions import *
 from limpyd.contrib.collection import ExtendedCollectionManager
+from limpyd.indexes import BaseIndex, EqualIndex
 
 # used to validate a related_name
 re_identifier = re.compile(r"\W")
@@ -57,6 +59,7 @@ class RelatedCollection(object):
         """
         self.instance = instance
         self.related_field = related_field
+        self._prefetched = None  # related instances set by `prefetch_related`
 
     def __call__(self, **filters):
         """
@@ -68,6 +71,16 @@ class RelatedCollection(object):
         filters[self.related_field.name] = self.instance._pk
         return self.related_field._model.collection(**filters)
 
+    def instances(self, lazy=False):
+        """
+        Return the list of the related instances. If they were retrieved via
+        `prefetch_related` on the collection of the current instance, they are
+        returned without any call to redis.
+        """
+        if self._prefetched is not None:
+            return list(self._prefetched)
+        return list(self().instances(lazy=lazy))
+
     def remove_instance(self):
         """
         Remove the instance from the related fields (delete the field if it's
@@ -95,6 +108,302 @@ class RelatedCollection(object):
                     related_field.delete()
 
 
+class RelatedFilterIndex(BaseIndex):
+    """
+    An index, not storing anything, used by RelatedCollectionManager to filter
+    on a related field via a filter on the related model, like
+    `Person.collection(group__name='admins')`.
+
+    The collection of the related model is computed in redis, then the sets of
+    the index of the related field, for all its pks, are unioned in a
+    temporary set via a lua script: no pks are retrieved by the client.
+
+    The filter given to the related model collection is passed as the suffix,
+    so it can be a filter through another related field.
+    """
+
+    supported_key_types = {'set'}
+
+    scripts = {
+        'union_related': {
+            # we get the pks of the related collection (a set, zset or list)
+            # and we union the sets of the index of the related field for all of
+            # them, in blocks of 100 to avoid unpacking too many keys at once
+            'lua': """
+                local source_key, dest_key, prefix = KEYS[1], KEYS[2], ARGV[1]
+                local source_type = redis.call('type', source_key)['ok']
+                local pks
+                if source_type == 'set' then
+                    pks = redis.call('smembers', source_key)
+                elseif source_type == 'zset' then
+                    pks = redis.call('zrange', source_key, 0, -1)
+                elseif source_type == 'list' then
+                    pks = redis.call('lrange', source_key, 0, -1)
+                else
+                    return 0
+                end
+                local block_size = 100
+                for i = 1, #pks, block_size do
+                    local keys = {dest_key}
+                    for j = i, math.min(i + block_size - 1, #pks) do
+                        keys[#keys + 1] = prefix .. pks[j]
+                    end
+                    redis.call('sunionstore', dest_key, unpack(keys))
+                end
+                return redis.call('scard', dest_key)
+            """
+        },
+    }
+
+    def __init__(self, field, field_index):
+        super(RelatedFilterIndex, self).__init__(field)
+        self.field_index = field_index
+
+    @property
+    def related_model(self):
+        """The model on the other side of the related field"""
+        return self.field.database._models[self.field.related_to]
+
+    def get_filtered_keys(self, suffix, *args, **kwargs):
+        """Return a temporary set with the pks of the model related to the
+        pks of the related model matching the filter in `suffix`
+
+        For the parameters, see ``BaseIndex.get_filtered_keys``
+
+        """
+        self._check_key_accepted_key_types(kwargs.get('accepted_key_types'))
+
+        collection = self.related_model.collection(**{suffix: args[-1]})
+        source_key, delete_source = collection._get_final_set_to_compute()
+
+        tmp_key = self._unique_key('tmp')
+        if source_key is not None:
+            try:
+                self.model.database.call_script(
+                    # be sure to use the script dict at the class level
+                    # to avoid registering it many times
+                    script_dict=self.__class__.scripts['union_related'],
+                    keys=[source_key, tmp_key],
+                    args=[self.field_index.get_storage_key('', transform_value=False)],
+                )
+            finally:
+                if delete_source:
+                    self.connection.delete(source_key)
+
+        return [(tmp_key, 'set', True)]
+
+
+class RelatedCollectionManager(ExtendedCollectionManager):
+    """
+    A collection manager for related models, able to retrieve related instances
+    for all the instances of the collection at once, via `select_related` (for
+    FK fields) and `prefetch_related` (for M2M fields and related collections).
+
+    Without them, getting the related instances of each instance of a
+    collection needs many calls to redis for each instance.
+
+    Exemple with the Person and Group models of RelatedCollection:
+
+        for person in Person.collection().instances().select_related('group'):
+            person.group.instance()  # no call to redis
+
+        for group in Group.collection().instances().prefetch_related('members'):
+            group.members.instances()  # no call to redis
+
+    The related instances are retrieved when the collection is fetched, so they
+    are not updated if the related data is updated later.
+    """
+
+    def __init__(self, model):
+        super(RelatedCollectionManager, self).__init__(model)
+        self._select_related = []  # names of FK fields to get instances for
+        self._prefetch_related = []  # names of M2M fields or related collections
+
+    def clone(self):
+        new = super(RelatedCollectionManager, self).clone()
+        new._select_related = list(self._select_related)
+        new._prefetch_related = list(self._prefetch_related)
+        return new
+
+    def _parse_filter_key(self, key):
+        """
+        Use a RelatedFilterIndex for filters on a related field followed by a
+        field of the related model, like `group__name`, when the rest of the key
+        is not a suffix handled by an index of the related field.
+        """
+        key_path = key.split('__')
+        field_name = key_path.pop(0)
+        if not key_path or not self.model.has_field(field_name):
+            return super(RelatedCollectionManager, self)._parse_filter_key(key)
+
+        field = self.model.get_field(field_name)
+        suffix = '__'.join(key_path)
+        if not isinstance(field, RelatedFieldMixin) \
+                or any(index.can_handle_suffix(suffix) for index in field._indexes) \
+                or not self.model.database._models[field.related_to].has_field(key_path[0]):
+            return super(RelatedCollectionManager, self)._parse_filter_key(key)
+
+        field_index = super(RelatedCollectionManager, self)._parse_filter_key(field_name)[0]
+        if not isinstance(field_index, EqualIndex) or field_index.supported_key_types != {'set'} \
+                or field_index.transform:
+            raise ImplementationError(
+                'Filter "%s" needs an EqualIndex without transform on %s.%s' % (
+                    key, self.model.__name__, field_name
+                )
+            )
+
+        return RelatedFilterIndex(field, field_index), suffix, []
+
+    def select_related(self, *field_names):
+        """
+        Ask the collection to retrieve, when fetched, the related instances of
+        the given FK fields, for all the instances at once. They will then be
+        returned by the `instance` method of these fields without any call to
+        redis. Only valid if instances are returned by the collection.
+        """
+        for field_name in field_names:
+            if not isinstance(self.model.get_field(field_name), SimpleValueRelatedFieldMixin):
+                raise ValueError('%s.%s is not a FK field' % (self.model.__name__, field_name))
+        clone = self.clone()
+        clone._select_related.extend(name for name in field_names if name not in clone._select_related)
+        return clone
+
+    def prefetch_related(self, *names):
+        """
+        Ask the collection to retrieve, when fetched, the related instances of
+        the given M2M fields or related collections (via their related name),
+        for all the instances at once. They will then be returned by the
+        `instances` method of these fields or related collections without any
+        call to redis. Only valid if instances are returned by the collection.
+        """
+        for name in names:
+            self._get_prefetch_relation(name)
+        clone = self.clone()
+        clone._prefetch_related.extend(name for name in names if name not in clone._prefetch_related)
+        return clone
+
+    def _get_prefetch_relation(self, name):
+        """
+        Return a M2M field of the model for the given name, or the related
+        field on the other side of the related collection with the given name
+        """
+        if self.model.has_field(name):
+            field = self.model.get_field(name)
+            if isinstance(field, MultiValuesRelatedFieldMixin):
+                return field
+        else:
+            relations = getattr(self.model.database, '_relations', {}).get(self.model._name.lower(), [])
+            for model_name, field_name, related_name in relations:
+                if related_name == name:
+                    return self.model.database._models[model_name].get_field(field_name)
+        raise ValueError('%s is not a M2M field or a related collection of %s' % (name, self.model.__name__))
+
+    def _fetch_collection(self, apply_slice=None):
+        """
+        Create all instances at once when fetching the collection, to retrieve
+        their related instances in batch
+        """
+        fetched = self._collection_cache is not None
+        super(RelatedCollectionManager, self)._fetch_collection(apply_slice)
+        if fetched or not self._collection_cache or not self._instances:
+            return
+        if not (self._select_related or self._prefetch_related):
+            return
+        instances = {instance._pk: instance for instance in self._to_instances(self._collection_cache)}
+        self._cache_iterator_function = partial(self._get_fetched_instance, instances)
+
+    @staticmethod
+    def _get_fetched_instance(instances, pk):
+        """Return the instance for the given pk, created in `_fetch_collection`"""
+        try:
+            return instances[pk]
+        except KeyError:
+            raise DoesNotExist("No instance found with pk %s" % pk)
+
+    def _to_instances(self, pks):
+        """
+        Return instances for the given pks, with their related instances asked
+        via `select_related` and `prefetch_related`
+        """
+        instances = super(RelatedCollectionManager, self)._to_instances(pks)
+        if instances:
+            for field_name in self._select_related:
+                self._select_related_for_instances(instances, field_name)
+            for name in self._prefetch_related:
+                self._prefetch_related_for_instances(instances, name)
+        return instances
+
+    def _get_related_instances(self, model, pks):
+        """
+        Return a dict with the instances of the given model for the given pks,
+        with only one redis call for all existence checks (none if lazy)
+        """
+        collection = model.collection_manager(model)
+        collection._lazy_instances = self._lazy_instances
+        return {instance._pk: instance for instance in collection._to_instances(sorted(pks))}
+
+    def _select_related_for_instances(self, instances, field_name):
+        """
+        Read the value of the FK field for all instances in one call, then
+        attach the related instances to the fields
+        """
+        with self.connection.pipeline(transaction=False) as pipe:
+            for instance in instances:
+                field = instance.get_field(field_name)
+                if isinstance(field, fields.InstanceHashField):
+                    pipe.hget(field.key, field.hash_field)
+                else:
+                    pipe.get(field.key)
+            values = pipe.execute()
+
+        model = self.model.database._models[self.model.get_field(field_name).related_to]
+        related_instances = self._get_related_instances(model, {value for value in values if value is not None})
+
+        for instance, value in zip(instances, values):
+            # if there is no related instance, `instance` will work as usual
+            instance.get_field(field_name)._prefetched = related_instances.get(value)
+
+    def _prefetch_related_for_instances(self, instances, name):
+        """
+        Read the pks of the related instances for all instances in one call,
+        then attach the related instances to the M2M fields or related
+        collections
+        """
+        field = self._get_prefetch_relation(name)
+
+        with self.connection.pipeline(transaction=False) as pipe:
+            if field._model is self.model and field.name == name:
+                # a M2M field of the model
+                model = self.model.database._models[field.related_to]
+                for instance in instances:
+                    key = instance.get_field(name).key
+                    if isinstance(field, fields.SetField):
+                        pipe.smembers(key)
+                    elif isinstance(field, fields.ListField):
+                        pipe.lrange(key, 0, -1)
+                    else:
+                        pipe.zrange(key, 0, -1)
+            else:
+                # a related collection, we read the index used to filter it
+                model = field._model
+                index, suffix, extra_field_parts = model.collection_manager(model)._parse_filter_key(field.name)
+                for instance in instances:
+                    key, key_type, __ = index.get_filtered_keys(
+                        suffix, instance._pk, accepted_key_types={'set', 'zset'})[0]
+                    if key_type == 'set':
+                        pipe.smembers(key)
+                    else:
+                        pipe.zrange(key, 0, -1)
+            related_pks = pipe.execute()
+
+        related_instances = self._get_related_instances(model, set().union(*related_pks))
+
+        for instance, pks in zip(instances, related_pks):
+            getattr(instance, name)._prefetched = [
+                related_instances[pk] for pk in pks if pk in related_instances
+            ]
+
+
 class RelatedModel(model.RedisModel):
     """
     This subclass of RedisModel handles creation of related collections, and
@@ -103,7 +412,7 @@ class RelatedModel(model.RedisModel):
     """
 
     abstract = True
-    collection_manager = ExtendedCollectionManager
+    collection_manager = RelatedCollectionManager
 
     def __init__(self, *args, **kwargs):
         """
@@ -225,6 +534,8 @@ class RelatedFieldMixin(with_metaclass(RelatedFieldMetaclass)):
 
     related_collection_class = RelatedCollection
 
+    _prefetched = None  # related instance(s) set by `select_related`/`prefetch_related`
+
     def __init__(self, to, *args, **kwargs):
         """
         Force the field to be indexable and save related arguments.
@@ -351,6 +662,15 @@ class RelatedFieldMixin(with_metaclass(RelatedFieldMetaclass)):
 
         return related_name.lower()
 
+    def _call_command(self, name, *args, **kwargs):
+        """
+        Forget the related instance(s) retrieved via `select_related` or
+        `prefetch_related` when the field is updated.
+        """
+        if name in self.available_modifiers:
+            self._prefetched = None
+        return super(RelatedFieldMixin, self)._call_command(name, *args, **kwargs)
+
     def from_python(self, value):
         """
         Provide the ability to pass a RedisModel instances or a FK field as
@@ -419,7 +739,11 @@ class SimpleValueRelatedFieldMixin(RelatedFieldMixin):
     def instance(self, lazy=False):
         """
         Returns the instance of the related object linked by the field.
+        If it was retrieved via `select_related` on the collection of the
+        current instance, it is returned without any call to redis.
         """
+        if self._prefetched is not None:
+            return self._prefetched
         model = self.database._models[self.related_to]
         meth = model.lazy_connect if lazy else model
         return meth(self.proxy_get())
@@ -477,6 +801,16 @@ class MultiValuesRelatedFieldMixin(RelatedFieldMixin):
     # calling obj.field.collection() is the same as calling obj.field()
     collection = __call__
 
+    def instances(self, lazy=False):
+        """
+        Return the list of the related instances. If they were retrieved via
+        `prefetch_related` on the collection of the current instance, they are
+        returned without any call to redis.
+        """
+        if self._prefetched is not None:
+            return list(self._prefetched)
+        return list(self().instances(lazy=lazy))
+
 
 class M2MSetField(MultiValuesRelatedFieldMixin, fields.SetField):
     """ Related field based on a SetField, acting as a M2M """
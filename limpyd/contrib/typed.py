@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+from future.builtins import str
+from future.builtins import object
+
+import json
+from datetime import date, datetime
+
+from limpyd import fields
+from limpyd.indexes import EqualIndex, NumberRangeIndex
+from limpyd.utils import normalize
+
+
+class TypedFieldMixin(object):
+    """
+    Base mixin for fields storing values of a python type.
+    The value passed to the commands taking a value is converted with
+    "from_python" before sending it to redis, and the value returned by the
+    commands returning a value is converted with "to_python" (see
+    `SingleValueField._traverse_command`).
+    Subclasses must define "from_python" to return a string from a python
+    value (or a string already converted), and "to_python" to return a python
+    value from a string. Both must accept None.
+    Values returned by commands called in a pipeline are not converted.
+    """
+
+    converts_values = True
+
+    def proxy_set(self, value):
+        """
+        Always pass the value as is, even lists and dicts, to the setter
+        """
+        return getattr(self, self.proxy_setter)(value)
+
+
+class IntegerFieldMixin(TypedFieldMixin):
+    """
+    Mixin for fields storing integers. Indexed by default with `EqualIndex` and
+    `NumberRangeIndex`.
+    """
+
+    default_indexes = [EqualIndex, NumberRangeIndex]
+
+    def from_python(self, value):
+        if value is None:
+            return None
+        return str(int(normalize(value)))
+
+    def to_python(self, value):
+        if value is None:
+            return None
+        return int(value)
+
+    def to_python_many(self, values):
+        return [None if value is None else int(value) for value in values]
+
+
+class FloatFieldMixin(TypedFieldMixin):
+    """
+    Mixin for fields storing floats. Indexed by default with `EqualIndex` and
+    `NumberRangeIndex`.
+    """
+
+    default_indexes = [EqualIndex, NumberRangeIndex]
+
+    def from_python(self, value):
+        if value is None:
+            return None
+        return repr(float(normalize(value)))
+
+    def to_python(self, value):
+        if value is None:
+            return None
+        return float(value)
+
+    def to_python_many(self, values):
+        return [None if value is None else float(value) for value in values]
+
+
+class DateTimeFieldMixin(TypedFieldMixin):
+    """
+    Mixin for fields storing datetimes, stored with a fixed format (see
+    "datetime_format") so the lexicographical order is the chronological one,
+    allowing the use of `TextRangeIndex`.
+    Aware datetimes are converted to naive UTC datetimes.
+    Strings are stored as is, to be able to filter on partial values in
+    indexes (like `date__gte='2020-01'`), and `date` objects are converted
+    to strings with their `isoformat` method.
+    Stored values not matching the format are returned as strings.
+    """
+
+    datetime_format = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def from_python(self, value):
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            if value.utcoffset() is not None:
+                value = (value - value.utcoffset()).replace(tzinfo=None)
+            return value.strftime(self.datetime_format)
+        if isinstance(value, date):
+            return value.isoformat()
+        return normalize(value)
+
+    def to_python(self, value):
+        if value is None:
+            return None
+        try:
+            return datetime.strptime(value, self.datetime_format)
+        except ValueError:
+            return value
+
+    def to_python_many(self, values):
+        strptime, datetime_format = datetime.strptime, self.datetime_format
+        results = []
+        for value in values:
+            if value is not None:
+                try:
+                    value = strptime(value, datetime_format)
+                except ValueError:
+                    pass
+            results.append(value)
+        return results
+
+
+class _JSONString(str):
+    """ A string already serialized in JSON, to not serialize it again """
+
+
+class JSONFieldMixin(TypedFieldMixin):
+    """
+    Mixin for fields storing any value that can be serialized in JSON. Keys
+    of dicts are sorted, so equal values are stored the same way, allowing
+    the use of `EqualIndex`.
+    """
+
+    def from_python(self, value):
+        if value is None or isinstance(value, _JSONString):
+            return value
+        return _JSONString(json.dumps(value, sort_keys=True, separators=(',', ':')))
+
+    def _prepare_index_data(self, pk, values=None):
+        """
+        Pass the serialized values to the indexes, as dicts and lists cannot be
+        used by them
+        """
+        return [
+            (self.from_python(value), )
+            for value, in super(JSONFieldMixin, self)._prepare_index_data(pk, values)
+        ]
+
+    def to_python(self, value):
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def to_python_many(self, values):
+        loads = json.loads
+        return [None if value is None else loads(value) for value in values]
+
+
+class IntegerStringField(IntegerFieldMixin, fields.StringField):
+    """ StringField storing an integer """
+
+
+class IntegerInstanceHashField(IntegerFieldMixin, fields.InstanceHashField):
+    """ InstanceHashField storing an integer """
+
+
+class FloatStringField(FloatFieldMixin, fields.StringField):
+    """ StringField storing a float """
+
+
+class FloatInstanceHashField(FloatFieldMixin, fields.InstanceHashField):
+    """ InstanceHashField storing a float """
+
+
+class DateTimeStringField(DateTimeFieldMixin, fields.StringField):
+    """ StringField storing a datetime """
+
+
+class DateTimeInstanceHashField(DateTimeFieldMixin, fields.InstanceHashField):
+    """ InstanceHashField storing a datetime """
+
+
+class JSONStringField(JSONFieldMixin, fields.StringField):
+    """ StringField storing a JSON serializable value """
+
+
+class JSONInstanceHashField(JSONFieldMixin, fields.InstanceHashField):
+    """ InstanceHashField storing a JSON serializable value """
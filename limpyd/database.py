@@ -55,9 +55,11 @@ class RedisDatabase(object):
         if self.redis_version < (3, ):
             raise LimpydException('Limpyd needs redis-server >= 3 to operate')
 
-    def connect(self, **settings):
+    def connect(self, decode_responses=True, **settings):
         """
         Connect to redis and cache the new connection
+        If `decode_responses` is False, the connection returns bytes, without
+        decoding them.
         """
         # compute a unique key for this settings, for caching. Work on the whole
         # dict without directly using known keys to allow the use of unix socket
@@ -65,8 +67,10 @@ class RedisDatabase(object):
         if not settings:
             settings = self.connection_settings
         connection_key = ':'.join([str(settings[k]) for k in sorted(settings)])
+        if not decode_responses:
+            connection_key += ':raw'
         if connection_key not in self._connections:
-            self._connections[connection_key] = redis.Redis(decode_responses=True, **settings)
+            self._connections[connection_key] = redis.Redis(decode_responses=decode_responses, **settings)
             self.ensure_redis_versions()
         return self._connections[connection_key]
 
@@ -77,6 +81,7 @@ class RedisDatabase(object):
         """
         self.connection_settings = connection_settings
         self._connection = None
+        self._raw_connection = None
 
     def _add_model(self, model):
         """
@@ -140,6 +145,17 @@ class RedisDatabase(object):
             self._connection = self.connect()
         return self._connection
 
+    @property
+    def raw_connection(self):
+        """
+        A connection to the same redis database, but returning bytes without
+        decoding them, used by fields storing binary data (see `BytesField`).
+        It's not used by pipelines.
+        """
+        if self._raw_connection is None:
+            self._raw_connection = self.connect(decode_responses=False)
+        return self._raw_connection
+
     @property
     def redis_version(self):
         """Return the redis version as a tuple"""
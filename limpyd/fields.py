@@ -5,10 +5,18 @@ from future.builtins import str
 from future.builtins import zip
 from future.utils import with_metaclass
 
+import zlib
+from base64 import b64decode, b64encode
 from inspect import isclass
 from logging import getLogger
 from copy import copy
 
+try:
+    import lzma
+except ImportError:  # python 2
+    lzma = None
+
+from redis.client import Pipeline
 from redis.exceptions import RedisError
 
 from limpyd.database import Lock
@@ -29,6 +37,7 @@ __all__ = [
     'PKField',
     'AutoPKField',
     'HashField',
+    'BytesField',
 ]
 
 
@@ -179,6 +188,9 @@ class RedisField(RedisProxyCommand):
     _unique_supported = True
     _field_parts = 1
     default_indexes = None
+    # if True, values are converted by `from_python` before being stored, and
+    # by `to_python` after being read
+    converts_values = False
 
     available_getters = {'expire', 'expireat', 'pexpire', 'pexpireat', 'ttl', 'pttl', 'persist'}
     available_modifiers = set()
@@ -487,13 +499,18 @@ class RedisField(RedisProxyCommand):
                     if self._instance.connected:
                         self._rollback_indexes()
                     raise
-                else:
-                    return result
                 finally:
                     if self._instance.connected:
                         self._reset_indexes_rollback_caches(self._instance_pk)
         else:
-            return meth(name, *args, **kwargs)
+            result = meth(name, *args, **kwargs)
+
+        # update partial indexes of other fields having a condition on this one
+        if (name in self.available_modifiers and self.attached_to_instance
+                and self.name in self._model._partial_indexes_fields):
+            self._instance._update_partial_indexes([self.name])
+
+        return result
 
     def _rollback_indexes(self):
         """
@@ -531,6 +548,12 @@ class RedisField(RedisProxyCommand):
             indexes = self._indexes
 
         pk = self._instance.pk.get()
+
+        # skip partial indexes for which the instance does not match the conditions
+        indexes = [index for index in indexes if index.matches_condition(pk)]
+        if not indexes:
+            return
+
         values = self._prepare_index_data(pk, values)
 
         for parts in values:
@@ -562,6 +585,12 @@ class RedisField(RedisProxyCommand):
             indexes = self._indexes
 
         pk = self._instance.pk.get()
+
+        # skip partial indexes for which the instance does not match the conditions
+        indexes = [index for index in indexes if index.matches_condition(pk)]
+        if not indexes:
+            return
+
         values = self._prepare_index_data(pk, values)
 
         for parts in values:
@@ -666,6 +695,19 @@ class RedisField(RedisProxyCommand):
         """
         return normalize(value)
 
+    def to_python(self, value):
+        """
+        Convert a value read from Redis. Does nothing by default.
+        """
+        return value
+
+    def to_python_many(self, values):
+        """
+        Convert many values read from Redis at once (used by `values` and
+        `values_list` of collections).
+        """
+        return [self.to_python(value) for value in values]
+
     def _reset(self, command, *args, **kwargs):
         """
         Shortcut for commands that reset values of the field.
@@ -717,8 +759,146 @@ class SingleValueField(RedisField):
     """
     A simple parent class for StringField, InstanceHashField and PKField, all field
     types handling a single value.
+    Values can be compressed (only if the field is not indexable) by passing
+    the name of a codec (see `compression_codecs`) to the `compress` argument:
+    values whose size is at least `compress_threshold` bytes (1024 by default)
+    are then compressed before being stored, and decompressed when read.
     """
 
+    _copy_conf = copy(RedisField._copy_conf)
+    _copy_conf['kwargs'] = _copy_conf['kwargs'] + ['compress', 'compress_threshold']
+
+    _compress_supported = True
+    compress = None
+    compress_threshold = 1024
+
+    # Compressed values are stored as text: this marker, the character of the
+    # codec, then the compressed value encoded in base64. Values that are not
+    # compressed but start with the marker are stored with the marker and "-"
+    # prepended, so values stored without this prefix are returned as is.
+    compression_marker = '\x00'
+    compression_codecs = {
+        'zlib': ('z', zlib),
+        'lzma': ('x', lzma),
+    }
+
+    # Commands taking the value as argument (at `_value_arg_position` in
+    # the arguments passed to `_traverse_command`), and commands returning the
+    # value, converted if `converts_values` is True
+    _commands_with_value_from_python = set()
+    _commands_with_value_to_python = set()
+    _value_arg_position = 0
+    # Commands working on the stored value, that would not work if compressed
+    _commands_denied_if_compressed = set()
+
+    def __init__(self, *args, **kwargs):
+        self.compress = kwargs.pop('compress', None)
+        self.compress_threshold = kwargs.pop('compress_threshold', 1024)
+
+        super(SingleValueField, self).__init__(*args, **kwargs)
+
+        if self.compress:
+            if not self._compress_supported:
+                raise ImplementationError('%s field cannot be compressed' % self.__class__.__name__)
+            if self.compress not in self.compression_codecs:
+                raise ImplementationError('Invalid value "%s" for "compress", must be one of: %s' % (
+                    self.compress, ', '.join(sorted(self.compression_codecs))))
+            if self.compression_codecs[self.compress][1] is None:
+                raise ImplementationError('The "%s" compression is not available' % self.compress)
+            if self.indexable:
+                raise ImplementationError('Cannot compress values of indexable fields')
+            self.converts_values = True
+
+    def compress_value(self, value):
+        """
+        Compress the given value (already passed to `from_python`) if big
+        enough and if it saves space, and return the string to store.
+        """
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            value = str(value)
+        marker = self.compression_marker
+
+        data = value.encode('utf-8')
+        if len(data) >= self.compress_threshold:
+            char, module = self.compression_codecs[self.compress]
+            compressed = b64encode(module.compress(data)).decode('ascii')
+            if len(compressed) + 2 < len(data):
+                return marker + char + compressed
+
+        if value.startswith(marker):
+            return marker + '-' + value
+        return value
+
+    def decompress_value(self, value):
+        """
+        Return the original value of a value stored by `compress_value`. Values
+        stored without compression (for example before `compress` was set on
+        the field) are returned as is.
+        """
+        if value is None or not value.startswith(self.compression_marker):
+            return value
+        char, value = value[1:2], value[2:]
+        if char == '-':
+            return value
+        for codec_char, module in self.compression_codecs.values():
+            if char == codec_char:
+                return module.decompress(b64decode(value)).decode('utf-8')
+        raise ValueError('Invalid compressed value')
+
+    def _value_to_redis(self, value):
+        """
+        Convert (with `from_python`) and compress if needed a value to store.
+        """
+        value = self.from_python(value)
+        if self.compress:
+            value = self.compress_value(value)
+        return value
+
+    def _value_from_redis(self, value):
+        """
+        Decompress if needed and convert (with `to_python`) a value read from
+        redis.
+        """
+        if self.compress:
+            value = self.decompress_value(value)
+        return self.to_python(value)
+
+    def _values_from_redis(self, values):
+        """
+        Same as `_value_from_redis` for many values at once (used by `values`
+        and `values_list` of collections).
+        """
+        if self.compress:
+            values = [self.decompress_value(value) for value in values]
+        return self.to_python_many(values)
+
+    def _traverse_command(self, name, *args, **kwargs):
+        """
+        If the field converts its values, convert the value passed to the
+        commands defined in `_commands_with_value_from_python`, and the value
+        returned by the ones defined in `_commands_with_value_to_python`.
+        Values returned by commands called in a pipeline are not converted.
+        """
+        if not self.converts_values:
+            return super(SingleValueField, self)._traverse_command(name, *args, **kwargs)
+
+        if self.compress and name in self._commands_denied_if_compressed:
+            raise ImplementationError('The "%s" command cannot be used on compressed fields' % name)
+
+        position = self._value_arg_position
+        if name in self._commands_with_value_from_python and len(args) > position:
+            args = list(args)
+            args[position] = self._value_to_redis(args[position])
+
+        result = super(SingleValueField, self)._traverse_command(name, *args, **kwargs)
+
+        if name in self._commands_with_value_to_python and not isinstance(result, Pipeline):
+            result = self._value_from_redis(result)
+
+        return result
+
     def _call_set(self, command, value, *args, **kwargs):
         """
         Helper for commands that only set a value to the field.
@@ -758,6 +938,14 @@ class StringField(SingleValueField):
         'setrange', 'setex', 'psetex',
     }
 
+    _commands_with_value_from_python = {'set', 'setnx', 'getset', }
+    _commands_with_value_to_python = {'get', 'getset', }
+    _commands_denied_if_compressed = {
+        'getbit', 'getrange', 'strlen', 'bitcount', 'bitpos', 'append', 'decr',
+        'decrby', 'incr', 'incrby', 'incrbyfloat', 'setbit', 'setrange',
+        'setex', 'psetex',
+    }
+
     _call_getset = SingleValueField._call_set
     _call_append = _call_setrange = _call_setbit = SingleValueField._reset
     _call_decr = SingleValueField._reindex_from_result
@@ -791,6 +979,42 @@ class StringField(SingleValueField):
         return super(StringField, self)._call_set(command, value, ex=ex, px=px)
 
 
+class BytesField(StringField):
+    """
+    A StringField for binary data: its commands use the raw connection of the
+    database, so values are returned as bytes, without decoding.
+    It cannot be indexed, as indexes work on text, and cannot be retrieved via
+    `values`/`values_list` of collections.
+    Its commands cannot be used while the database is pipelined, as they would
+    not be part of the pipeline.
+    """
+
+    _compress_supported = False
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('indexable') or kwargs.get('unique') or kwargs.get('indexes'):
+            raise ImplementationError('%s field cannot be indexed' % self.__class__.__name__)
+        super(BytesField, self).__init__(*args, **kwargs)
+
+    @property
+    def connection(self):
+        """
+        Use the connection of the database not decoding responses
+        """
+        if not self._model:
+            raise TypeError('A field cannot use a connection if not linked to a model')
+        if isinstance(self.database.connection, Pipeline):
+            # the raw connection is not pipelined, so the command would be run immediately
+            raise ImplementationError('%s field cannot be used in a pipeline' % self.__class__.__name__)
+        return self.database.raw_connection
+
+    def from_python(self, value):
+        """
+        Keep bytes as is.
+        """
+        return value
+
+
 class MultiValuesField(RedisField):
     """
     It's a base class for SetField, SortedSetField and ListField, to manage
@@ -1287,6 +1511,12 @@ class InstanceHashField(SingleValueField):
     available_getters = {'hget', }
     available_modifiers = {'hdel', 'hset', 'hsetnx', 'hincrby', 'hincrbyfloat', }
 
+    # the name of the hash field is inserted before the value
+    _commands_with_value_from_python = {'hset', 'hsetnx', }
+    _commands_with_value_to_python = {'hget', }
+    _value_arg_position = 1
+    _commands_denied_if_compressed = {'hincrby', 'hincrbyfloat', }
+
     _call_hset = SingleValueField._call_set
     _call_hdel = RedisField._del
 
@@ -1294,14 +1524,26 @@ class InstanceHashField(SingleValueField):
     def key(self):
         return self._instance.key
 
+    @property
+    def hash_field(self):
+        """
+        The name of the field in the hash of the instance: its name, prefixed
+        by the pk if the model has a `bucket_size`.
+        """
+        if self._model.bucket_size:
+            return self.make_key(self._instance.pk.get(), self.name)
+        return self.name
+
     @property
     def sort_wildcard(self):
+        if self._model.bucket_size:
+            return "%s->*:%s" % (self._model.sort_wildcard(), self.name)
         return "%s->%s" % (self._model.sort_wildcard(), self.name)
 
     def _traverse_command(self, name, *args, **kwargs):
         """Add key AND the hash field to the args, and call the Redis command."""
         args = list(args)
-        args.insert(0, self.name)
+        args.insert(0, self.hash_field)
         return super(InstanceHashField, self)._traverse_command(name, *args, **kwargs)
 
     def delete(self):
@@ -1325,7 +1567,7 @@ class InstanceHashField(SingleValueField):
             """
             return False
         else:
-            return self.connection.hexists(key, self.name)
+            return self.connection.hexists(key, self.hash_field)
     exists = hexists
 
 
@@ -1351,6 +1593,7 @@ class PKField(SingleValueField):
     _auto_increment = False  # False for PKField, True for AutoPKField
     _auto_added = False  # True only if automatically added by limpyd
     _set = False  # True when set for the first (and unique) time
+    _compress_supported = False
 
     _copy_conf = copy(RedisField._copy_conf)
     _copy_conf['attrs'] += ['_auto_increment', '_auto_added']
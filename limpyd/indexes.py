@@ -7,10 +7,11 @@ from past.builtins import str as oldstr
 from collections import defaultdict
 from itertools import product
 from logging import getLogger
+import re
 import threading
 
 from limpyd.exceptions import ImplementationError, LimpydException, UniquenessError
-from limpyd.utils import make_key, unique_key
+from limpyd.utils import is_bucket_pattern, make_key, normalize, resolve_pattern, unique_key
 
 logger = getLogger(__name__)
 
@@ -45,6 +46,14 @@ class BaseIndex(object):
         The filter in the collection will then have to use a transformed value, for example
         ``birth_date__year=1976`` if the transform take a date and transform it to a year.
         This callable can accept one (``value``) or two (``self``, ``value``) arguments
+    only_if: dict
+        None by default. If defined, the index is partial: only instances matching all its
+        conditions are indexed. Each key is the name of a field of the model holding a single
+        value (``StringField`` or ``InstanceHashField``, not the primary key), and each value
+        is the value this field must have (``None`` to match instances without value for it).
+        Instances are added to or removed from the index when the fields of the conditions are
+        updated. Filters using this index only return instances matching the conditions.
+        Cannot be used for unique fields, multi-fields indexes, or indexes used to sort.
 
     Class attributes
     ----------------
@@ -60,6 +69,13 @@ class BaseIndex(object):
         May include: 'set', 'zset' or 'list'
     filter_single_field : bool
         Tell if the index can be used to filter a field independently than others.
+    ordering : str
+        ``None`` by default. Set to ``'score'`` or ``'lex'`` if the index stores all pks of the
+        field in a sorted-set ordered by the value of the field, by score or lexicographically.
+        The key of this sorted-set must be returned by ``get_ordering_key``.
+    use_for_sort : bool
+        ``False`` by default. If ``True`` (the index must have an ``ordering``), collections
+        sorted by the field will use the sorted-set of the index instead of the ``SORT`` command.
 
     Parameters
     -----------
@@ -73,10 +89,13 @@ class BaseIndex(object):
     key = None
     prefix = None
     transform = None
+    only_if = None
     filter_single_field = True
+    ordering = None
+    use_for_sort = False
 
     configurable_attrs = {
-        'prefix', 'transform', 'handle_uniqueness', 'key', 'name'
+        'prefix', 'transform', 'handle_uniqueness', 'key', 'name', 'only_if'
     }
 
     supported_key_types = set()
@@ -128,6 +147,18 @@ class BaseIndex(object):
         if 'transform' in kwargs:
             attrs['transform'] = staticmethod(kwargs.pop('transform'))
 
+        if 'only_if' in kwargs and 'only_if' in cls.configurable_attrs:
+            only_if = kwargs.pop('only_if')
+            if only_if is not None:
+                if not isinstance(only_if, dict) or not only_if:
+                    raise ValueError('"only_if" must be a dict of field names and values')
+                # store values as strings, like they are returned by redis
+                only_if = {
+                    field_name: None if value is None else str(value)
+                    for field_name, value in only_if.items()
+                }
+            attrs['only_if'] = only_if
+
         name = kwargs.pop('name', None)
 
         return name, attrs, kwargs
@@ -519,7 +550,7 @@ class BaseIndex(object):
         """
         if aggressive:
             keys = self.get_all_storage_keys()
-            with self.model.database.pipeline(transaction=False) as pipe:
+            with self.connection.pipeline(transaction=False) as pipe:
                 for key in keys:
                     pipe.delete(key)
                 pipe.execute()
@@ -584,8 +615,50 @@ class BaseIndex(object):
         field : RedisField
             The field for which the indexes are ready
 
+        Raises
+        ------
+        ImplementationError
+            If ``only_if`` is set for a unique field, a multi-fields index, or an index used
+            to sort
+
+        """
+        if not cls.only_if:
+            return
+
+        if field.unique or not cls.filter_single_field or cls.use_for_sort:
+            raise ImplementationError(
+                "The index %s on %s.%s cannot use only_if: it is not supported for unique fields, "
+                "multi-fields indexes and indexes used to sort" % (
+                    cls.__name__,
+                    model.__name__,
+                    field.name,
+                )
+            )
+
+    def matches_condition(self, pk):
+        """Tell if the instance with the given pk must be in the index, according to ``only_if``
+
+        Parameters
+        ----------
+        pk : Any
+            The primary key of the instance to check
+
+        Returns
+        -------
+        bool
+            ``True`` if the index is not partial, or if the instance matches all its conditions
+
         """
-        pass
+        if not self.only_if:
+            return True
+
+        instance = self.model.lazy_connect(pk)
+        for field_name, expected_value in self.only_if.items():
+            value = normalize(instance.get_field(field_name).proxy_get())
+            if (None if value is None else str(value)) != expected_value:
+                return False
+
+        return True
 
     def _unique_key(self, prefix=None):
         """
@@ -601,12 +674,111 @@ class BaseIndex(object):
 
 
 class EqualIndex(BaseIndex):
-    """Default simple equal index."""
+    """Default simple equal index.
+
+    Configurable attributes
+    -----------------------
+    These are class attributes that can be changed via ``configure``:
+
+    registry : bool
+        Default to ``False``. When ``True``, the index maintains a sorted-set of all the
+        distinct values of the field, with, as score, the number of instances having each value.
+        It is updated in the same lua script that updates the set of the value.
+        It is used to get the distinct values and counts of the field without scanning the
+        keys of the database. Only for fields with only one part (not ``HashField``).
+        If activated on an already indexed field, the index must be rebuilt.
+
+    """
 
     handled_suffixes = {None, 'eq', 'in'}
     handle_uniqueness = True
     supported_key_types = {'set'}
 
+    registry = False
+    configurable_attrs = BaseIndex.configurable_attrs | {'registry'}
+
+    scripts = {
+        'store': {
+            # add the pk to the set of the value, and if it was not already in, increment
+            # the count of the value in the registry
+            'lua': """
+                local added = redis.call('sadd', KEYS[1], ARGV[1])
+                if added == 1 then
+                    redis.call('zincrby', KEYS[2], 1, ARGV[2])
+                end
+                return added
+            """
+        },
+        'unstore': {
+            # remove the pk from the set of the value, and if it was in, decrement the count
+            # of the value in the registry, removing the value if there is no more instances
+            'lua': """
+                local removed = redis.call('srem', KEYS[1], ARGV[1])
+                if removed == 1 then
+                    if tonumber(redis.call('zincrby', KEYS[2], -1, ARGV[2])) <= 0 then
+                        redis.call('zrem', KEYS[2], ARGV[2])
+                    end
+                end
+                return removed
+            """
+        },
+    }
+
+    @classmethod
+    def handle_configurable_attrs(cls, **kwargs):
+        """Handle attributes that can be passed to ``configure``.
+
+        This method handle the ``registry`` attribute added in this index class.
+
+        For the parameters, see ``BaseIndex.handle_configurable_attrs``.
+
+        """
+
+        name, attrs, kwargs = super(EqualIndex, cls).handle_configurable_attrs(**kwargs)
+        if 'registry' in kwargs and 'registry' in cls.configurable_attrs:
+            attrs['registry'] = bool(kwargs.pop('registry'))
+        return name, attrs, kwargs
+
+    @classmethod
+    def _field_model_ready(cls, model, field):
+        """Check that the registry, if activated, can be used for the field
+
+        For the parameters, see ``BaseIndex._field_model_ready``.
+
+        Raises
+        ------
+        ImplementationError
+            If the registry is activated for a field with many parts (like a ``HashField``)
+
+        """
+        super(EqualIndex, cls)._field_model_ready(model, field)
+
+        if cls.registry and field._field_parts != 1:
+            raise ImplementationError("The index %s on %s.%s cannot use a registry: the field has many parts" % (
+                cls.__name__,
+                model.__name__,
+                field.name,
+            ))
+
+    def get_registry_key(self):
+        """Return the redis key of the sorted-set of the values of the field
+
+        Returns
+        -------
+        str
+            The redis key of the registry. Only used if ``registry`` is ``True``.
+
+        """
+        parts = [self.model._name, '__index__', 'registry', self.field.name]
+
+        if self.prefix:
+            parts.append(self.prefix)
+
+        if self.key:
+            parts.append(self.key)
+
+        return self.field.make_key(*parts)
+
     def union_filtered_in_keys(self, dest_key, *source_keys):
         """Do a union of the given `source_keys` at the redis level, into `dest_key`
 
@@ -720,7 +892,7 @@ class EqualIndex(BaseIndex):
         parts1.append('*')
         parts2.append('*')
 
-        return set(
+        keys = set(
             self.model.database.scan_keys(self.field.make_key(*parts1))
         ).union(
             set(
@@ -728,6 +900,102 @@ class EqualIndex(BaseIndex):
             )
         )
 
+        if self.registry:
+            keys.add(self.get_registry_key())
+
+        return keys
+
+    def get_all_values_keys(self):
+        """Return all the values indexed for the field, with the key of their set
+
+        If the index uses a registry, the values are read from it. Else the keys are found by
+        scanning the keys matching the keys used by this index, ignoring the keys of the other
+        indexes of the field, so it is slow on large databases.
+        Only for fields with only one part (not ``HashField``).
+
+        Returns
+        -------
+        Dict[str, str]
+            The key of the set of each normalized value
+
+        """
+        if self.registry:
+            return {
+                value: self.get_storage_key(value, transform_value=False)
+                for value in self.connection.zrange(self.get_registry_key(), 0, -1)
+            }
+
+        pattern = self.get_storage_key('*', transform_value=False)
+        prefix = pattern[:-1]
+
+        def iter_indexes(indexes):
+            for index in indexes:
+                sub_indexes = getattr(index, '_indexes', None)  # indexes composed of others
+                if sub_indexes is None:
+                    yield index
+                else:
+                    for sub_index in iter_indexes(sub_indexes):
+                        yield sub_index
+
+        # ignore keys of the other indexes of the same field: other equal indexes, with a
+        # longer prefix, and the storage keys of the other kinds of indexes
+        other_prefixes = []
+        other_keys = set()
+        for index in iter_indexes(self.field._indexes):
+            if index is self:
+                continue
+            if isinstance(index, EqualIndex):
+                other_prefix = index.get_storage_key('*', transform_value=False)[:-1]
+                if len(other_prefix) > len(prefix) and other_prefix.startswith(prefix):
+                    other_prefixes.append(other_prefix)
+            else:
+                other_keys.update(index.get_all_storage_keys())
+
+        keys = [
+            key for key in self.model.database.scan_keys(pattern)
+            if key not in other_keys and not any(key.startswith(other_prefix) for other_prefix in other_prefixes)
+        ]
+        if not keys:
+            return {}
+
+        # ignore keys of other kinds of indexes of the same field
+        with self.connection.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.type(key)
+            types = pipe.execute()
+
+        return {key[len(prefix):]: key for key, key_type in zip(keys, types) if key_type == 'set'}
+
+    def get_values_counts(self):
+        """Return all the values indexed for the field, with the number of instances for each
+
+        If the index uses a registry, the counts are read from it in one call. Else the keys
+        are found like in ``get_all_values_keys`` then counted.
+        Only for fields with only one part (not ``HashField``).
+
+        Returns
+        -------
+        Dict[str, int]
+            The number of instances for each normalized value
+
+        """
+        if self.registry:
+            return {
+                value: int(count)
+                for value, count in self.connection.zrange(self.get_registry_key(), 0, -1, withscores=True)
+            }
+
+        values_keys = sorted(self.get_all_values_keys().items())
+        if not values_keys:
+            return {}
+
+        with self.connection.pipeline(transaction=False) as pipe:
+            for __, key in values_keys:
+                pipe.scard(key)
+            counts = pipe.execute()
+
+        return {value: count for (value, __), count in zip(values_keys, counts) if count}
+
     def get_uniqueness_members(self, key):
         """Get from redis all the members of the given index `key` used to check for uniqueness.
 
@@ -782,6 +1050,8 @@ class EqualIndex(BaseIndex):
             The pk of the instance to save in the index.
         kwargs : Any
             This is the ``kwargs`` passed to ``.add``. May be used by subclasses.
+            If ``registry`` is ``True``, it contains ``registry_value``: the normalized value
+            whose count of instances is incremented in the registry.
 
         Returns
         -------
@@ -790,7 +1060,16 @@ class EqualIndex(BaseIndex):
             subclasses.
 
         """
-        self.connection.sadd(key, pk)
+        if self.registry:
+            self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['store'],
+                keys=[key, self.get_registry_key()],
+                args=[pk, kwargs['registry_value']],
+            )
+        else:
+            self.connection.sadd(key, pk)
         return True
 
     def unstore(self, key, pk, **kwargs):
@@ -803,7 +1082,10 @@ class EqualIndex(BaseIndex):
         pk : Any
             The pk of the instance to remove from the index.
         kwargs : Any
-            This is the ``kwargs`` passed to ``.add``. May be used by subclasses.
+            This is the ``kwargs`` passed to ``.remove``. May be used by subclasses.
+            If ``registry`` is ``True``, it contains ``registry_value``: the normalized value
+            whose count of instances is decremented in the registry (it is removed from the
+            registry when no more instances are indexed for it).
 
         Returns
         -------
@@ -812,7 +1094,16 @@ class EqualIndex(BaseIndex):
             subclasses.
 
         """
-        self.connection.srem(key, pk)
+        if self.registry:
+            self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['unstore'],
+                keys=[key, self.get_registry_key()],
+                args=[pk, kwargs['registry_value']],
+            )
+        else:
+            self.connection.srem(key, pk)
         return True
 
     def add(self, pk, *args, **kwargs):
@@ -830,6 +1121,9 @@ class EqualIndex(BaseIndex):
 
         # Do index => create a key to be able to retrieve parent pk with
         # current field value]
+        if self.registry:
+            kwargs['registry_value'] = self.normalize_value(args[-1])
+
         logger.debug("adding %s to index %s" % (pk, key))
         if self.store(key, pk, **kwargs):
             self._get_rollback_cache(pk)['indexed_values'].add(tuple(args))
@@ -842,18 +1136,66 @@ class EqualIndex(BaseIndex):
         """
 
         key = self.get_storage_key(*args)
+        if self.registry:
+            kwargs['registry_value'] = self.normalize_value(args[-1])
+
         logger.debug("removing %s from index %s" % (pk, key))
         if self.unstore(key, pk, **kwargs):
             self._get_rollback_cache(pk)['deindexed_values'].add(tuple(args))
 
 
 class BaseRangeIndex(BaseIndex):
-    """Base of indexes using sorted-set to do range filtering (lt, gte...)"""
+    """Base of indexes using sorted-set to do range filtering (lt, gte...)
+
+    Configurable attributes
+    -----------------------
+    These are class attributes that can be changed via ``configure``:
+
+    chunk_size : int
+        Default to ``None``: the primary keys matching a filter are copied from the sorted-set
+        to a temporary key in only one lua call, that may block redis for a long time for huge
+        ranges. If set, the copy is done in many calls, each one copying at most ``chunk_size``
+        members, letting redis serve other clients between them. In this case, the copy is not
+        atomic.
+
+    """
 
     handle_uniqueness = True
     lua_filter_script = NotImplemented
+    lua_filter_chunk_script = NotImplemented
     supported_key_types = {'set', 'zset'}
 
+    chunk_size = None
+    configurable_attrs = BaseIndex.configurable_attrs | {'chunk_size'}
+
+    @classmethod
+    def handle_configurable_attrs(cls, **kwargs):
+        """Handle attributes that can be passed to ``configure``.
+
+        This method handle the ``chunk_size`` attribute added in this index class.
+
+        For the parameters, see ``BaseIndex.handle_configurable_attrs``.
+
+        Raises
+        ------
+        ValueError
+            If ``chunk_size`` is not a positive integer
+
+        """
+
+        name, attrs, kwargs = super(BaseRangeIndex, cls).handle_configurable_attrs(**kwargs)
+        if 'chunk_size' in kwargs and 'chunk_size' in cls.configurable_attrs:
+            chunk_size = kwargs.pop('chunk_size')
+            if chunk_size is not None:
+                try:
+                    chunk_size = int(chunk_size)
+                except (ValueError, TypeError):
+                    chunk_size = 0
+                if chunk_size <= 0:
+                    raise ValueError('"chunk_size" must be a positive integer')
+            attrs['chunk_size'] = chunk_size
+        return name, attrs, kwargs
+
     def get_storage_key(self, *args):
         """Return the redis key where to store the index for the given "value" (`args`)
 
@@ -891,6 +1233,23 @@ class BaseRangeIndex(BaseIndex):
 
         return self.field.make_key(*parts)
 
+    def get_ordering_key(self, *args):
+        """Return the key of the sorted-set in which all pks are ordered by the value of the field
+
+        Parameters
+        -----------
+        args: tuple
+            The "values" to take into account to get the key, without the final value (so it's
+            empty except for fields with many parts, like ``HashField``)
+
+        Returns
+        -------
+        str
+            The redis key of the sorted-set
+
+        """
+        return self.get_storage_key(*(list(args) + [None]))
+
     def get_all_storage_keys(self):
         """Returns the keys to be removed by `clear` in aggressive mode
 
@@ -1100,6 +1459,16 @@ class BaseRangeIndex(BaseIndex):
             args=[key_type, start, end, exclude or ""] + list(args)  # None is refused by redis-py so we pass ""
         )
 
+    def copy_by_chunks(self, key, tmp_key, key_type, start, end, exclude):
+        """Copy the filtered pks in the temporary key by many calls of ``chunk_size`` members
+
+        Used instead of ``call_script`` if ``chunk_size`` is set.
+
+        For the parameters, see ``BaseRangeIndex.call_script``
+
+        """
+        raise NotImplementedError
+
     def get_filtered_keys(self, suffix, *args, **kwargs):
         """Returns the index key for the given args "value" (`args`)
 
@@ -1149,7 +1518,10 @@ class BaseRangeIndex(BaseIndex):
         real_suffix = self.remove_prefix(suffix)
 
         start, end, exclude = self.get_boundaries(real_suffix, value)
-        self.call_script(key, tmp_key, key_type, start, end, exclude)
+        if self.chunk_size:
+            self.copy_by_chunks(key, tmp_key, key_type, start, end, exclude)
+        else:
+            self.call_script(key, tmp_key, key_type, start, end, exclude)
 
         return [(tmp_key, key_type, True)]
 
@@ -1186,15 +1558,33 @@ class TextRangeIndex(BaseRangeIndex):
     ---------
     https://redis.io/topics/indexes#lexicographical-indexes
 
+    Configurable attributes
+    -----------------------
+    These are class attributes that can be changed via ``configure``:
+
+    compact : bool
+        Default to ``False``. When ``True``, the value and the pk are separated in the members
+        of the sorted-set by a single null byte instead of ``separator``, saving memory and
+        allowing the pk to be extracted faster. Values containing a null byte cannot then be
+        indexed. As the encoding differs, ``-compact`` is added to the key of the index
+        (except if a key is explicitly configured), so an index with the old encoding can be
+        kept while the compact one is built.
+
     """
 
     handled_suffixes = {None, 'eq', 'gt', 'gte', 'lt', 'lte', 'startswith', 'in'}
     key = 'text-range'
     separator = u':%s-SEPARATOR:' % key.upper()
+    ordering = 'lex'
+
+    compact = False
+    compact_separator = u'\x00'
+    configurable_attrs = BaseRangeIndex.configurable_attrs | {'compact'}
 
     lua_filter_script = {
         # we extract members of the sorted-set via zrangebylex
-        # then we split the value and pk, on the separator
+        # then we split the value and pk, on the separator (on the first one, without
+        # reversing the member, if the index is compact: the separator is then one char)
         # if the value is the one in exclude, we ignore it
         # and we add every pk to a set or zset depending on the asked type
         # if a zset, we use the returned position as a score for each member
@@ -1204,6 +1594,7 @@ class TextRangeIndex(BaseRangeIndex):
             local source_key, dest_type, dest_key = KEYS[1], ARGV[1], KEYS[2]
             local lex_start, lex_end = ARGV[2], ARGV[3]
             local exclude, separator = ARGV[4], ARGV[5]
+            local compact = separator:len() == 1
             local start, block_size = 0, 100
 
             while true do
@@ -1213,14 +1604,21 @@ class TextRangeIndex(BaseRangeIndex):
                 end
                 local result, nb_results = {}, 0;
                 for i, member in ipairs(members) do
-                    -- split to get value and pk (do it reverse to split on the last separator only)
-                    local first_pos, last_pos = member:reverse():find(separator:reverse(), 1, true)
-                    first_pos = member:len() - last_pos  -- real position of last separator
-
-                    -- only add if nothing to exclude, or the rest is not the exclude
-                    if not exclude or member:sub(1, first_pos) ~= exclude then
+                    if compact then
+                        -- the value cannot contain the separator: the pk is after the first one
+                        -- and there is never something to exclude
                         nb_results = nb_results + 1
-                        result[nb_results] = member:sub(first_pos + separator:len() + 1)
+                        result[nb_results] = member:sub(member:find(separator, 1, true) + 1)
+                    else
+                        -- split to get value and pk (do it reverse to split on the last separator only)
+                        local first_pos, last_pos = member:reverse():find(separator:reverse(), 1, true)
+                        first_pos = member:len() - last_pos  -- real position of last separator
+
+                        -- only add if nothing to exclude, or the rest is not the exclude
+                        if not exclude or member:sub(1, first_pos) ~= exclude then
+                            nb_results = nb_results + 1
+                            result[nb_results] = member:sub(first_pos + separator:len() + 1)
+                        end
                     end
                 end
                 -- call sadd/zadd only if we have something to put in
@@ -1248,6 +1646,75 @@ class TextRangeIndex(BaseRangeIndex):
         """
     }
 
+    lua_filter_chunk_script = {
+        # same as `lua_filter_script` but for only one block of `count` members,
+        # the scores of the zset starting at `rank`
+        # we return the number of members read, the number of pks added, and the
+        # last member read, to be used to start the next block
+        'lua': """
+            local source_key, dest_type, dest_key = KEYS[1], ARGV[1], KEYS[2]
+            local lex_start, lex_end = ARGV[2], ARGV[3]
+            local exclude, separator = ARGV[4], ARGV[5]
+            local compact = separator:len() == 1
+            local count, rank = tonumber(ARGV[6]), tonumber(ARGV[7])
+
+            local members = redis.call('zrangebylex', source_key, lex_start, lex_end, 'limit', 0, count)
+            local result, nb_results = {}, 0;
+            for i, member in ipairs(members) do
+                if compact then
+                    -- the value cannot contain the separator: the pk is after the first one
+                    -- and there is never something to exclude
+                    nb_results = nb_results + 1
+                    result[nb_results] = member:sub(member:find(separator, 1, true) + 1)
+                else
+                    -- split to get value and pk (do it reverse to split on the last separator only)
+                    local first_pos, last_pos = member:reverse():find(separator:reverse(), 1, true)
+                    first_pos = member:len() - last_pos  -- real position of last separator
+
+                    -- only add if nothing to exclude, or the rest is not the exclude
+                    if not exclude or member:sub(1, first_pos) ~= exclude then
+                        nb_results = nb_results + 1
+                        result[nb_results] = member:sub(first_pos + separator:len() + 1)
+                    end
+                end
+            end
+            if nb_results > 0 then
+                if dest_type == 'set' then
+                    redis.call('sadd', dest_key, unpack(result))
+                else
+                    local args = {}
+                    for i, member in ipairs(result) do
+                        args[2*i-1], args[2*i] = rank + i - 1, member
+                    end
+                    redis.call('zadd', dest_key, unpack(args))
+                end
+            end
+            return {#members, nb_results, members[#members] or ''}
+        """
+    }
+
+    @classmethod
+    def handle_configurable_attrs(cls, **kwargs):
+        """Handle attributes that can be passed to ``configure``.
+
+        This method handle the ``compact`` attribute added in this index class, that changes
+        the separator and, if not given, the key.
+
+        For the parameters, see ``BaseIndex.handle_configurable_attrs``.
+
+        """
+
+        name, attrs, kwargs = super(TextRangeIndex, cls).handle_configurable_attrs(**kwargs)
+        if 'compact' in kwargs and 'compact' in cls.configurable_attrs:
+            compact = attrs['compact'] = bool(kwargs.pop('compact'))
+            if compact != cls.compact:
+                if compact:
+                    attrs['separator'] = cls.compact_separator
+                    attrs.setdefault('key', u'%s-compact' % cls.key)
+                else:
+                    attrs['separator'] = TextRangeIndex.separator
+        return name, attrs, kwargs
+
     def prepare_data_to_store(self, pk, value, **kwargs):
         """Prepare the value to be stored in the zset
 
@@ -1256,8 +1723,18 @@ class TextRangeIndex(BaseRangeIndex):
         We add a string "value:pk" to the storage sorted-set, with a score of 0.
         Then when filtering will get then lexicographical ordered
         And we'll later be able to extract the pk for each returned values
+
+        Raises
+        ------
+        ValueError
+            If the index is ``compact`` and the value contains the separator
+
         """
         value = self.normalize_value(value)
+        if self.compact and self.separator in value:
+            raise ValueError('Invalid value %r for field %s.%s: a compact %s cannot index a null byte' % (
+                value, self.model.__name__, self.field.name, self.__class__.__name__
+            ))
         return self.separator.join([value, str(pk)]), 0
 
     def _extract_value_from_storage(self, string):
@@ -1283,7 +1760,7 @@ class TextRangeIndex(BaseRangeIndex):
 
         The third return value, ``exclude`` is ``None`` except for the filters
         `lt` and `gt` because we cannot explicitly exclude it when
-         querying the sorted-set
+         querying the sorted-set (except if the index is ``compact``)
 
         For the parameters, see BaseRangeIndex.store
 
@@ -1310,18 +1787,28 @@ class TextRangeIndex(BaseRangeIndex):
             end = start.encode('utf-8') + b'\xff'
 
         elif filter_type == 'gt':
-            # starting at the value, excluded
-            start = u'(%s' % value
-            exclude = value
+            if self.compact:
+                # values cannot contain the null separator, so all greater values
+                # are after the value followed by the next char
+                start = u'[%s\x01' % value
+            else:
+                # starting at the value, excluded
+                start = u'(%s' % value
+                exclude = value
 
         elif filter_type == 'gte':
             # starting at the value, included
             start = u'[%s' % value
 
         elif filter_type == 'lt':
-            # ending with the value, excluded
-            end = u'(%s' % value
-            exclude = value
+            if self.compact:
+                # values cannot contain the null separator, so all lesser values
+                # are before the value followed by the separator
+                end = u'(%s%s' % (value, self.separator)
+            else:
+                # ending with the value, excluded
+                end = u'(%s' % value
+                exclude = value
 
         elif filter_type == 'lte':
             # ending with the value, included (but not starting with, hence the separator)
@@ -1370,12 +1857,36 @@ class TextRangeIndex(BaseRangeIndex):
             key, tmp_key, key_type, start, end, exclude, *args
         )
 
+    def copy_by_chunks(self, key, tmp_key, key_type, start, end, exclude):
+        """Copy the filtered pks in the temporary key by many calls of ``chunk_size`` members
+
+        As members are unique, each block starts just after the last member of the
+        previous one, so redis does not have to skip the already read members.
+
+        For the parameters, see BaseRangeIndex.copy_by_chunks
+
+        """
+        rank = 0
+        while True:
+            nb_members, nb_added, last_member = self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.lua_filter_chunk_script,
+                keys=[key, tmp_key],
+                args=[key_type, start, end, exclude or "", self.separator, self.chunk_size, rank],
+            )
+            if nb_members < self.chunk_size:
+                break
+            rank += nb_added
+            start = u'(%s' % last_member
+
 
 class NumberRangeIndex(BaseRangeIndex):
 
     handled_suffixes = {None, 'eq', 'gt', 'gte', 'lt', 'lte', 'in'}
     key = 'number-range'
     raise_if_not_float = False
+    ordering = 'score'
 
     lua_filter_script = {
         # we extract members of the sorted-set via zrangebyscore
@@ -1418,6 +1929,39 @@ class NumberRangeIndex(BaseRangeIndex):
         """
     }
 
+    lua_filter_chunk_script = {
+        # same as `lua_filter_script` but for only one block of `count` members, after
+        # skipping `skip` ones, the scores of the zset starting at `rank`
+        # we return the number of members read, the last score read, and the number of
+        # members with this score, to be used to start the next block
+        'lua': """
+            local source_key, dest_type, dest_key = KEYS[1], ARGV[1], KEYS[2]
+            local score_start, score_end = ARGV[2], ARGV[3]
+            local skip, count, rank = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+
+            local members = redis.call('zrangebyscore', source_key, score_start, score_end,
+                                       'withscores', 'limit', skip, count)
+            local nb_members = #members / 2
+            if nb_members == 0 then
+                return {0, '', 0}
+            end
+            local pks, args, last_score, nb_last = {}, {}, members[#members], 0
+            for i = 1, nb_members do
+                pks[i] = members[2*i-1]
+                args[2*i-1], args[2*i] = rank + i - 1, pks[i]
+                if members[2*i] == last_score then
+                    nb_last = nb_last + 1
+                end
+            end
+            if dest_type == 'set' then
+                redis.call('sadd', dest_key, unpack(pks))
+            else
+                redis.call('zadd', dest_key, unpack(args))
+            end
+            return {nb_members, last_score, nb_last}
+        """
+    }
+
     def normalize_value(self, value, transform=True):
         """Prepare the given value to be stored in the index
 
@@ -1499,6 +2043,841 @@ class NumberRangeIndex(BaseRangeIndex):
         start, end, __ = self.get_boundaries(filter_type, value)  # we have nothing to exclude
         return self.connection.zrangebyscore(key, start, end)
 
+    def copy_by_chunks(self, key, tmp_key, key_type, start, end, exclude):
+        """Copy the filtered pks in the temporary key by many calls of ``chunk_size`` members
+
+        Each block starts at the last score of the previous one, only skipping the
+        members already read with this score, so redis does not have to skip all the
+        already read members.
+
+        For the parameters, see BaseRangeIndex.copy_by_chunks
+
+        """
+        skip = rank = 0
+        while True:
+            nb_members, last_score, nb_last = self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.lua_filter_chunk_script,
+                keys=[key, tmp_key],
+                args=[key_type, start, end, skip, self.chunk_size, rank],
+            )
+            if nb_members < self.chunk_size:
+                break
+            rank += nb_members
+            if last_score == start:
+                # all the members of the block have the same score as the previous block
+                skip += nb_last
+            else:
+                start, skip = last_score, nb_last
+
+
+class GeoIndex(BaseRangeIndex):
+    """Index allowing to filter on the distance to a point
+
+    The value of the field must be a longitude and a latitude, separated by a comma (a list or
+    tuple of two numbers returned by ``transform`` is also accepted). All pks of the field are
+    stored in a redis geo sorted-set, via ``GEOADD``. Values that are not valid coordinates
+    are not indexed.
+
+    The ``near`` suffix accepts a tuple ``(longitude, latitude, radius)``, the radius being in
+    kilometers, or ``(longitude, latitude, radius, unit)``, with ``unit`` being one of ``m``,
+    ``km``, ``mi`` and ``ft``.
+
+    If the collection accepts sorted-sets (like with ``ExtendedCollectionManager``), the
+    filtered pks are stored in a sorted-set with their distance to the point as score, so the
+    collection is ordered by distance if not sorted otherwise. Else they are stored in a set.
+
+    ``GEOSEARCH``/``GEOSEARCHSTORE`` are used on redis 6.2+, else ``GEORADIUS``, that needs
+    redis 3.2+.
+
+    """
+
+    handled_suffixes = {'near'}
+    handle_uniqueness = False
+    key = 'geo'
+    units = {'m', 'km', 'mi', 'ft'}
+    default_unit = 'km'
+
+    configurable_attrs = BaseRangeIndex.configurable_attrs - {'chunk_size'}
+
+    lua_filter_script = {
+        # store in a zset the members near the given point, with their distance as score,
+        # or in a set, by block of 1000 to avoid passing too many arguments to sadd
+        'lua': """
+            local source_key, dest_key = KEYS[1], KEYS[2]
+            local dest_type, use_search = ARGV[1], ARGV[2] == '1'
+            local longitude, latitude, radius, unit = ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+
+            if dest_type == 'zset' then
+                if use_search then
+                    redis.call('geosearchstore', dest_key, source_key, 'fromlonlat', longitude, latitude,
+                               'byradius', radius, unit, 'asc', 'storedist')
+                else
+                    redis.call('georadius', source_key, longitude, latitude, radius, unit,
+                               'asc', 'storedist', dest_key)
+                end
+            else
+                local members
+                if use_search then
+                    members = redis.call('geosearch', source_key, 'fromlonlat', longitude, latitude,
+                                         'byradius', radius, unit)
+                else
+                    members = redis.call('georadius', source_key, longitude, latitude, radius, unit)
+                end
+                for i = 1, #members, 1000 do
+                    redis.call('sadd', dest_key, unpack(members, i, math.min(i + 999, #members)))
+                end
+            end
+            -- return the key, because why not
+            return dest_key
+        """
+    }
+
+    def normalize_value(self, value, transform=True):
+        """Prepare the given value to be stored in the index
+
+        For the parameters, see BaseIndex.normalize_value
+
+        Returns
+        -------
+        Union[Tuple[float, float], None]
+            The longitude and latitude, or ``None`` if the value is not valid coordinates
+
+        """
+        if transform:
+            value = self.transform_value(value)
+        if isinstance(value, (list, tuple)):
+            parts = list(value)
+        else:
+            parts = str(self.field.from_python(value)).strip('()[] ').split(',')
+        try:
+            longitude, latitude = [float(part) for part in parts]
+        except (ValueError, TypeError):
+            return None
+        # limits of the coordinates accepted by redis
+        if not (-180 <= longitude <= 180 and -85.05112878 <= latitude <= 85.05112878):
+            return None
+        return longitude, latitude
+
+    def prepare_data_to_store(self, pk, value, **kwargs):
+        """Prepare the value to be stored in the geo sorted-set
+
+        For the parameters, see BaseRangeIndex.prepare_data_to_store
+
+        Returns
+        -------
+        str
+            The pk, as member of the sorted-set
+        Union[Tuple[float, float], None]
+            The coordinates, passed as "score" to ``store``, ``None`` if not valid.
+
+        """
+        return pk, self.normalize_value(value)
+
+    def store(self, key, member, score):
+        """Store data in the index in redis
+
+        For the parameters, see BaseRangeIndex.store, except that `score` is a tuple with the
+        longitude and latitude, to use with ``GEOADD``
+
+        """
+        if score is None:
+            return False
+        longitude, latitude = score
+        self.connection.execute_command('GEOADD', key, longitude, latitude, member)
+        return True
+
+    def parse_near_value(self, value):
+        """Get the arguments to use to filter from the value of a ``near`` filter
+
+        Parameters
+        ----------
+        value : Union[list, tuple]
+            The longitude, the latitude, the radius, and optionally the unit
+
+        Returns
+        -------
+        tuple
+            The longitude, latitude, radius and unit
+
+        Raises
+        ------
+        ValueError
+            If the value is not valid
+
+        """
+        try:
+            if len(value) == 3:
+                value = list(value) + [self.default_unit]
+            longitude, latitude, radius, unit = value
+            longitude, latitude, radius = float(longitude), float(latitude), float(radius)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid value for the "near" filter of %s.%s: %s. It must be '
+                             '(longitude, latitude, radius) or (longitude, latitude, radius, unit)' % (
+                                 self.model.__name__, self.field.name, value))
+        if unit not in self.units:
+            raise ValueError('Invalid unit for the "near" filter of %s.%s: %s. It must be one of %s' % (
+                self.model.__name__, self.field.name, unit, ', '.join(sorted(self.units))))
+        return longitude, latitude, radius, unit
+
+    def get_filtered_keys(self, suffix, *args, **kwargs):
+        """Return a temporary key with the pks near the point given in `args`
+
+        For the parameters, see ``BaseIndex.get_filtered_keys``
+
+        Notes
+        -----
+        Returns a sorted-set, with the distance as score, if accepted, else a set.
+
+        """
+        accepted_key_types = kwargs.get('accepted_key_types')
+        self._check_key_accepted_key_types(accepted_key_types)
+
+        key_type = 'zset' if accepted_key_types and 'zset' in accepted_key_types else 'set'
+        tmp_key = self._unique_key('tmp')
+        args = list(args)
+
+        longitude, latitude, radius, unit = self.parse_near_value(args[-1])
+        key = self.get_storage_key(*args)
+
+        self.model.database.call_script(
+            # be sure to use the script dict at the class level
+            # to avoid registering it many times
+            script_dict=self.__class__.lua_filter_script,
+            keys=[key, tmp_key],
+            args=[key_type, int(self.model.database.redis_version >= (6, 2)),
+                  longitude, latitude, radius, unit]
+        )
+
+        return [(tmp_key, key_type, True)]
+
+
+class TokenIndex(BaseIndex):
+    """Index allowing to filter on the words, or parts, of a text
+
+    The value is split in tokens, and the pk is stored in a set for each token. All the sets of
+    a value are updated with only one call to redis, via a lua script.
+
+    Handled suffixes:
+
+    - ``search``: entries having all the tokens of the filter value (so all the words with the
+      ``words`` tokenizer)
+    - ``contains`` (only with the ``trigrams`` tokenizer): entries containing the filter value
+    - ``icontains`` (only with the ``trigrams`` tokenizer, and if ``lowercase``): the same but
+      case insensitive
+
+    For ``contains`` and ``icontains``, the entries having all the trigrams of the filter value
+    are then checked, if ``verify`` is ``True``, by reading their values, to only keep the ones
+    really containing it. If the filter value is shorter than 3 chars, all the entries are read.
+
+    Configurable attributes
+    -----------------------
+    These are class attributes that can be changed via ``configure``:
+
+    tokenizer : Union[str, Callable]
+        Default to ``'words'``, to split the value on non-alphanumeric characters. Can be
+        ``'trigrams'`` to use all the sequences of 3 characters of the value, or a callable
+        accepting a value and returning its tokens.
+    lowercase : bool
+        Default to ``True``. If ``True``, values are lowercased before being tokenized.
+    verify : bool
+        Default to ``True``. If ``False``, the values of the entries found for ``contains`` and
+        ``icontains`` are not checked, which is faster but the results may contain false
+        positives. Only available for fields with only one part (not ``HashField``).
+
+    """
+
+    handle_uniqueness = False
+    key = 'token'
+    supported_key_types = {'set'}
+
+    tokenizer = 'words'
+    tokenizers = {'words', 'trigrams'}
+    lowercase = True
+    verify = True
+    configurable_attrs = BaseIndex.configurable_attrs | {'tokenizer', 'lowercase', 'verify'}
+
+    words_regex = re.compile(r'\w+', re.UNICODE)
+
+    scripts = {
+        'store': {
+            # add the pk to the set of each token
+            'lua': """
+                for _, key in ipairs(KEYS) do
+                    redis.call('sadd', key, ARGV[1])
+                end
+                return #KEYS
+            """
+        },
+        'unstore': {
+            # remove the pk from the set of each token
+            'lua': """
+                for _, key in ipairs(KEYS) do
+                    redis.call('srem', key, ARGV[1])
+                end
+                return #KEYS
+            """
+        },
+    }
+
+    @classmethod
+    def handle_configurable_attrs(cls, **kwargs):
+        """Handle attributes that can be passed to ``configure``.
+
+        This method handle the ``tokenizer``, ``lowercase`` and ``verify`` attributes added in
+        this index class.
+
+        For the parameters, see ``BaseIndex.handle_configurable_attrs``.
+
+        Raises
+        ------
+        ValueError
+            If the tokenizer is not one of ``tokenizers`` or a callable
+
+        """
+
+        name, attrs, kwargs = super(TokenIndex, cls).handle_configurable_attrs(**kwargs)
+        if 'tokenizer' in kwargs:
+            tokenizer = kwargs.pop('tokenizer')
+            if callable(tokenizer):
+                tokenizer = staticmethod(tokenizer)
+            elif tokenizer not in cls.tokenizers:
+                raise ValueError('"tokenizer" must be a callable or one of %s' % ', '.join(sorted(cls.tokenizers)))
+            attrs['tokenizer'] = tokenizer
+        for key in ('lowercase', 'verify'):
+            if key in kwargs:
+                attrs[key] = bool(kwargs.pop(key))
+        return name, attrs, kwargs
+
+    @classmethod
+    def _field_model_ready(cls, model, field):
+        """Check that the values can be verified, if asked, for the field
+
+        For the parameters, see ``BaseIndex._field_model_ready``.
+
+        Raises
+        ------
+        ImplementationError
+            If ``verify`` is ``True`` for a field with many parts (like a ``HashField``), and
+            the ``contains`` suffix is handled
+
+        """
+        super(TokenIndex, cls)._field_model_ready(model, field)
+
+        if cls.verify and cls.tokenizer == 'trigrams' and field._field_parts != 1:
+            raise ImplementationError("The index %s on %s.%s cannot verify values: the field has many parts" % (
+                cls.__name__,
+                model.__name__,
+                field.name,
+            ))
+
+    @property
+    def handled_suffixes(self):
+        """``contains`` and ``icontains`` can only be used with trigrams"""
+        if self.tokenizer != 'trigrams':
+            return {'search'}
+        if not self.lowercase:
+            return {'search', 'contains'}
+        return {'search', 'contains', 'icontains'}
+
+    def tokenize(self, value):
+        """Split the given normalized value in tokens
+
+        Parameters
+        ----------
+        value: str
+            The value, normalized, to tokenize
+
+        Returns
+        -------
+        Set[str]
+            The distinct tokens of the value
+
+        """
+        if self.lowercase:
+            value = value.lower()
+        if self.tokenizer == 'words':
+            tokens = self.words_regex.findall(value)
+        elif self.tokenizer == 'trigrams':
+            tokens = [value[i:i + 3] for i in range(len(value) - 2)]
+        else:
+            tokens = self.tokenizer(value)
+        return {str(token) for token in tokens if token}
+
+    def get_storage_key(self, *args):
+        """Return the redis key of the set of the token given as the last entry of `args`
+
+        Key has this form:
+        model-name:__index__:token:field-name:sub-field-name:the-token
+        The ':sub-field-name part' is repeated for each entry in *args that is not the token.
+        The keys are in the ``__index__`` namespace, so they cannot be the ones used by an
+        ``EqualIndex`` for a value of the field.
+
+        Parameters
+        -----------
+        args: tuple
+            All the "values" to take into account to get the storage key, the last one being
+            the token.
+
+        Returns
+        -------
+        str
+            The redis key to use
+
+        """
+
+        args = list(args)
+        token = args.pop()
+
+        parts = [
+            self.model._name,
+            '__index__',
+            self.key,
+            self.field.name,
+        ] + args
+
+        if self.prefix:
+            parts.append(self.prefix)
+
+        parts.append(token)
+
+        return self.field.make_key(*parts)
+
+    def get_storage_keys(self, *args):
+        """Return the redis keys of the sets of all the tokens of the value (`args`)
+
+        For the parameters, see ``BaseIndex.add``
+
+        Returns
+        -------
+        List[str]
+            The keys, sorted, for each token of the value
+
+        """
+        args = list(args)
+        tokens = self.tokenize(self.normalize_value(args.pop()))
+        return sorted(self.get_storage_key(*(args + [token])) for token in tokens)
+
+    def get_all_storage_keys(self):
+        """Returns the keys to be removed by `clear` in aggressive mode
+
+        For the parameters, see BaseIndex.get_all_storage_keys
+
+        """
+
+        parts1 = [
+            self.model._name,
+            '__index__',
+            self.key,
+            self.field.name,
+        ]
+
+        parts2 = parts1 + ['*']  # for indexes taking args, like for hashfields
+
+        if self.prefix:
+            parts1.append(self.prefix)
+            parts2.append(self.prefix)
+
+        parts1.append('*')
+        parts2.append('*')
+
+        return set(
+            self.model.database.scan_keys(self.field.make_key(*parts1))
+        ).union(
+            set(
+                self.model.database.scan_keys(self.field.make_key(*parts2))
+            )
+        )
+
+    def add(self, pk, *args, **kwargs):
+        """Add the instance tied to the field for the given "value" (via `args`) to the index
+
+        For the parameters, see ``BaseIndex.add``
+
+        """
+
+        keys = self.get_storage_keys(*args)
+        if keys:
+            logger.debug("adding %s to %s keys of index %s" % (pk, len(keys), self.__class__.__name__))
+            self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['store'],
+                keys=keys,
+                args=[pk],
+            )
+        self._get_rollback_cache(pk)['indexed_values'].add(tuple(args))
+
+    def remove(self, pk, *args, **kwargs):
+        """Remove the instance tied to the field for the given "value" (via `args`) from the index
+
+        For the parameters, see ``BaseIndex.remove``
+
+        """
+
+        keys = self.get_storage_keys(*args)
+        if keys:
+            logger.debug("removing %s from %s keys of index %s" % (pk, len(keys), self.__class__.__name__))
+            self.model.database.call_script(
+                # be sure to use the script dict at the class level
+                # to avoid registering it many times
+                script_dict=self.__class__.scripts['unstore'],
+                keys=keys,
+                args=[pk],
+            )
+        self._get_rollback_cache(pk)['deindexed_values'].add(tuple(args))
+
+    def get_filtered_keys(self, suffix, *args, **kwargs):
+        """Return a temporary set with the pks matching the filter
+
+        For the parameters, see ``BaseIndex.get_filtered_keys``
+
+        Notes
+        -----
+        The sets of all the tokens of the filter value are intersected with ``SINTERSTORE``.
+
+        Raises
+        ------
+        ValueError
+            - If the filter value has no token for the ``search`` suffix
+            - If the filter value is shorter than 3 chars for ``contains`` or
+              ``icontains`` without ``verify``
+
+        """
+        self._check_key_accepted_key_types(kwargs.get('accepted_key_types'))
+
+        args = list(args)
+        value = self.normalize_value(args.pop(), transform=False)
+        real_suffix = self.remove_prefix(suffix)
+        verify = self.verify and real_suffix in ('contains', 'icontains')
+
+        token_keys = [self.get_storage_key(*(args + [token])) for token in self.tokenize(value)]
+        if not token_keys:
+            if not verify:
+                raise ValueError('No token found in "%s" to filter on %s.%s with the %s suffix' % (
+                    value, self.model.__name__, self.field.name, real_suffix))
+            # too short to have tokens: all the entries will be checked
+            token_keys = [self.model.get_field('pk').collection_key]
+
+        tmp_key = self._unique_key('tmp')
+        self.connection.sinterstore(tmp_key, token_keys)
+
+        if verify:
+            self.verify_values(tmp_key, value, real_suffix == 'icontains')
+
+        return [(tmp_key, 'set', True)]
+
+    def verify_values(self, key, value, case_insensitive):
+        """Remove from the set the pks of the entries not containing the value
+
+        The values of all the pks are read with only one ``SORT`` command (or one pipeline for
+        fields of models using buckets).
+
+        Parameters
+        ----------
+        key: str
+            The key of the set with the pks to check
+        value: str
+            The normalized value that must be contained in the values of the entries
+        case_insensitive: bool
+            If the check must ignore the case
+
+        """
+        if case_insensitive:
+            value = value.lower()
+
+        pattern = self.field.sort_wildcard
+        if is_bucket_pattern(pattern):
+            # SORT cannot read the values of fields of models using buckets
+            pks = list(self.connection.smembers(key))
+            with self.connection.pipeline(transaction=False) as pipe:
+                for pk in pks:
+                    pipe.hget(*resolve_pattern(pattern, pk))
+                results = [item for entry in zip(pks, pipe.execute()) for item in entry]
+        else:
+            results = self.connection.sort(key, by='nosort', get=['#', pattern])
+        excluded = []
+        for pk, entry_value in zip(results[::2], results[1::2]):
+            if entry_value is not None:
+                entry_value = self.normalize_value(entry_value)
+                if case_insensitive:
+                    entry_value = entry_value.lower()
+                if value in entry_value:
+                    continue
+            excluded.append(pk)
+
+        if excluded:
+            self.connection.srem(key, *excluded)
+
+
+class PresenceIndex(BaseIndex):
+    """Index allowing to filter on the presence of a value, with the ``isnull`` suffix
+
+    The pks of all the instances having a value for the field are stored in one set.
+
+    - ``isnull=False``: this set is used directly, without any temporary key
+    - ``isnull=True``: a temporary set is computed with ``SDIFFSTORE``, with the pks of the
+      model that are not in this set
+
+    Only for fields holding a single value (or a single value for each sub-field, like
+    ``HashField``), not for ``SetField``, ``ListField`` and ``SortedSetField``.
+
+    """
+
+    handled_suffixes = {'isnull'}
+    handle_uniqueness = False
+    key = 'presence'
+    supported_key_types = {'set'}
+
+    @classmethod
+    def _field_model_ready(cls, model, field):
+        """Check that the field holds only one value
+
+        For the parameters, see ``BaseIndex._field_model_ready``.
+
+        Raises
+        ------
+        ImplementationError
+            If the field can hold many values, like a ``SetField``
+
+        """
+        super(PresenceIndex, cls)._field_model_ready(model, field)
+
+        from limpyd.fields import MultiValuesField  # avoid circular import
+        if isinstance(field, MultiValuesField) and field._field_parts == 1:
+            raise ImplementationError("The index %s cannot be used on %s.%s: the field holds many values" % (
+                cls.__name__,
+                model.__name__,
+                field.name,
+            ))
+
+    @staticmethod
+    def parse_isnull_value(value):
+        """Convert the value passed to the ``isnull`` filter to a bool
+
+        Parameters
+        ----------
+        value: Union[bool, int, str]
+            ``True``, ``False``, ``1``, ``0``, or these values as strings
+
+        Returns
+        -------
+        bool
+            The value as a bool
+
+        Raises
+        ------
+        ValueError
+            If the value cannot be converted
+
+        """
+        if isinstance(value, bool):
+            return value
+        normalized = str(value).lower()
+        if normalized in ('1', 'true'):
+            return True
+        if normalized in ('0', 'false'):
+            return False
+        raise ValueError('"%s" is not a valid value for the isnull filter' % value)
+
+    def get_storage_key(self, *args):
+        """Return the redis key of the set of the pks having a value
+
+        Key has this form:
+        model-name:__index__:presence:field-name:sub-field-name
+        The ':sub-field-name part' is repeated for each entry in *args.
+        The key is in the ``__index__`` namespace, so it cannot be the one used by an
+        ``EqualIndex`` for a value of the field.
+
+        Parameters
+        -----------
+        args: tuple
+            All the "values" to take into account to get the storage key, without the value
+            itself, for example the sub-field name in case of a ``HashField``.
+
+        Returns
+        -------
+        str
+            The redis key to use
+
+        """
+
+        parts = [
+            self.model._name,
+            '__index__',
+            self.key,
+            self.field.name,
+        ] + list(args)
+
+        if self.prefix:
+            parts.append(self.prefix)
+
+        return self.field.make_key(*parts)
+
+    def get_all_storage_keys(self):
+        """Returns the keys to be removed by `clear` in aggressive mode
+
+        For the parameters, see BaseIndex.get_all_storage_keys
+
+        """
+
+        parts1 = [
+            self.model._name,
+            '__index__',
+            self.key,
+            self.field.name,
+        ]
+
+        parts2 = parts1 + ['*']  # for indexes taking args, like for hashfields
+
+        if self.prefix:
+            parts1.append(self.prefix)
+            parts2.append(self.prefix)
+
+        return set(
+            self.model.database.scan_keys(self.field.make_key(*parts1))
+        ).union(
+            set(
+                self.model.database.scan_keys(self.field.make_key(*parts2))
+            )
+        )
+
+    def add(self, pk, *args, **kwargs):
+        """Add the instance tied to the field for the given "value" (via `args`) to the index
+
+        For the parameters, see ``BaseIndex.add``
+
+        """
+
+        key = self.get_storage_key(*args[:-1])
+        logger.debug("adding %s to index %s" % (pk, key))
+        self.connection.sadd(key, pk)
+        self._get_rollback_cache(pk)['indexed_values'].add(tuple(args))
+
+    def remove(self, pk, *args, **kwargs):
+        """Remove the instance tied to the field for the given "value" (via `args`) from the index
+
+        For the parameters, see ``BaseIndex.remove``
+
+        """
+
+        key = self.get_storage_key(*args[:-1])
+        logger.debug("removing %s from index %s" % (pk, key))
+        self.connection.srem(key, pk)
+        self._get_rollback_cache(pk)['deindexed_values'].add(tuple(args))
+
+    def get_filtered_keys(self, suffix, *args, **kwargs):
+        """Return the set of the pks having a value, or a temporary set of the ones without
+
+        For the parameters, see ``BaseIndex.get_filtered_keys``
+
+        """
+        self._check_key_accepted_key_types(kwargs.get('accepted_key_types'))
+
+        args = list(args)
+        isnull = self.parse_isnull_value(args.pop())
+        key = self.get_storage_key(*args)
+
+        if not isnull:
+            return [(key, 'set', False)]
+
+        tmp_key = self._unique_key('tmp')
+        self.connection.sdiffstore(tmp_key, [self.model.get_field('pk').collection_key, key])
+        return [(tmp_key, 'set', True)]
+
+
+class SortIndex(BaseRangeIndex):
+    """Index only used to sort collections on a field, without calling the ``SORT`` command
+
+    All pks are stored in a sorted-set, by score (the value, as a float) or, if ``alpha`` is
+    ``True``, lexicographically (with the value and the pk, separated by a null byte, as member,
+    so a value is always before the longer values starting with it, like with ``SORT``; values
+    containing a null byte cannot then be indexed).
+    When a collection is sorted by the field (with the same ``alpha`` value), the filtered
+    pks are ordered using this sorted-set, and only the wanted slice is returned.
+
+    This index cannot be used to filter: add another index to the field for that.
+
+    Configurable attributes
+    -----------------------
+    These are class attributes that can be changed via ``configure``:
+
+    alpha : bool
+        ``False`` by default, to sort numerically. Set to ``True`` to sort lexicographically.
+        Must match the ``alpha`` argument passed to the ``sort`` method of the collection.
+
+    """
+
+    handled_suffixes = set()
+    handle_uniqueness = False
+    key = 'sort'
+    separator = u'\x00'
+    use_for_sort = True
+
+    alpha = False
+    configurable_attrs = (BaseRangeIndex.configurable_attrs - {'chunk_size'}) | {'alpha'}
+
+    @classmethod
+    def handle_configurable_attrs(cls, **kwargs):
+        """Handle attributes that can be passed to ``configure``.
+
+        This method handle the ``alpha`` attribute added in this index class.
+
+        For the parameters, see ``BaseIndex.handle_configurable_attrs``.
+
+        """
+
+        name, attrs, kwargs = super(SortIndex, cls).handle_configurable_attrs(**kwargs)
+        if 'alpha' in kwargs:
+            attrs['alpha'] = bool(kwargs.pop('alpha'))
+        return name, attrs, kwargs
+
+    @property
+    def ordering(self):
+        """The sorted-set is ordered lexicographically if ``alpha``, else by score"""
+        return 'lex' if self.alpha else 'score'
+
+    def normalize_value(self, value, transform=True):
+        """Prepare the given value to be stored in the index
+
+        For the parameters, see BaseIndex.normalize_value
+
+        If not ``alpha``, the value is casted to a float, or 0 if not possible.
+
+        """
+        value = super(SortIndex, self).normalize_value(value, transform)
+        if self.alpha:
+            return value
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return 0
+
+    def prepare_data_to_store(self, pk, value, **kwargs):
+        """Prepare the value to be stored in the zset
+
+        For the parameters, see BaseRangeIndex.prepare_data_to_store
+
+        If ``alpha``, the member is "value\\x00pk", with a score of 0, like in a compact
+        ``TextRangeIndex``. Else the member is the pk and the score the value, like in
+        ``NumberRangeIndex``.
+
+        Raises
+        ------
+        ValueError
+            If ``alpha`` and the value contains the separator
+
+        """
+        value = self.normalize_value(value)
+        if self.alpha:
+            if self.separator in value:
+                raise ValueError('Invalid value %r for field %s.%s: an alpha %s cannot index a null byte' % (
+                    value, self.model.__name__, self.field.name, self.__class__.__name__
+                ))
+            return self.separator.join([value, str(pk)]), 0
+        return pk, value
+
 
 class _MultiFieldsIndexMixin(object):
     """Mixin for multi-fields indexing"""
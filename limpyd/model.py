@@ -11,10 +11,11 @@ import inspect
 import threading
 
 from limpyd.fields import *
+from limpyd.fields import FieldLock, SingleValueField
 from limpyd.utils import make_key
 from limpyd.exceptions import *
 from limpyd.database import RedisDatabase
-from limpyd.collection import CollectionManager
+from limpyd.collection import CollectionManager, PreparedCollection
 
 __all__ = ['RedisModel', ]
 
@@ -124,6 +125,13 @@ class MetaRedisModel(MetaRedisProxy):
         if pk_field.name != 'pk':
             it._redis_attr_pk = getattr(it, "_redis_attr_%s" % pk_field.name)
 
+        # Buckets are computed from the pk, that must be an integer
+        if it.bucket_size is not None:
+            if not isinstance(it.bucket_size, int) or isinstance(it.bucket_size, bool) or it.bucket_size < 1:
+                raise ImplementationError('"bucket_size" of %s must be a positive integer' % name)
+            if not isinstance(pk_field, AutoPKField):
+                raise ImplementationError('%s must use an AutoPKField to use buckets' % name)
+
         # Tell index classes that fields are now ready
         for field in it.get_fields():
             if field is it._redis_attr_pk:
@@ -137,6 +145,28 @@ class MetaRedisModel(MetaRedisProxy):
             for index in field._indexes if not index.filter_single_field
         ]
 
+        # For each field used in the conditions of partial indexes, the fields having these indexes
+        it._partial_indexes_fields = defaultdict(set)
+        for field in it.get_fields():
+            for index in field._indexes:
+                for condition_field_name in index.only_if or ():
+                    if not it.has_field(condition_field_name):
+                        raise ImplementationError("%s is not an existing field for the condition of the index %s on %s.%s" % (
+                            condition_field_name,
+                            index.__class__.__name__,
+                            it.__name__,
+                            field.name,
+                        ))
+                    condition_field = it.get_field(condition_field_name)
+                    if not isinstance(condition_field, SingleValueField) or isinstance(condition_field, PKField):
+                        raise ImplementationError("Index %s on %s.%s must use single value fields in its condition, not a %s" % (
+                            index.__class__.__name__,
+                            it.__name__,
+                            field.name,
+                            condition_field.__class__.__name__,
+                        ))
+                    it._partial_indexes_fields[condition_field_name].add(field.name)
+
         return it
 
 
@@ -151,6 +181,9 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
     collection_manager = CollectionManager
     DoesNotExist = DoesNotExist
     default_indexes = None
+    # If set, InstanceHashFields of instances are stored in hashes shared by
+    # this number of instances (see `key`), using less memory
+    bucket_size = None
 
     available_getters = {'hmget', 'hgetall', 'hkeys', 'hvals', 'hlen', }
     available_modifiers = {'hmset', 'hdel', }
@@ -382,11 +415,22 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
                 field.proxy_set(field.default)
 
     @classmethod
-    def collection(cls, manager=None, **filters):
+    def collection(cls, *q_filters, **filters):
+        manager = filters.pop('manager', None)
         if not manager:
             manager = cls.collection_manager
         collection = manager(cls)
-        return collection(**filters)
+        return collection(*q_filters, **filters)
+
+    @classmethod
+    def prepare_collection(cls, *filter_keys, **options):
+        """
+        Return a ``PreparedCollection`` for the given filter keys, to be
+        executed many times with different values, without parsing the filters
+        again. Accepted options are ``manager`` and ``sort``.
+        See ``limpyd.collection.PreparedCollection``.
+        """
+        return PreparedCollection(cls, filter_keys, **options)
 
     @classmethod
     def instances(cls, lazy=False, **filters):
@@ -498,6 +542,18 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
     # --- Hash management
     @property
     def key(self):
+        """
+        The key of the hash holding the InstanceHashFields of the instance. If
+        the model has a `bucket_size`, it's a hash shared by many instances,
+        the bucket of the instance being its pk divided by this size, and the
+        names of the fields in this hash are prefixed by the pk.
+        """
+        if self.bucket_size:
+            return self.make_key(
+                self._name,
+                "bucket",
+                int(self.pk.get()) // self.bucket_size,
+            )
         return self.make_key(
             self._name,
             self.pk.get(),
@@ -508,13 +564,59 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
     def sort_wildcard(cls):
         """
         Used to sort Hashfield. See Hashfield.sort_widlcard.
-        """
+        If the model has a `bucket_size`, the `*` is followed by it, and the
+        pattern cannot be used by the redis SORT command (see
+        `limpyd.utils.is_bucket_pattern`)
+        """
+        if cls.bucket_size:
+            return cls.make_key(
+                cls._name,
+                "bucket",
+                "*/%d" % cls.bucket_size,
+            )
         return cls.make_key(
             cls._name,
             "*",
             "hash",
         )
 
+    def _hash_fields(self, field_names):
+        """
+        Return the names in the hash of the instance of the given
+        InstanceHashFields (prefixed by the pk if the model has a `bucket_size`)
+        """
+        if not self.bucket_size:
+            return list(field_names)
+        pk = self.pk.get()
+        return [self.make_key(pk, field_name) for field_name in field_names]
+
+    def _call_hash_getter(self, command, *args, **kwargs):
+        """
+        If the model has a `bucket_size`, the hash is shared by many instances,
+        so `hgetall`, `hkeys`, `hvals` and `hlen` are computed from the values
+        of all the InstanceHashFields of the instance, read with `hmget`.
+        """
+        if not self.bucket_size:
+            return self._traverse_command(command, *args, **kwargs)
+
+        values = self._traverse_command('hmget', self._hash_fields(self._instancehash_fields))
+        if not isinstance(values, list):  # in a pipeline
+            return values
+
+        data = {
+            field_name: value
+            for field_name, value in zip(self._instancehash_fields, values)
+            if value is not None
+        }
+        if command == 'hkeys':
+            return list(data)
+        if command == 'hvals':
+            return list(data.values())
+        if command == 'hlen':
+            return len(data)
+        return data
+    _call_hgetall = _call_hkeys = _call_hvals = _call_hlen = _call_hash_getter
+
     def hmget(self, *args):
         """
         This command on the model allow getting many instancehash fields with only
@@ -523,7 +625,15 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
         if args and not any(arg in self._instancehash_fields for arg in args):
             raise ValueError("Only InstanceHashField can be used here.")
 
-        return self._call_command('hmget', args)
+        result = self._call_command('hmget', self._hash_fields(args))
+
+        if isinstance(result, list):  # not in a pipeline
+            result = [
+                self.get_field(field_name)._value_from_redis(value)
+                for field_name, value in zip(args, result)
+            ]
+
+        return result
 
     def hmset(self, **kwargs):
         """
@@ -548,7 +658,13 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
                     field.index(value)
 
             # Call redis (waits for a dict)
-            result = self._call_command('hmset', kwargs)
+            result = self._call_command('hmset', {
+                hash_field: self.get_field(field_name)._value_to_redis(value)
+                if self.get_field(field_name).converts_values else value
+                for hash_field, (field_name, value) in zip(self._hash_fields(kwargs), iteritems(kwargs))
+            })
+
+            self._update_partial_indexes(kwargs)
 
             return result
 
@@ -578,7 +694,49 @@ class RedisModel(with_metaclass(MetaRedisModel, RedisProxyCommand)):
                 field.deindex()
 
         # Return the number of fields really deleted
-        return self._call_command('hdel', *args)
+        result = self._call_command('hdel', *self._hash_fields(args))
+
+        self._update_partial_indexes(args)
+
+        return result
+
+    def _update_partial_indexes(self, field_names):
+        """
+        Add the instance to, or remove it from, the partial indexes (ones with
+        `only_if`) having a condition on one of the given fields, depending on
+        the current values of the fields in their conditions.
+        Must be called after the update of these fields.
+        """
+        field_names = set(field_names)
+        indexed_field_names = set()
+        for field_name in field_names:
+            indexed_field_names.update(self._partial_indexes_fields.get(field_name, ()))
+        if not indexed_field_names:
+            return
+
+        pk = self.pk.get()
+        for field_name in sorted(indexed_field_names):
+            field = self.get_field(field_name)
+            indexes = [
+                index for index in field._indexes
+                if index.only_if and not field_names.isdisjoint(index.only_if)
+            ]
+            with FieldLock(field):
+                values = field._prepare_index_data(pk)
+                for index in indexes:
+                    # adding and removing are safe if already done, so we don't need the
+                    # previous state of the conditions
+                    matches = index.matches_condition(pk)
+                    try:
+                        for parts in values:
+                            if parts[-1] is None:
+                                continue
+                            if matches:
+                                index.add(pk, *parts, check_uniqueness=False)
+                            else:
+                                index.remove(pk, *parts)
+                    finally:
+                        index._reset_rollback_cache(pk)
 
     def delete(self):
         """
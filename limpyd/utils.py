@@ -31,8 +31,9 @@ def unique_key(connection, prefix=None):
 
     Parameters
     ----------
-    connection : Redis
-        The redis connection on which to ensure the key does not exist
+    connection : Optional[Redis]
+        The redis connection on which to ensure the key does not exist. If ``None``, the
+        existence is not checked and must be done by the caller
     prefix : Optional[str]
         If set, the key will be prefixed with this prefix (separated from the generated part with
         a `:`
@@ -47,11 +48,59 @@ def unique_key(connection, prefix=None):
         key = str(uuid.uuid4().hex)
         if prefix:
             key = make_key(prefix, key)
-        if not connection.exists(key):
+        if connection is None or not connection.exists(key):
             break
     return key
 
 
+def is_bucket_pattern(pattern):
+    """Tell if the given ``SORT`` pattern is the one of a field of a model using buckets.
+
+    Such patterns (``model:bucket:*/<bucket size>->*:field``) have a ``*`` in the hash
+    field part, and cannot be used by the redis ``SORT`` command.
+
+    Parameters
+    ----------
+    pattern : str
+        The pattern, as used in the ``BY`` and ``GET`` arguments of ``SORT``
+
+    Returns
+    -------
+    bool
+        ``True`` if the pattern is the one of a field of a model using buckets
+
+    """
+    return '*' in pattern.partition('->')[2]
+
+
+def resolve_pattern(pattern, pk):
+    """Return the key, and the hash field, read for a pk by a ``SORT`` pattern.
+
+    Patterns of fields of models using buckets (see ``is_bucket_pattern``) are supported.
+
+    Parameters
+    ----------
+    pattern : str
+        The pattern, as used in the ``BY`` and ``GET`` arguments of ``SORT``
+    pk : str
+        The primary key to use in place of the ``*``
+
+    Returns
+    -------
+    Tuple[str, Optional[str]]
+        The key, and the field to read in this key if it's a hash, else ``None``
+
+    """
+    key, arrow, hash_field = pattern.partition('->')
+    if '*' in hash_field:
+        prefix, __, bucket_size = key.partition('*/')
+        key = prefix + str(int(pk) // int(bucket_size))
+        hash_field = hash_field.replace('*', str(pk), 1)
+    else:
+        key = key.replace('*', str(pk), 1)
+    return key, (hash_field if arrow else None)
+
+
 def normalize(value):
     """
     Simple method to always have the same kind of value
@@ -8,7 +8,10 @@ import unittest
 from redis.exceptions import ResponseError
 
 from limpyd import fields
-from limpyd.collection import CollectionManager, CollectionResults
+from limpyd.collection import (CollectionManager, CollectionResults, PkInFilter, PreparedCollection, Q,
+                               Count, Sum, Avg, Min, Max)
+from limpyd.contrib.indexes import MultiIndexes
+from limpyd.indexes import EqualIndex, NumberRangeIndex, PresenceIndex, TextRangeIndex, SortIndex
 from limpyd.exceptions import *
 
 from .base import LimpydBaseTest, TEST_CONNECTION_SETTINGS
@@ -217,6 +220,220 @@ class CollectionTest(CollectionBaseTest):
         self.assertEqual({'1', '2', '3', '4'}, Boat.collection())
 
 
+class QTest(CollectionBaseTest):
+    """
+    Test filtering with ``Q`` expressions and ``exclude``.
+    """
+
+    def test_q_should_or_filters(self):
+        collection = Boat.collection(Q(launched=1898) | Q(power='engine'))
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat4._pk})
+        self.assertEqual(len(collection), 2)
+
+    def test_q_should_and_filters(self):
+        collection = Boat.collection(Q(power='sail') & Q(launched=1964))
+        self.assertSetEqual(set(collection), {self.boat2._pk})
+        collection = Boat.collection(Q(power='sail', launched=1964))
+        self.assertSetEqual(set(collection), {self.boat2._pk})
+
+    def test_q_should_be_and_ed_with_other_filters(self):
+        collection = Boat.collection(Q(launched=1898) | Q(launched=1955), power='sail')
+        self.assertSetEqual(set(collection), {self.boat1._pk})
+
+    def test_q_could_be_negated(self):
+        collection = Boat.collection(~Q(power='sail'))
+        self.assertSetEqual(set(collection), {self.boat4._pk})
+        collection = Boat.collection(Q(launched=1898) | ~Q(power='sail'))
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat4._pk})
+        collection = Boat.collection(Q(power='sail') & ~Q(launched=1898))
+        self.assertSetEqual(set(collection), {self.boat2._pk, self.boat3._pk})
+
+    def test_q_could_be_nested(self):
+        collection = Boat.collection(
+            (Q(launched=1898) | Q(launched=1966) | Q(power='engine')) & ~Q(name='Pen Duick III')
+        )
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat4._pk})
+
+    def test_q_could_filter_on_pk(self):
+        collection = Boat.collection(Q(pk=self.boat1._pk) | Q(power='engine'))
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat4._pk})
+        # a pk that does not exist is not returned
+        collection = Boat.collection(Q(pk=1000) | Q(power='engine'))
+        self.assertSetEqual(set(collection), {self.boat4._pk})
+        collection = Boat.collection(Q(pk=self.boat1._pk) & Q(pk=self.boat2._pk))
+        self.assertSetEqual(set(collection), set())
+
+    def test_exclude_should_remove_matching_entries(self):
+        collection = Boat.collection().exclude(power='engine')
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat2._pk, self.boat3._pk})
+        collection = Boat.collection(power='sail').exclude(launched=1898)
+        self.assertSetEqual(set(collection), {self.boat2._pk, self.boat3._pk})
+        # many filters in exclude are and-ed
+        collection = Boat.collection().exclude(power='sail', launched=1898)
+        self.assertSetEqual(set(collection), {self.boat2._pk, self.boat3._pk, self.boat4._pk})
+        collection = Boat.collection().exclude(Q(launched=1898) | Q(launched=1964))
+        self.assertSetEqual(set(collection), {self.boat3._pk, self.boat4._pk})
+
+    def test_exclude_should_work_with_sort_and_slice(self):
+        collection = Boat.collection().exclude(launched=1898).sort(by='-launched')
+        self.assertEqual(list(collection), [self.boat3._pk, self.boat2._pk, self.boat4._pk])
+        self.assertEqual(collection[1:], [self.boat2._pk, self.boat4._pk])
+
+    def test_exclude_should_work_with_pk(self):
+        collection = Boat.collection(pk=self.boat1._pk).exclude(power='sail')
+        self.assertSetEqual(set(collection), set())
+        collection = Boat.collection(pk=self.boat1._pk).exclude(power='engine')
+        self.assertSetEqual(set(collection), {self.boat1._pk})
+
+    def test_q_should_not_leave_temporary_keys(self):
+        nb_keys = self.count_keys()
+        collection = Boat.collection(
+            (Q(launched=1898) | ~Q(power='sail')) & ~Q(launched=1955)
+        ).exclude(launched=1966)
+        self.assertSetEqual(set(collection), {self.boat1._pk})
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_q_should_be_computed_in_redis(self):
+        collection = Boat.collection(Q(launched=1898) | Q(power='engine')).exclude(launched=1955)
+        # EXISTS + SUNIONSTORE for the "or", EXISTS + SDIFFSTORE for the exclusion,
+        # DEL of the "or" key, SMEMBERS, then DEL of the final key
+        with self.assertNumCommands(7):
+            self.assertSetEqual(set(collection), {self.boat1._pk})
+
+    def test_filters_or_q_must_be_parsed(self):
+        with self.assertRaises(ImplementationError):
+            Boat.collection(Q(launched=1898) | Q(length=15.1))
+        with self.assertRaises(ValueError):
+            Boat.collection({'launched': 1898})
+        with self.assertRaises(ValueError):
+            Q({'launched': 1898})
+        with self.assertRaises(TypeError):
+            Q(launched=1898) | {'launched': 1898}
+
+    def test_q_repr(self):
+        self.assertEqual(repr(Q(launched=1898) | ~Q(power='sail')),
+                         "(OR: (AND: launched=1898), (NOT (AND: power=%r)))" % 'sail')
+
+
+class FetchInOneCallTest(CollectionBaseTest):
+    """
+    Test the ``fetch`` lua script used to fetch filtered collections.
+    """
+
+    def assertSameAsWithoutScript(self, collection_getter):
+        result = collection_getter()
+        try:
+            CollectionManager.FETCH_IN_ONE_CALL = False
+            self.assertEqual(collection_getter(), result)
+        finally:
+            CollectionManager.FETCH_IN_ONE_CALL = True
+        return result
+
+    def test_filtered_sorted_sliced_collection_should_be_fetched_in_one_call(self):
+        collection = Boat.collection(power='sail', launched__in=[1898, 1966]).sort(by='-launched')
+        # EXISTS + SUNIONSTORE for the `in` filter (done by the index), then EVALSHA, running:
+        #   EXISTS final_key
+        #   SINTERSTORE final_key index_key tmp_key
+        #   SORT final_key BY launched LIMIT 0 1 DESC
+        #   DEL final_key tmp_key
+        with self.assertNumCommands(7):
+            self.assertEqual(collection[0:1], [self.boat3._pk])
+
+    def test_results_should_be_the_same_as_without_script(self):
+        self.assertSetEqual(
+            self.assertSameAsWithoutScript(lambda: set(Boat.collection(power='sail', launched=1898))),
+            {self.boat1._pk}
+        )
+        self.assertListEqual(
+            self.assertSameAsWithoutScript(lambda: list(
+                Boat.collection(power='sail', launched__in=[1898, 1964, 1966]).sort(by='-launched'))),
+            [self.boat3._pk, self.boat2._pk, self.boat1._pk]
+        )
+        self.assertListEqual(
+            self.assertSameAsWithoutScript(lambda: list(
+                Boat.collection(power='sail', launched__in=[1898, 1964, 1966]).sort(by='name', alpha=True)[1:])),
+            [self.boat2._pk, self.boat3._pk]
+        )
+        self.assertListEqual(
+            self.assertSameAsWithoutScript(lambda: [boat._pk for boat in
+                Boat.collection(Q(launched=1898) | Q(power='engine')).instances().sort()]),
+            [self.boat1._pk, self.boat4._pk]
+        )
+        self.assertSetEqual(
+            self.assertSameAsWithoutScript(lambda: set(Boat.collection(power='sail', launched=2000))),
+            set()
+        )
+
+    def test_temporary_keys_should_be_deleted(self):
+        nb_keys = self.count_keys()
+        collection = Boat.collection(Q(launched=1898) | Q(launched=1964), power='sail')
+        self.assertSetEqual(set(collection), {self.boat1._pk, self.boat2._pk})
+        self.assertEqual(self.count_keys(), nb_keys)
+
+
+class PreparedCollectionTest(CollectionBaseTest):
+    """
+    Test collections prepared with ``prepare_collection``.
+    """
+
+    def test_prepared_collection_should_return_same_results_as_collection(self):
+        prepared = Boat.prepare_collection('power', 'launched__in')
+        self.assertIsInstance(prepared, PreparedCollection)
+        self.assertSetEqual(set(prepared.execute(power='sail', launched__in=[1898, 1955, 1966])),
+                            set(Boat.collection(power='sail', launched__in=[1898, 1955, 1966])))
+        self.assertSetEqual(set(prepared.execute(power='engine', launched__in=[1955])),
+                            {self.boat4._pk})
+
+    def test_prepared_collection_should_be_sorted(self):
+        prepared = Boat.prepare_collection('power', sort='-launched')
+        self.assertListEqual(list(prepared.execute(power='sail')),
+                             [self.boat3._pk, self.boat2._pk, self.boat1._pk])
+        self.assertEqual(prepared.execute(power='sail')[1:],
+                             [self.boat2._pk, self.boat1._pk])
+        prepared = Boat.prepare_collection('power', sort={'by': 'name', 'alpha': True})
+        self.assertListEqual(list(prepared.execute(power='sail')),
+                             [self.boat1._pk, self.boat2._pk, self.boat3._pk])
+
+    def test_prepared_collection_could_be_chained(self):
+        prepared = Boat.prepare_collection('pk', 'power')
+        collection = prepared.execute(pk=self.boat1._pk, power='sail').instances()
+        self.assertListEqual([boat._pk for boat in collection], [self.boat1._pk])
+        self.assertListEqual(list(prepared.execute(pk=self.boat1._pk, power='engine')), [])
+
+    def test_filters_should_be_parsed_only_once(self):
+        calls = []
+        original_parse_filter_key = CollectionManager._parse_filter_key
+
+        def parse_filter_key(manager, key):
+            calls.append(key)
+            return original_parse_filter_key(manager, key)
+
+        CollectionManager._parse_filter_key = parse_filter_key
+        try:
+            prepared = Boat.prepare_collection('power', 'launched')
+            for launched in (1898, 1964, 1966):
+                self.assertEqual(len(prepared.execute(power='sail', launched=launched)), 1)
+        finally:
+            CollectionManager._parse_filter_key = original_parse_filter_key
+
+        self.assertListEqual(calls, ['power', 'launched'])
+
+    def test_prepare_collection_should_raise_for_invalid_filters(self):
+        with self.assertRaises(ImplementationError):
+            Boat.prepare_collection('length')
+        with self.assertRaises(ValueError):
+            Boat.prepare_collection('power', 'power')
+
+    def test_execute_should_raise_if_values_do_not_match_filters(self):
+        prepared = Boat.prepare_collection('power', 'launched')
+        with self.assertRaises(ValueError):
+            prepared.execute(power='sail')
+        with self.assertRaises(ValueError):
+            prepared.execute(power='sail', launched=1898, name='Pen Duick I')
+        with self.assertRaises(ValueError):
+            prepared.execute(power='sail', name='Pen Duick I')
+
+
 class SliceTest(CollectionBaseTest):
     """
     Test slicing of a collection
@@ -600,11 +817,12 @@ class LenTest(CollectionBaseTest):
                 # So we have 3 additional redis call: 1 SCARD + 2 EXPIRE
                 self.assertSetEqual(set(collection), {'1'})
         else:
-            with self.assertNumCommands(4):
-                # EXISTS tmp_key
-                # SINTERSTORE tmp_key index_key1 index_key2
-                # SORT tmp_key
-                # DEL tmp_key
+            with self.assertNumCommands(5):
+                # EVALSHA, running:
+                #   EXISTS tmp_key
+                #   SINTERSTORE tmp_key index_key1 index_key2
+                #   SORT tmp_key
+                #   DEL tmp_key
                 self.assertSetEqual(set(collection), {'1'})
 
         with self.assertNumCommands(0):
@@ -634,5 +852,550 @@ class LenTest(CollectionBaseTest):
             self.assertEqual(len(list(collection)), 3)
 
 
+class IteratorTest(CollectionBaseTest):
+
+    def test_iterator_should_return_all_entries(self):
+        for chunk_size in (1, 2, 3, 4, 10):
+            self.assertEqual(set(Boat.collection().iterator(chunk_size)), {'1', '2', '3', '4'})
+            self.assertEqual(set(Boat.collection(power="sail").iterator(chunk_size)), {'1', '2', '3'})
+
+    def test_iterator_should_keep_sort(self):
+        collection = Boat.collection().sort(by='launched')
+        for chunk_size in (1, 2, 3, 4, 10):
+            self.assertEqual(list(collection.iterator(chunk_size)), ['1', '4', '2', '3'])
+        collection = Boat.collection(power="sail").sort(by='-launched')
+        for chunk_size in (1, 2, 3, 4, 10):
+            self.assertEqual(list(collection.iterator(chunk_size)), ['3', '2', '1'])
+
+    def test_iterator_should_ignore_slicing(self):
+        collection = Boat.collection().sort()
+        self.assertEqual(collection[1:2], ['2'])
+        self.assertEqual(list(collection.iterator(3)), ['1', '2', '3', '4'])
+
+    def test_sorted_iterator_should_sort_by_chunk(self):
+        collection = Boat.collection(power="sail").sort(by='launched')
+        with self.assertNumCommands(2):
+            # SORT index_key LIMIT 0 2
+            # SORT index_key LIMIT 2 2
+            self.assertEqual(list(collection.iterator(2)), ['1', '2', '3'])
+        collection = Boat.collection(power="sail", launched__in=[1898, 1964, 1966]).sort(by='launched')
+        with self.assertNumCommands(10):
+            # EXISTS tmp_key
+            # SUNIONSTORE tmp_key index_key1 index_key2 index_key3
+            # EXISTS final_set
+            # SINTERSTORE final_set index_key tmp_key
+            # DEL tmp_key
+            # SORT final_set LIMIT 0 2
+            # EXPIRE final_set
+            # SORT final_set LIMIT 2 2
+            # EXPIRE final_set
+            # DEL final_set
+            self.assertEqual(list(collection.iterator(2)), ['1', '2', '3'])
+
+    def test_iterator_should_delete_temporary_final_set(self):
+        keys_before = self.count_keys()
+        iterator = Boat.collection(power="sail", launched=1898).sort(by='launched').iterator(1)
+        self.assertEqual(next(iterator), '1')
+        self.assertEqual(self.count_keys(), keys_before + 1)
+        self.assertEqual(list(iterator), [])
+        self.assertEqual(self.count_keys(), keys_before)
+
+    def test_iterator_should_work_with_pk(self):
+        self.assertEqual(list(Boat.collection(pk=2).iterator()), ['2'])
+        self.assertEqual(list(Boat.collection(pk=2, power="sail").iterator()), ['2'])
+        self.assertEqual(list(Boat.collection(pk=4, power="sail").iterator()), [])
+        self.assertEqual(list(Boat.collection(pk=10).iterator()), [])
+
+    def test_iterator_should_return_instances(self):
+        instances = list(Boat.collection(power="sail").sort(by='launched').instances().iterator(2))
+        self.assertEqual([boat._pk for boat in instances], ['1', '2', '3'])
+        self.assertTrue(all(boat.connected for boat in instances))
+        self.assertEqual(instances[1].name.get(), "Pen Duick II")
+
+    def test_iterator_should_check_instances_in_one_call_by_chunk(self):
+        collection = Boat.collection().instances()
+        with self.assertNumCommands(5):
+            # SSCAN collection_key (small set: all returned at once)
+            # SISMEMBER collection_key pk (x4, all sent in one pipeline)
+            instances = list(collection.iterator())
+        self.assertEqual({boat._pk for boat in instances}, {'1', '2', '3', '4'})
+
+    def test_iterator_should_skip_non_existing_instances(self):
+        # add a fake pk in the collection index
+        self.connection.sadd(Boat.get_field('power')._indexes[0].get_storage_key('sail'), 100)
+        instances = list(Boat.collection(power="sail").instances().iterator())
+        self.assertEqual({boat._pk for boat in instances}, {'1', '2', '3'})
+        instances = list(Boat.collection(power="sail").instances(lazy=True).iterator())
+        self.assertEqual({boat._pk for boat in instances}, {'1', '2', '3', '100'})
+        self.assertFalse(any(boat.connected for boat in instances))
+
+    def test_iterator_should_refuse_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            Boat.collection().iterator(0)
+
+
+class PagedBoat(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[TextRangeIndex.configure(compact=True)])
+    power = fields.StringField(indexable=True, default="sail")
+    length = fields.StringField(indexable=True, indexes=[NumberRangeIndex])
+    launched = fields.StringField(indexable=True, indexes=[
+        TextRangeIndex, NumberRangeIndex.configure(prefix='double', transform=lambda value: float(value) * 2)])
+
+
+class AfterTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(AfterTest, self).setUp()
+        PagedBoat(name="Pen Duick I", length=15.1, launched=1898)
+        PagedBoat(name="Pen Duick II", length=13.6, launched=1964)
+        PagedBoat(name="Pen Duick III", length=17.45, launched=1966)
+        PagedBoat(name="Rainbow Warrior I", power="engine", length=40, launched=1955)
+        PagedBoat(name="Rainbow Warrior II", power="engine", length=17.45, launched=1957)
+        PagedBoat(name="Pen Duick IV", length=20)  # same length as nothing else
+
+    def get_all_pages(self, collection, limit):
+        pages = []
+        page = collection.after(limit=limit)
+        pages.append(page.results)
+        while page.cursor:
+            page = collection.after(page.cursor, limit=limit)
+            pages.append(page.results)
+        return pages
+
+    def test_after_should_return_pages_ordered_by_score(self):
+        collection = PagedBoat.collection().sort(by='length')
+        page = collection.after(limit=2)
+        self.assertEqual(page.results, ['2', '1'])
+        self.assertIsNotNone(page.cursor)
+        page = collection.after(page.cursor, limit=2)
+        self.assertEqual(page.results, ['3', '5'])
+        page = collection.after(page.cursor, limit=2)
+        self.assertEqual(page.results, ['6', '4'])
+        self.assertIsNone(page.cursor)
+
+    def test_after_should_handle_ties_on_score(self):
+        collection = PagedBoat.collection().sort(by='length')
+        for limit in (1, 2, 3, 4, 5, 6, 10):
+            pages = self.get_all_pages(collection, limit)
+            self.assertEqual(sum(pages, []), ['2', '1', '3', '5', '6', '4'])
+            self.assertTrue(all(len(page) <= limit for page in pages))
+
+    def test_after_should_work_in_reverse_order(self):
+        collection = PagedBoat.collection().sort(by='-length')
+        for limit in (1, 2, 3, 10):
+            self.assertEqual(sum(self.get_all_pages(collection, limit), []), ['4', '6', '5', '3', '1', '2'])
+
+    def test_after_should_return_pages_ordered_lexicographically(self):
+        collection = PagedBoat.collection().sort(by='name', alpha=True)
+        for limit in (1, 2, 4, 10):
+            self.assertEqual(sum(self.get_all_pages(collection, limit), []), ['1', '2', '3', '6', '4', '5'])
+        collection = PagedBoat.collection().sort(by='-name', alpha=True)
+        for limit in (1, 2, 4, 10):
+            self.assertEqual(sum(self.get_all_pages(collection, limit), []), ['5', '4', '6', '3', '2', '1'])
+
+    def test_after_should_apply_filters(self):
+        collection = PagedBoat.collection(power="sail").sort(by='length')
+        for limit in (1, 2, 3, 10):
+            self.assertEqual(sum(self.get_all_pages(collection, limit), []), ['2', '1', '3', '6'])
+        collection = PagedBoat.collection(power="engine", length__lt=20).sort(by='-name', alpha=True)
+        self.assertEqual(sum(self.get_all_pages(collection, 1), []), ['5'])
+        collection = PagedBoat.collection(power="submarine").sort(by='length')
+        self.assertEqual(collection.after(), ([], None))
+
+    def test_after_should_work_with_pk(self):
+        collection = PagedBoat.collection(pk=3).sort(by='length')
+        self.assertEqual(collection.after(), (['3'], None))
+        collection = PagedBoat.collection(pk=3, power="engine").sort(by='length')
+        self.assertEqual(collection.after(), ([], None))
+        collection = PagedBoat.collection(pk=30).sort(by='length')
+        self.assertEqual(collection.after(), ([], None))
+
+    def test_after_should_not_sort_the_whole_collection(self):
+        collection = PagedBoat.collection(power="sail").sort(by='length')
+        with self.assertNumCommands(6):
+            # EVALSHA page_after_script length_key power_key ...
+            # then in the script:
+            # TYPE power_key
+            # ZRANGEBYSCORE length_key -inf +inf WITHSCORES LIMIT 0 100
+            # SISMEMBER power_key pk (x3: 2 for the page, 1 to know if there is a next one)
+            page = collection.after(limit=2)
+        self.assertEqual(page.results, ['2', '1'])
+        with self.assertNumCommands(7):
+            # EVALSHA page_after_script length_key power_key ...
+            # then in the script:
+            # TYPE power_key
+            # ZRANGEBYSCORE length_key 15.1 +inf WITHSCORES LIMIT 0 100
+            # SISMEMBER power_key pk (x4: the cursor is skipped without check)
+            page = collection.after(page.cursor, limit=2)
+        self.assertEqual(page, (['3', '6'], None))
+
+    def test_after_should_not_leave_temporary_keys(self):
+        keys_before = self.count_keys()
+        PagedBoat.collection(power="sail", length__in=[15.1, 20]).sort(by='length').after()
+        PagedBoat.collection(pk=1).sort(by='length').after()
+        self.assertEqual(self.count_keys(), keys_before)
+
+    def test_after_should_return_instances(self):
+        page = PagedBoat.collection(power="sail").sort(by='length').instances().after(limit=2)
+        self.assertEqual([boat._pk for boat in page.results], ['2', '1'])
+        self.assertEqual(page.results[0].name.get(), "Pen Duick II")
+
+    def test_after_should_refuse_invalid_arguments(self):
+        collection = PagedBoat.collection().sort(by='length')
+        with self.assertRaises(ValueError):
+            collection.after(limit=0)
+        with self.assertRaises(ValueError):
+            collection.after('foo')
+        with self.assertRaises(ValueError):
+            PagedBoat.collection().after()
+        with self.assertRaises(ValueError):
+            PagedBoat.collection().sort().after()
+        with self.assertRaises(ImplementationError):
+            PagedBoat.collection().sort(by='power').after()
+
+    def test_after_should_use_an_index_ordered_like_the_collection(self):
+        # numeric index on "length": cannot be used for a lexicographic sort
+        with self.assertRaises(ImplementationError):
+            PagedBoat.collection().sort(by='length', alpha=True).after()
+        # lexicographic index on "name": cannot be used for a numeric sort
+        with self.assertRaises(ImplementationError):
+            PagedBoat.collection().sort(by='name').after()
+        # not compact TextRangeIndex, misordering values starting with another one, and
+        # NumberRangeIndex with a transform: cannot be used
+        with self.assertRaises(ImplementationError):
+            PagedBoat.collection().sort(by='launched', alpha=True).after()
+        with self.assertRaises(ImplementationError):
+            PagedBoat.collection().sort(by='launched').after()
+
+
+class SortedBoat(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[SortIndex.configure(alpha=True)])
+    power = fields.StringField(indexable=True, default="sail")
+    length = fields.StringField(indexable=True, indexes=[SortIndex])
+
+
+class SortIndexTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(SortIndexTest, self).setUp()
+        SortedBoat(name="Pen Duick I", length=15.1)
+        SortedBoat(name="Pen Duick II", length=13.6)
+        SortedBoat(name="Pen Duick III", length=17.45)
+        SortedBoat(name="Rainbow Warrior I", power="engine", length=40)
+        SortedBoat(name="Rainbow Warrior II", power="engine", length=17.45)
+        SortedBoat(power="sail")  # no name nor length: not in the sort indexes
+
+    def assertSameAsSort(self, collection, by, alpha):
+        """Check that the collection returns the same as the SORT command for all slices"""
+        field = SortedBoat.get_field(by.lstrip('-'))
+        expected = self.connection.sort(collection._get_final_set(collection._lazy_collection['sets'], None, None)[0],
+                                        by=field.sort_wildcard, alpha=alpha, desc=by.startswith('-'))
+        self.assertEqual(list(collection.sort(by=by, alpha=alpha)), expected)
+        for start in range(-len(expected), len(expected)):
+            self.assertEqual(collection.sort(by=by, alpha=alpha)[start], expected[start])
+        for start in range(-7, 8):
+            for stop in range(-7, 8):
+                self.assertEqual(collection.sort(by=by, alpha=alpha)[start:stop], expected[start:stop])
+        self.assertEqual(list(collection.sort(by=by, alpha=alpha).iterator(4)), expected)
+
+    def test_sort_by_score_should_use_the_index(self):
+        collection = SortedBoat.collection().sort(by='length')
+        with self.assertNumCommands(7):
+            # EXISTS tmp_key
+            # EVALSHA sort_by_index_script collection_key length_key tmp_key tmp_set_key ...
+            # then in the script:
+            # TYPE collection_key
+            # ZINTERSTORE tmp_key 2 collection_key length_key WEIGHTS 0 1
+            # ZUNIONSTORE tmp_key 2 collection_key tmp_key WEIGHTS 0 1
+            # ZRANGE tmp_key 0 1
+            # DEL tmp_key
+            self.assertEqual(collection[:2], ['6', '2'])
+        # like with SORT, entries without value are sorted with a value of 0
+        self.assertEqual(list(SortedBoat.collection().sort(by='length')), ['6', '2', '1', '3', '5', '4'])
+        self.assertEqual(list(SortedBoat.collection().sort(by='-length')), ['4', '5', '3', '1', '2', '6'])
+
+    def test_sort_lexicographically_should_use_the_index(self):
+        # like with SORT, entries without value are first
+        self.assertEqual(list(SortedBoat.collection().sort(by='name', alpha=True)), ['6', '1', '2', '3', '4', '5'])
+        collection = SortedBoat.collection().sort(by='-name', alpha=True)
+        with self.assertNumCommands(10):
+            # EXISTS tmp_key
+            # EVALSHA sort_by_index_script collection_key name_key tmp_key tmp_set_key ...
+            # then in the script:
+            # TYPE collection_key
+            # SCARD collection_key
+            # ZREVRANGE name_key 0 99
+            # SISMEMBER collection_key pk (x5, all entries of the block)
+            self.assertEqual(collection[1:3], ['4', '3'])
+
+    def test_values_starting_with_another_one_should_be_sorted_like_sort(self):
+        for name in ('a', 'a1', 'a b', 'ab', 'b', 'a\t', 'a:'):
+            SortedBoat(name=name, power="prefix")
+        for by in ('name', '-name'):
+            # without filter, the index is used
+            self.assertSameAsSort(SortedBoat.collection(), by, True)
+            # with a filter, the index is used if desc, else SORT is used
+            self.assertSameAsSort(SortedBoat.collection(power="prefix"), by, True)
+        self.assertEqual(list(SortedBoat.collection(power="prefix").sort(by='name', alpha=True)),
+                         ['7', '12', '9', '8', '13', '10', '11'])
+
+    def test_filtered_ascending_lexicographic_sort_should_use_sort(self):
+        # the whole index would have to be read to count the entries not in it: SORT is used
+        collection = SortedBoat.collection(power="sail").sort(by='name', alpha=True)
+        with self.assertNumCommands(1):
+            # SORT power_sail_key BY name_wildcard ALPHA LIMIT 0 2
+            self.assertEqual(collection[:2], ['6', '1'])
+        with self.assertNumCommands(1):
+            # SORT power_sail_key BY name_wildcard ALPHA
+            self.assertEqual(list(collection), ['6', '1', '2', '3'])
+
+    def test_sort_with_index_should_work_like_sort(self):
+        for by in ('length', '-length'):
+            self.assertSameAsSort(SortedBoat.collection(), by, False)
+            self.assertSameAsSort(SortedBoat.collection(power="sail"), by, False)
+        for by in ('name', '-name'):
+            self.assertSameAsSort(SortedBoat.collection(), by, True)
+            self.assertSameAsSort(SortedBoat.collection(power="sail"), by, True)
+
+    def test_filters_should_be_applied(self):
+        self.assertEqual(list(SortedBoat.collection(power="sail").sort(by='length')), ['6', '2', '1', '3'])
+        self.assertEqual(list(SortedBoat.collection(power="engine").sort(by='-name', alpha=True)), ['5', '4'])
+        self.assertEqual(list(SortedBoat.collection(power="submarine").sort(by='length')), [])
+        self.assertEqual(list(SortedBoat.collection(pk=3).sort(by='length')), ['3'])
+        self.assertEqual(list(SortedBoat.collection(pk=3, power="sail").sort(by='name', alpha=True)), ['3'])
+        self.assertEqual(list(SortedBoat.collection(pk=3, power="engine").sort(by='length')), [])
+
+    def test_sort_not_matching_the_index_should_use_sort(self):
+        # no alpha index on "length": SORT is used
+        collection = SortedBoat.collection().sort(by='length', alpha=True)
+        with self.assertNumCommands(1):
+            # SORT collection_key BY length_wildcard ALPHA
+            self.assertEqual(list(collection), ['6', '2', '1', '3', '5', '4'])
+
+    def test_sort_with_index_should_return_instances(self):
+        boats = SortedBoat.collection(power="sail").sort(by='-length').instances()[:2]
+        self.assertEqual([boat.name.get() for boat in boats], ["Pen Duick III", "Pen Duick I"])
+        boats = SortedBoat.collection(power="sail").sort(by='name', alpha=True).instances()[:2]
+        self.assertEqual([boat.name.get() for boat in boats], [None, "Pen Duick I"])
+
+    def test_sort_with_index_should_not_leave_temporary_keys(self):
+        keys_before = self.count_keys()
+        list(SortedBoat.collection(power="sail").sort(by='length'))
+        list(SortedBoat.collection(power="sail").sort(by='name', alpha=True))
+        self.assertEqual(self.count_keys(), keys_before)
+
+
+class Invoice(TestRedisModel):
+    status = fields.InstanceHashField(indexable=True)
+    amount = fields.InstanceHashField(indexable=True, indexes=[NumberRangeIndex])
+    discount = fields.StringField()
+    lines = fields.ListField()
+
+
+class AggregateTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(AggregateTest, self).setUp()
+        Invoice(status='paid', amount=10, discount=1)
+        Invoice(status='paid', amount=25.5)
+        Invoice(status='paid', amount=4, discount='none')
+        Invoice(status='draft', amount=100, discount=3)
+
+    def test_aggregations_should_be_computed(self):
+        self.assertDictEqual(Invoice.collection().aggregate(
+            nb=Count(), total=Sum('amount'), average=Avg('amount'), nb_discounts=Count('discount'),
+            discounts=Sum('discount'), smallest=Min('amount'), biggest=Max('amount'),
+            smallest_discount=Min('discount'), biggest_discount=Max('discount'),
+        ), {
+            'nb': 4, 'total': 139.5, 'average': 34.875, 'nb_discounts': 2,
+            'discounts': 4.0, 'smallest': 4.0, 'biggest': 100.0,
+            'smallest_discount': 1.0, 'biggest_discount': 3.0,
+        })
+
+    def test_aggregations_should_use_filters(self):
+        self.assertDictEqual(Invoice.collection(status='paid').aggregate(
+            nb=Count(), total=Sum('amount'), smallest=Min('amount'), biggest=Max('amount'),
+        ), {'nb': 3, 'total': 39.5, 'smallest': 4.0, 'biggest': 25.5})
+        self.assertDictEqual(Invoice.collection(status='paid', amount__gt=5).aggregate(
+            nb=Count(), average=Avg('amount'),
+        ), {'nb': 2, 'average': 17.75})
+        self.assertDictEqual(Invoice.collection(pk=2).aggregate(nb=Count(), total=Sum('amount')),
+                             {'nb': 1, 'total': 25.5})
+
+    def test_min_and_max_should_use_the_range_index(self):
+        # EVALSHA, TYPE, SMEMBERS, then ZCARD and ZRANGE (or ZREVRANGE) on the index
+        with self.assertNumCommands(7):
+            self.assertDictEqual(Invoice.collection().aggregate(smallest=Min('amount'), biggest=Max('amount')),
+                                 {'smallest': 4.0, 'biggest': 100.0})
+        # with a filter matching few invoices, ZSCORE is used for each one instead
+        # EVALSHA, TYPE, SMEMBERS, ZCARD, and 3 ZSCORE
+        for index in range(10):
+            Invoice(status='other', amount=index)
+        with self.assertNumCommands(7):
+            self.assertDictEqual(Invoice.collection(status='paid').aggregate(biggest=Max('amount')),
+                                 {'biggest': 25.5})
+        self.assertDictEqual(Invoice.collection(status='draft').aggregate(biggest=Max('amount')),
+                             {'biggest': 100.0})
+        # with many invoices, the index is walked until one is in the collection
+        self.assertDictEqual(Invoice.collection(status='other').aggregate(smallest=Min('amount'), biggest=Max('amount')),
+                             {'smallest': 0.0, 'biggest': 9.0})
+
+    def test_empty_collection_should_have_no_values(self):
+        self.assertDictEqual(Invoice.collection(status='cancelled').aggregate(
+            nb=Count(), total=Sum('amount'), biggest=Max('amount'),
+        ), {'nb': 0, 'total': None, 'biggest': None})
+        self.assertDictEqual(Invoice.collection(pk=1000).aggregate(nb=Count(), total=Sum('amount')),
+                             {'nb': 0, 'total': None})
+
+    def test_temporary_keys_should_be_deleted(self):
+        nb_keys = self.count_keys()
+        Invoice.collection(status='paid', amount__gt=5).aggregate(total=Sum('amount'))
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_invalid_aggregations_should_raise(self):
+        with self.assertRaises(ValueError):
+            Sum()
+        with self.assertRaises(ValueError):
+            Invoice.collection().aggregate(total='amount')
+        with self.assertRaises(ImplementationError):
+            Invoice.collection().aggregate(total=Sum('lines'))
+
+
+
+class FacetedBoat(TestRedisModel):
+    power = fields.InstanceHashField(indexable=True, indexes=[
+        EqualIndex,
+        EqualIndex.configure(prefix='upper', transform=lambda value: value.upper()),
+    ])
+    length = fields.InstanceHashField(indexable=True, indexes=[EqualIndex, NumberRangeIndex])
+    launched = fields.InstanceHashField(indexable=True, indexes=[NumberRangeIndex])
+    name = fields.InstanceHashField(indexable=True, indexes=[
+        EqualIndex,
+        PresenceIndex,
+        MultiIndexes.compose([
+            EqualIndex.configure(prefix='lower', transform=lambda value: value.lower()),
+            NumberRangeIndex,
+        ]),
+    ])
+
+
+class FacetCountsTest(CollectionBaseTest):
+
+    def test_facet_counts_should_count_entries_by_value(self):
+        self.assertDictEqual(Boat.collection().facet_counts('power', 'launched'), {
+            'power': {'sail': 3, 'engine': 1},
+            'launched': {'1898': 1, '1964': 1, '1966': 1, '1955': 1},
+        })
+
+    def test_facet_counts_should_use_filters(self):
+        self.assertDictEqual(Boat.collection(launched__in=[1898, 1955]).facet_counts('power'),
+                             {'power': {'sail': 1, 'engine': 1}})
+        self.assertDictEqual(Boat.collection(power='sail').facet_counts('power', 'launched'), {
+            'power': {'sail': 3},
+            'launched': {'1898': 1, '1964': 1, '1966': 1},
+        })
+        self.assertDictEqual(Boat.collection(pk=self.boat4._pk).facet_counts('power'),
+                             {'power': {'engine': 1}})
+        self.assertDictEqual(Boat.collection(power='foo').facet_counts('power'), {'power': {}})
+
+    def test_facet_counts_should_not_leave_temporary_keys(self):
+        nb_keys = self.count_keys()
+        Boat.collection(launched__in=[1898, 1955]).facet_counts('power')
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_facet_counts_should_ignore_keys_of_other_indexes(self):
+        FacetedBoat(power='sail', length=10, launched=1900)
+        FacetedBoat(power='sail', length=12, launched=1910)
+        FacetedBoat(power='engine', length=10, launched=1920)
+        self.assertDictEqual(FacetedBoat.collection().facet_counts('power', 'length'), {
+            'power': {'sail': 2, 'engine': 1},
+            'length': {'10': 2, '12': 1},
+        })
+
+    def test_facet_counts_should_ignore_keys_of_indexes_composed_of_others(self):
+        FacetedBoat(power='sail', name='Foo')
+        FacetedBoat(power='sail', name='Bar')
+        FacetedBoat(power='engine', name='foo')
+        FacetedBoat(power='engine')
+        self.assertDictEqual(FacetedBoat.collection().facet_counts('name'),
+                             {'name': {'Foo': 1, 'Bar': 1, 'foo': 1}})
+        self.assertEqual(FacetedBoat.collection().distinct('name'), ['Bar', 'Foo', 'foo'])
+
+    def test_facet_counts_should_raise_without_equal_index(self):
+        with self.assertRaises(ImplementationError):
+            FacetedBoat.collection().facet_counts('launched')
+
+
+class RegistryBoat(TestRedisModel):
+    power = fields.InstanceHashField(indexable=True, indexes=[EqualIndex.configure(registry=True)])
+    launched = fields.InstanceHashField(indexable=True)
+
+
+class DistinctTest(CollectionBaseTest):
+
+    def test_distinct_should_return_sorted_values(self):
+        self.assertEqual(Boat.collection().distinct('power'), ['engine', 'sail'])
+        self.assertEqual(Boat.collection().distinct('launched'), ['1898', '1955', '1964', '1966'])
+
+    def test_distinct_should_use_filters(self):
+        self.assertEqual(Boat.collection(launched__in=[1964, 1966]).distinct('power'), ['sail'])
+        self.assertEqual(Boat.collection(power='foo').distinct('launched'), [])
+
+    def test_distinct_and_facet_counts_should_use_registry(self):
+        RegistryBoat(power='sail', launched=1898)
+        RegistryBoat(power='sail', launched=1964)
+        RegistryBoat(power='engine', launched=1955)
+        # no filters: only one call to get the registry
+        with self.assertNumCommands(1):
+            self.assertEqual(RegistryBoat.collection().distinct('power'), ['engine', 'sail'])
+        with self.assertNumCommands(1):
+            self.assertDictEqual(RegistryBoat.collection().facet_counts('power'),
+                                 {'power': {'sail': 2, 'engine': 1}})
+        # with filters, values are still read from the registry
+        self.assertDictEqual(RegistryBoat.collection(launched__in=[1898, 1955]).facet_counts('power'),
+                             {'power': {'sail': 1, 'engine': 1}})
+
+
+class PkInTest(CollectionBaseTest):
+
+    def test_pk_in_should_return_existing_pks(self):
+        self.assertSetEqual(set(Boat.collection(pk__in=[1, 3, 10])), {'1', '3'})
+        self.assertSetEqual(set(Boat.collection(pk__in=['2', 4])), {'2', '4'})
+        self.assertSetEqual(set(Boat.collection(pk__in=[])), set())
+        self.assertSetEqual(set(Boat.collection(pk__in=[10, 11])), set())
+
+    def test_pk_in_with_other_filters(self):
+        self.assertSetEqual(set(Boat.collection(pk__in=[1, 2, 4], power='sail')), {'1', '2'})
+        self.assertSetEqual(set(Boat.collection(pk__in=[1, 2, 3], pk=2)), {'2'})
+        self.assertSetEqual(set(Boat.collection(Q(pk__in=[1, 2]) | Q(power='engine'))), {'1', '2', '4'})
+        self.assertSetEqual(set(Boat.collection(pk__in=[1, 2, 3]).exclude(pk__in=[2])), {'1', '3'})
+
+    def test_pk_in_with_sort_slice_and_len(self):
+        collection = Boat.collection(pk__in=[3, 1, 2, 10]).sort(by='-launched')
+        self.assertEqual(list(collection), ['3', '2', '1'])
+        self.assertEqual(len(collection), 3)
+        self.assertEqual(collection[1:], ['2', '1'])
+
+    def test_pks_should_be_added_by_chunks_in_one_pipeline(self):
+        PkInFilter.chunk_size = 2
+        try:
+            collection = Boat.collection(pk__in=[1, 2, 3, 4, 5])
+            # exists for the tmp key, 3 sadd, the script with its 4 commands
+            with self.assertNumCommands(1 + 3 + 1 + 4):
+                self.assertSetEqual(set(collection), {'1', '2', '3', '4'})
+        finally:
+            del PkInFilter.chunk_size
+
+    def test_pk_in_should_not_leave_temporary_keys(self):
+        nb_keys = self.count_keys()
+        list(Boat.collection(pk__in=[1, 2, 10], power='sail'))
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_pk_in_can_be_prepared(self):
+        prepared = Boat.prepare_collection('pk__in', 'power')
+        self.assertSetEqual(set(prepared.execute(pk__in=[1, 4], power='sail')), {'1'})
+        self.assertSetEqual(set(prepared.execute(pk__in=[2, 3, 4], power='engine')), {'4'})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,7 +7,11 @@ import unittest
 from redis import ResponseError
 
 from limpyd import fields
-from limpyd.contrib.collection import ExtendedCollectionManager, SORTED_SCORE, DEFAULT_STORE_TTL
+from limpyd.collection import Q, Count, Max
+from limpyd.contrib.collection import (ExtendedCollectionManager, SortedSetWindow, SORTED_SCORE,
+                                      DEFAULT_STORE_TTL)
+from limpyd.contrib.indexes import ScoredEqualIndex
+from limpyd.indexes import TextRangeIndex, SortIndex, GeoIndex
 from limpyd.utils import unique_key
 from limpyd.exceptions import *
 from tests.indexes import RangeIndexTestModel
@@ -277,6 +281,41 @@ class FilterTest(BaseTest):
         self.assertSetEqual(set(collection), set())
 
 
+class QTest(BaseTest):
+
+    def test_filter_should_accept_q(self):
+        collection = Group.collection(active=1).filter(Q(public=0) | Q(name='baz'))
+        self.assertSetEqual(set(collection), {'2'})
+        collection = Group.collection().filter(Q(public=0) | Q(name='baz'))
+        self.assertSetEqual(set(collection), {'2', '3', '4'})
+
+    def test_q_should_accept_field_or_instance_as_value(self):
+        collection = Group.collection(Q(name=self.groups[1].name) | Q(pk=self.groups[2]))
+        self.assertSetEqual(set(collection), {'2', '3'})
+
+    def test_exclude_should_work_with_intersect(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 10, 2: 20, 3: 30})
+        collection = Group.collection().intersect(container.groups_sortedset).exclude(public=0)
+        self.assertSetEqual(set(collection), {'1', '3'})
+        container.groups_list.rpush(1, 2, 4)
+        collection = Group.collection().intersect(container.groups_list).exclude(active=0)
+        self.assertSetEqual(set(collection), {'1', '2'})
+
+    def test_q_should_accept_indexes_returning_sorted_sets(self):
+        Task(name='foo', queue='q1', priority=1)
+        Task(name='bar', queue='q2', priority=2)
+        Task(name='baz', queue='q1', priority=3)
+        nb_keys = self.count_keys()
+        collection = Task.collection(Q(queue='q2') | Q(name='baz'))
+        self.assertSetEqual(set(collection), {'2', '3'})
+        collection = Task.collection().exclude(queue='q1')
+        self.assertSetEqual(set(collection), {'2'})
+        collection = Task.collection(queue='q1').exclude(name='foo').sort(by='priority')
+        self.assertListEqual(list(collection), ['3'])
+        self.assertEqual(self.count_keys(), nb_keys)
+
+
 class IntersectTest(BaseTest):
 
     redis_zinterstore = None
@@ -312,6 +351,8 @@ class IntersectTest(BaseTest):
         restore it in tearDown.
         """
         super(IntersectTest, self).setUp()
+        # intersections must be done here, not in the ``fetch`` lua script
+        ExtendedCollectionManager.FETCH_IN_ONE_CALL = False
         IntersectTest.last_interstore_call = {'command': None, 'sets': [], }
         IntersectTest.redis_zinterstore = self.connection.zinterstore
         self.connection.zinterstore = IntersectTest.zinterstore
@@ -324,6 +365,7 @@ class IntersectTest(BaseTest):
         """
         self.connection.zinterstore = IntersectTest.redis_zinterstore
         self.connection.sinterstore = IntersectTest.redis_sinterstore
+        del ExtendedCollectionManager.FETCH_IN_ONE_CALL
         super(IntersectTest, self).tearDown()
 
     def test_intersect_should_accept_set_key_as_string(self):
@@ -503,6 +545,139 @@ class IntersectTest(BaseTest):
             check_data=[str(val) for val in range(1, 5)],
         )
 
+    def test_slicing_sortedset_should_keep_its_order(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 40, 2: 30, 3: 20, 4: 10})
+        for filters, expected in (({}, ['4', '3', '2', '1']), ({'active': 1}, ['2', '1'])):
+            for start in list(range(-5, 6)) + [None]:
+                if start is not None and -len(expected) <= start < len(expected):
+                    collection = Group.collection(**filters).intersect(container.groups_sortedset)
+                    self.assertEqual(collection[start], expected[start])
+                for stop in list(range(-5, 6)) + [None]:
+                    collection = Group.collection(**filters).intersect(container.groups_sortedset)
+                    self.assertEqual(collection[start:stop], expected[start:stop])
+        self.assertEqual(
+            Group.collection().intersect(container.groups_sortedset).values_list('name', flat=True)[1:3],
+            ['baz', 'bar'],
+        )
+
+    def test_slicing_sortedset_should_use_zrange(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 40, 2: 30, 3: 20, 4: 10})
+        collection = Group.collection(active=1).intersect(container.groups_sortedset)
+        with self.assertNumCommands(4):
+            # EXISTS final_key
+            # ZINTERSTORE final_key 2 active_key sortedset_key
+            # ZREVRANGE final_key 0 0
+            # DEL final_key
+            self.assertEqual(collection[-1], '1')
+        # the reversed order used for the negative index is not kept
+        self.assertEqual(list(collection), ['2', '1'])
+        # a sort is still possible
+        self.assertEqual(collection.sort()[:1], ['1'])
+        self.assertEqual(collection.sort(by='name', alpha=True)[-1], '1')
+
+
+class IntersectWindowTest(BaseTest):
+
+    def setUp(self):
+        super(IntersectWindowTest, self).setUp()
+        self.container = GroupsContainer()
+        self.container.groups_sortedset.zadd({1: 40, 2: 30, 3: 20, 4: 10})
+
+    def test_min_and_max_should_limit_the_scores(self):
+        sortedset = self.container.groups_sortedset
+        self.assertEqual(list(Group.collection().intersect(sortedset, min=20)), ['3', '2', '1'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, max=20)), ['4', '3'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, min=15, max=35)), ['3', '2'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, min='(20', max='(40')), ['2'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, min=50)), [])
+
+    def test_limit_should_keep_the_lowest_scores(self):
+        sortedset = self.container.groups_sortedset
+        self.assertEqual(list(Group.collection().intersect(sortedset, limit=2)), ['4', '3'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, min=20, limit=2)), ['3', '2'])
+        self.assertEqual(list(Group.collection().intersect(sortedset, limit=0)), [])
+
+    def test_window_should_be_applied_before_filters(self):
+        sortedset = self.container.groups_sortedset
+        # 1 and 2 are the active ones
+        collection = Group.collection(active=1).intersect(sortedset, limit=3)
+        self.assertEqual(list(collection), ['2'])
+        self.assertEqual(set(collection.sort()), {'2'})
+
+    def test_sortedset_key_should_be_accepted(self):
+        zset_key = unique_key(self.connection, 'tests')
+        self.connection.zadd(zset_key, {1: 1, 2: 2, 3: 3, 10: 10})
+        self.assertEqual(list(Group.collection().intersect(zset_key, min=2)), ['2', '3'])
+
+    def test_many_sortedsets_should_have_their_own_window(self):
+        zset_key = unique_key(self.connection, 'tests')
+        self.connection.zadd(zset_key, {1: 1, 2: 2, 3: 3, 4: 100})
+        # 4, 3 and 2 in the field, 1, 2 and 3 in the key
+        collection = Group.collection().intersect(self.container.groups_sortedset, zset_key, max=30)
+        self.assertEqual(set(collection), {'2', '3'})
+
+    def test_window_should_work_with_more_members_than_a_block(self):
+        zset_key = unique_key(self.connection, 'tests')
+        self.connection.zadd(zset_key, {i: i for i in range(1, 301)})
+        # groups are 1 to 4, only 3 and 4 are in the window
+        self.assertEqual(list(Group.collection().intersect(zset_key, min=3, limit=250)), ['3', '4'])
+        copied_key = unique_key(self.connection, 'tests')
+        ExtendedCollectionManager(Group)._sorted_set_window(
+            SortedSetWindow(zset_key, 3, '+inf', 250), copied_key)
+        self.assertEqual(self.connection.zcard(copied_key), 250)
+        self.assertEqual(self.connection.zrange(copied_key, 0, 0), ['3'])
+
+    def test_temporary_keys_should_be_deleted(self):
+        keys_before = self.count_keys()
+        collection = Group.collection(active=1).intersect(self.container.groups_sortedset, max=30)
+        self.assertEqual(list(collection), ['2'])
+        self.assertEqual(collection.sort(by='name', alpha=True)[:], ['2'])
+        self.assertEqual(self.count_keys(), keys_before)
+
+    def test_only_sorted_sets_should_be_accepted(self):
+        with self.assertRaises(ValueError):
+            Group.collection().intersect([1, 2], min=1)
+        with self.assertRaises(ValueError):
+            Group.collection().intersect(self.container.groups_set, limit=1)
+        with self.assertRaises(ValueError):
+            Group.collection().intersect(self.container.groups_sortedset, foo=1)
+
+
+class GeoPlace(TestRedisModel):
+    namespace = 'contrib-collection'
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.InstanceHashField(indexable=True)
+    location = fields.InstanceHashField(indexable=True, indexes=[GeoIndex])
+
+
+class GeoIndexTest(BaseTest):
+
+    def setUp(self):
+        super(GeoIndexTest, self).setUp()
+        self.paris = GeoPlace(name='paris', location='2.3522,48.8566').pk.get()
+        self.versailles = GeoPlace(name='versailles', location='2.1301,48.8049').pk.get()
+        self.lyon = GeoPlace(name='lyon', location='4.8357,45.7640').pk.get()
+
+    def test_near_filter_should_be_ordered_by_distance(self):
+        self.assertEqual(list(GeoPlace.collection(location__near=(2.2, 48.8, 500))),
+                         [self.versailles, self.paris, self.lyon])
+        self.assertEqual(list(GeoPlace.collection(location__near=(4.8, 45.7, 500))),
+                         [self.lyon, self.paris, self.versailles])
+        self.assertEqual(GeoPlace.collection(location__near=(4.8, 45.7, 500))[:2], [self.lyon, self.paris])
+
+    def test_other_sort_should_be_used(self):
+        collection = GeoPlace.collection(location__near=(4.8, 45.7, 500)).sort(by='name', alpha=True)
+        self.assertEqual(list(collection), [self.lyon, self.paris, self.versailles])
+
+    def test_near_filter_should_work_in_q_and_exclude(self):
+        self.assertSetEqual(set(GeoPlace.collection(Q(location__near=(2.35, 48.85, 5)) | Q(name='lyon'))),
+                            {self.paris, self.lyon})
+        self.assertSetEqual(set(GeoPlace.collection().exclude(location__near=(2.35, 48.85, 5))),
+                            {self.versailles, self.lyon})
+
 
 class SortByScoreTest(BaseTest):
     def setUp(self):
@@ -685,6 +860,44 @@ class SortByScoreTest(BaseTest):
         self.assertListEqual(list(collection), [{'name': 'foo', SORTED_SCORE: '1000.0'}])
 
 
+    def test_sort_by_sortedset_should_not_leave_temporary_keys(self):
+        nb_keys = self.count_keys()
+        collection = Group.collection(active=1).values_list('name', SORTED_SCORE)
+        list(collection.sort(by_score=self.container.groups_sortedset))
+        collection.sort(by_score=self.container.groups_sortedset)[0:1]
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_sort_by_sortedset_should_only_fetch_the_slice(self):
+        collection = Group.collection().sort(by_score=self.container.groups_sortedset)
+        # EXISTS (unique key), EVALSHA, TYPE, ZINTERSTORE, SCARD, ZRANGE, DEL
+        with self.assertNumCommands(7):
+            self.assertEqual(collection[1:3], self.sorted_pks[1:3])
+
+    def test_members_not_in_sortedset_should_be_first(self):
+        Group(name='new')
+        collection = Group.collection().values_list('name', SORTED_SCORE)
+        self.assertListEqual(list(collection.sort(by_score=self.container.groups_sortedset)), [
+            ('new', '-inf'), ('qux', '40.0'), ('bar', '200.0'), ('foo', '1000.0'),
+            ('baz', '3000.0'),
+        ])
+        collection = Group.collection().sort(by_score=self.container.groups_sortedset,
+                                             desc=True)
+        self.assertListEqual(list(collection), self.reversed_sorted_pks + ['5'])
+
+    def test_sort_by_sortedset_should_work_with_iterator(self):
+        collection = Group.collection().values_list('name', SORTED_SCORE).sort(
+                                                        by_score=self.container.groups_sortedset)
+        self.assertListEqual(list(collection.iterator(chunk_size=3)), [
+            ('qux', '40.0'), ('bar', '200.0'), ('foo', '1000.0'), ('baz', '3000.0'),
+        ])
+
+    def test_sort_by_sortedset_should_work_with_store(self):
+        collection = Group.collection().sort(by_score=self.container.groups_sortedset,
+                                             desc=True)
+        stored_collection = collection.store()
+        self.assertListEqual(list(stored_collection), self.reversed_sorted_pks)
+
+
 class StoreTest(BaseTest):
 
     def test_ttl_of_stored_collection_should_be_set(self):
@@ -985,3 +1198,211 @@ class ValuesListTest(BaseValuesTest):
         self.assertEqual(boats, {'1', '2', '3', '4'})
         boats = set(Boat.collection().values_list('name', flat=True).primary_keys())
         self.assertEqual(boats, {'1', '2', '3', '4'})
+
+
+class IteratorTest(BaseTest):
+
+    def test_iterator_should_keep_sortedset_order(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 1000, 2: 200, 3: 3000, 4: 40})
+        collection = Group.collection().intersect(container.groups_sortedset)
+        for chunk_size in (1, 3, 10):
+            self.assertEqual(list(collection.iterator(chunk_size)), ['4', '2', '1', '3'])
+
+    def test_iterator_should_keep_stored_order(self):
+        stored_collection = Group.collection().sort(by='-name', alpha=True).store()
+        for chunk_size in (1, 3, 10):
+            self.assertEqual(list(stored_collection.iterator(chunk_size)), ['4', '1', '3', '2'])
+        stored_collection = Group.collection(name='nothing').store()
+        self.assertEqual(list(stored_collection.iterator()), [])
+
+    def test_iterator_should_work_with_sort_by_score(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 1000, 2: 200, 3: 3000, 4: 40})
+        collection = Group.collection().sort(by_score=container.groups_sortedset)
+        for chunk_size in (1, 3, 10):
+            self.assertEqual(list(collection.iterator(chunk_size)), ['4', '2', '1', '3'])
+        values = list(collection.values_list('name', SORTED_SCORE).iterator(3))
+        self.assertEqual(values, [('qux', '40.0'), ('bar', '200.0'), ('foo', '1000.0'), ('baz', '3000.0')])
+
+    def test_iterator_should_return_values(self):
+        collection = Group.collection(active=1)
+        for chunk_size in (1, 3, 10):
+            self.assertEqual(
+                sorted(collection.values('pk', 'name', SORTED_SCORE).iterator(chunk_size), key=lambda v: v['pk']),
+                [{'pk': '1', 'name': 'foo', SORTED_SCORE: None}, {'pk': '2', 'name': 'bar', SORTED_SCORE: None}]
+            )
+            self.assertEqual(
+                list(collection.sort(by='name', alpha=True).values_list('name', flat=True).iterator(chunk_size)),
+                ['bar', 'foo']
+            )
+
+    def test_unsorted_values_should_be_retrieved_in_one_call_by_chunk(self):
+        collection = Group.collection(active=1).values_list('pk', 'name', 'public')
+        with self.assertNumCommands(5):
+            # SSCAN index_key (small set: all returned at once)
+            # HGET name, HGET public (x2, all sent in one pipeline)
+            self.assertEqual(sorted(collection.iterator()), [('1', 'foo', '1'), ('2', 'bar', '0')])
+
+
+class Task(TestRedisModel):
+    namespace = 'contrib-collection'
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.InstanceHashField(indexable=True, indexes=[TextRangeIndex.configure(compact=True)])
+    priority = fields.InstanceHashField()
+    queue = fields.InstanceHashField(
+        indexable=True,
+        indexes=[ScoredEqualIndex.configure(score_field='priority')]
+    )
+
+
+class AfterTest(BaseTest):
+
+    def get_all_results(self, collection, limit):
+        page = collection.after(limit=limit)
+        results = page.results
+        while page.cursor:
+            page = collection.after(page.cursor, limit=limit)
+            results.extend(page.results)
+        return results
+
+    def test_after_should_work_with_sort_by_score(self):
+        container = GroupsContainer()
+        container.groups_sortedset.zadd({1: 1000, 2: 200, 3: 3000, 4: 40, 10: 10})
+        collection = Group.collection().sort(by_score=container.groups_sortedset)
+        for limit in (1, 3, 10):
+            # pk 10 is not a real group
+            self.assertEqual(self.get_all_results(collection, limit), ['4', '2', '1', '3'])
+        collection = Group.collection(active=1).sort(by_score=container.groups_sortedset, desc=True)
+        for limit in (1, 3, 10):
+            self.assertEqual(self.get_all_results(collection, limit), ['1', '2'])
+
+    def test_after_should_work_with_intersect(self):
+        container = GroupsContainer()
+        container.groups_set.sadd(1, 2, 4)
+        container.groups_list.rpush(1, 4)
+        collection = Task.collection().sort(by='name', alpha=True).intersect(container.groups_set)
+        self.assertEqual(collection.after(), ([], None))
+        collection = Group.collection(public=0).sort(by_score=GroupsContainer().groups_sortedset)
+        self.assertEqual(collection.after(), ([], None))
+
+        # with a list, converted to a set
+        sortedset = GroupsContainer().groups_sortedset
+        sortedset.zadd({1: 1, 2: 2, 3: 3, 4: 4})
+        collection = Group.collection().intersect(container.groups_list).sort(by_score=sortedset)
+        keys_before = self.count_keys()
+        self.assertEqual(collection.after(limit=1).results, ['1'])
+        self.assertEqual(self.get_all_results(collection, 1), ['1', '4'])
+        self.assertEqual(self.count_keys(), keys_before)
+        collection = Group.collection().intersect(container.groups_set).sort(by_score=sortedset, desc=True)
+        self.assertEqual(self.get_all_results(collection, 2), ['4', '2', '1'])
+
+    def test_after_should_use_scored_equal_index(self):
+        Task(name='a', priority=3, queue='q1')
+        Task(name='b', priority=1, queue='q1')
+        Task(name='c', priority=2, queue='q2')
+        Task(name='d', priority=2, queue='q1')
+        Task(name='e', queue='q1')  # no priority: not in the index
+        collection = Task.collection(queue='q1').sort(by='priority')
+        with self.assertNumCommands(4):
+            # EVALSHA page_after_script queue_q1_key (no other filter key to check)
+            # then in the script:
+            # ZRANGEBYSCORE queue_q1_key -inf +inf WITHSCORES LIMIT 0 100
+            # then for the next page:
+            # EVALSHA page_after_script queue_q1_key
+            # ZRANGEBYSCORE queue_q1_key 2 +inf WITHSCORES LIMIT 0 100
+            page = collection.after(limit=2)
+            self.assertEqual(page.results, ['2', '4'])
+            self.assertEqual(collection.after(page.cursor, limit=2), (['1'], None))
+        collection = Task.collection(queue='q1', name__gte='b').sort(by='-priority')
+        self.assertEqual(self.get_all_results(collection, 1), ['4', '2'])
+        # the scores cannot be used for a lexicographic sort
+        with self.assertRaises(ImplementationError):
+            Task.collection(queue='q1').sort(by='priority', alpha=True).after()
+
+    def test_after_should_return_values(self):
+        Task(name='a', priority=3, queue='q1')
+        Task(name='b', priority=1, queue='q1')
+        collection = Task.collection().sort(by='-name', alpha=True).values_list('name', 'priority')
+        self.assertEqual(self.get_all_results(collection, 1), [('b', '1'), ('a', '3')])
+
+
+class SortedGroup(TestRedisModel):
+    namespace = 'contrib-collection'
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.InstanceHashField(indexable=True, indexes=[SortIndex.configure(alpha=True)])
+    rank = fields.InstanceHashField(indexable=True, indexes=[SortIndex])
+    active = fields.InstanceHashField(indexable=True, default=1)
+
+
+class SortIndexTest(BaseTest):
+
+    def setUp(self):
+        super(SortIndexTest, self).setUp()
+        SortedGroup(name='foo', rank=3)
+        SortedGroup(name='bar', rank=1, active=0)
+        SortedGroup(name='baz', rank=2)
+        SortedGroup(name='qux', rank=4)
+
+    def test_values_should_be_retrieved_for_sorted_pks(self):
+        collection = SortedGroup.collection(active=1).sort(by='-rank').values_list('name', 'rank')
+        with self.assertNumCommands(9):
+            # EXISTS tmp_key
+            # EVALSHA sort_by_index_script active_key rank_key tmp_key tmp_set_key ...
+            # then in the script:
+            # TYPE active_key
+            # ZINTERSTORE tmp_key 2 active_key rank_key WEIGHTS 0 1
+            # ZUNIONSTORE tmp_key 2 active_key tmp_key WEIGHTS 0 1
+            # ZREVRANGE tmp_key 0 0
+            # DEL tmp_key
+            # then in a pipeline:
+            # HGET name, HGET rank
+            self.assertEqual(collection[:1], [('qux', '4')])
+        self.assertEqual(list(collection), [('qux', '4'), ('foo', '3'), ('baz', '2')])
+        collection = SortedGroup.collection().sort(by='name', alpha=True).values('name')
+        self.assertEqual(list(collection), [{'name': 'bar'}, {'name': 'baz'}, {'name': 'foo'}, {'name': 'qux'}])
+
+    def test_sort_index_should_work_with_intersect(self):
+        container = GroupsContainer()
+        container.groups_list.rpush(1, 4, 2)
+        container.groups_sortedset.zadd({1: 10, 3: 20, 4: 30})
+        collection = SortedGroup.collection().intersect(container.groups_list).sort(by='-name', alpha=True)
+        self.assertEqual(list(collection), ['4', '1', '2'])
+        collection = SortedGroup.collection().intersect(container.groups_sortedset).sort(by='rank')
+        self.assertEqual(list(collection), ['3', '1', '4'])
+
+    def test_sort_index_should_work_with_stored_collection(self):
+        stored = SortedGroup.collection(active=1).sort(by='name', alpha=True).store()
+        self.assertEqual(list(stored), ['3', '1', '4'])
+        keys_before = self.count_keys()
+        self.assertEqual(list(stored.sort(by='-rank')), ['4', '1', '3'])
+        self.assertEqual(list(stored.sort(by='-name', alpha=True)), ['4', '1', '3'])
+        self.assertEqual(self.count_keys(), keys_before)
+
+
+class AggregateTest(BaseTest):
+
+    def test_aggregate_should_work_with_intersect(self):
+        container = GroupsContainer()
+        container.groups_list.rpush(1, 3, 4)
+        collection = Group.collection(public=1).intersect(container.groups_list)
+        self.assertDictEqual(collection.aggregate(nb=Count(), nb_active=Count('active'), max_active=Max('active')),
+                             {'nb': 2, 'nb_active': 2, 'max_active': 1.0})
+        collection = Group.collection().intersect(container.groups_list)
+        self.assertDictEqual(collection.aggregate(nb=Count(), active=Max('active')), {'nb': 3, 'active': 1.0})
+
+
+class FacetCountsTest(BaseTest):
+
+    def test_facet_counts_should_work_with_intersect(self):
+        container = GroupsContainer()
+        container.groups_list.rpush(1, 3, 4)
+        collection = Group.collection().intersect(container.groups_list)
+        self.assertDictEqual(collection.facet_counts('active', 'public'),
+                             {'active': {'1': 1, '0': 2}, 'public': {'1': 2, '0': 1}})
+        container.groups_sortedset.zadd({1: 10, 2: 20})
+        collection = Group.collection().intersect(container.groups_sortedset)
+        self.assertDictEqual(collection.facet_counts('active', 'public'),
+                             {'active': {'1': 2}, 'public': {'1': 1, '0': 1}})
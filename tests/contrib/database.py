@@ -6,6 +6,7 @@ import time
 
 from limpyd.contrib.database import PipelineDatabase, _Pipeline
 from limpyd import model, fields
+from limpyd.exceptions import ImplementationError
 
 from ..base import LimpydBaseTest, TEST_CONNECTION_SETTINGS
 
@@ -19,6 +20,7 @@ class Bike(model.RedisModel):
     name = fields.StringField(indexable=True)
     wheels = fields.StringField(default=2)
     passengers = fields.StringField(default=1)
+    picture = fields.BytesField()
 
 
 class PipelineTest(LimpydBaseTest):
@@ -124,3 +126,14 @@ class PipelineTest(LimpydBaseTest):
 
             names = pipe.execute()
             self.assertEqual(names, ["rosalie", "velocipede", "velocipede"])  # trhee in the pipeline, with one from the thread
+
+    def test_bytes_field_cannot_be_used_in_a_pipeline(self):
+        bike = Bike(name="rosalie", picture=b'\xff')
+        with self.database.pipeline(transaction=False) as pipe:
+            bike.name.get()
+            with self.assertRaises(ImplementationError):
+                bike.picture.get()
+            with self.assertRaises(ImplementationError):
+                bike.picture.set(b'\x00')
+            self.assertEqual(pipe.execute(), ["rosalie"])
+        self.assertEqual(bike.picture.get(), b'\xff')
@@ -532,6 +532,10 @@ class ScoredEqualIndexTestCase(LimpydBaseTest):
                     indexes=[ScoredEqualIndex.configure(score_field='queue_name')]
                 )
 
+    def test_registry_cannot_be_used(self):
+        with self.assertRaises(TypeError):
+            ScoredEqualIndex.configure(score_field='priority', registry=True)
+
     def test_multi_values_field(self):
         with self.assertRaises(ImplementationError):
             class ScoredEqualIndexModelWithMultiValuesScoreField(TestRedisModel):
@@ -7,6 +7,7 @@ from limpyd.exceptions import *
 from limpyd.contrib.related import (RelatedModel, RelatedCollection,
                                     FKStringField, FKInstanceHashField, M2MSetField,
                                     M2MListField, M2MSortedSetField)
+from limpyd.collection import Q
 from limpyd.contrib.collection import ExtendedCollectionManager
 
 from ..base import LimpydBaseTest, TEST_CONNECTION_SETTINGS
@@ -526,6 +527,138 @@ class M2MSortedSetTest(LimpydBaseTest):
         self.assertEqual(core_devs.members.zrevrangebyscore(25, 15), [ybon._pk])
 
 
+class PrefetchTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.p1 = Person(name='p1')
+        self.p2 = Person(name='p2')
+        self.p3 = Person(name='p3')
+        self.g1 = Group(name='g1', owner=self.p1)
+        self.g2 = Group(name='g2', owner=self.p2)
+        self.g3 = Group(name='g3')
+        self.g1.members.sadd(self.p1, self.p2)
+        self.g2.members.sadd(self.p3)
+        self.p1.following.sadd(self.p2, self.p3)
+
+    def test_select_related_should_retrieve_fk_instances_at_once(self):
+        collection = Group.collection().instances().select_related('owner').sort(alpha=True)
+        # one call to get pks, and 3 pipelines: existence of groups, owners pks, existence of owners
+        with self.assertNumCommands(1 + 3 + 3 + 2):
+            groups = list(collection)
+        with self.assertNumCommands(0):
+            owners = {group._pk: group.owner.instance() for group in groups if group._pk != 'g3'}
+        self.assertEqual({pk: owner._pk for pk, owner in owners.items()}, {'g1': 'p1', 'g2': 'p2'})
+        self.assertTrue(owners['g1'].connected)
+        # without related instance, it works as usual
+        with self.assertRaises(DoesNotExist):
+            groups[2].owner.instance()
+
+    def test_prefetch_related_should_retrieve_m2m_instances_at_once(self):
+        collection = Group.collection().instances().prefetch_related('members').sort(alpha=True)
+        with self.assertNumCommands(1 + 3 + 3 + 3):
+            groups = list(collection)
+        with self.assertNumCommands(0):
+            members = {group._pk: sorted(member._pk for member in group.members.instances()) for group in groups}
+        self.assertEqual(members, {'g1': ['p1', 'p2'], 'g2': ['p3'], 'g3': []})
+
+    def test_prefetch_related_should_retrieve_related_collections_at_once(self):
+        collection = Person.collection().instances().prefetch_related('membership', 'owned_groups', 'followers')
+        with self.assertNumCommands(1 + 3 + (3 + 2) + (3 + 2) + (3 + 1)):
+            persons = {person._pk: person for person in collection}
+        with self.assertNumCommands(0):
+            self.assertEqual([group._pk for group in persons['p1'].membership.instances()], ['g1'])
+            self.assertEqual([group._pk for group in persons['p3'].membership.instances()], ['g2'])
+            self.assertEqual([group._pk for group in persons['p2'].owned_groups.instances()], ['g2'])
+            self.assertEqual([person._pk for person in persons['p2'].followers.instances()], ['p1'])
+            self.assertEqual(persons['p1'].followers.instances(), [])
+
+    def test_instances_without_prefetch(self):
+        self.assertEqual([group._pk for group in self.p1.membership.instances()], ['g1'])
+        self.assertEqual(sorted(person._pk for person in self.g1.members.instances()), ['p1', 'p2'])
+
+    def test_prefetched_instances_should_be_forgotten_when_field_is_updated(self):
+        group = Group.collection(name='g1').instances().select_related('owner').prefetch_related('members')[0]
+        group.owner.hset(self.p3)
+        self.assertEqual(group.owner.instance()._pk, 'p3')
+        group.members.srem(self.p1)
+        self.assertEqual([member._pk for member in group.members.instances()], ['p2'])
+
+    def test_iterator_should_prefetch_by_chunks(self):
+        groups = list(Group.collection().instances().select_related('owner').iterator(chunk_size=2))
+        with self.assertNumCommands(0):
+            owners = {group._pk: group.owner.instance()._pk for group in groups if group._pk != 'g3'}
+        self.assertEqual(owners, {'g1': 'p1', 'g2': 'p2'})
+
+    def test_inexisting_instances_should_be_skipped(self):
+        collection = Group.collection().instances().select_related('owner')
+        self.g3.delete()
+        self.assertEqual(sorted(group._pk for group in collection), ['g1', 'g2'])
+
+    def test_invalid_names_should_raise(self):
+        with self.assertRaises(ValueError):
+            Group.collection().select_related('members')
+        with self.assertRaises(ValueError):
+            Group.collection().prefetch_related('owner')
+        with self.assertRaises(ValueError):
+            Group.collection().prefetch_related('foo')
+
+
+class RelatedFilterTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(RelatedFilterTest, self).setUp()
+        self.p1 = Person(name='p1', age=20)
+        self.p2 = Person(name='p2', age=30)
+        self.p3 = Person(name='p3', age=20)
+        self.g1 = Group(name='g1', owner=self.p1, status='admins')
+        self.g2 = Group(name='g2', owner=self.p2, status='users')
+        self.g3 = Group(name='g3', status='admins', parent=self.g1)
+        self.p1.prefered_group.set(self.g1)
+        self.p2.prefered_group.set(self.g2)
+        self.p3.prefered_group.set(self.g3)
+        self.g1.members.sadd(self.p1, self.p2)
+        self.g2.members.sadd(self.p3)
+
+    def test_filter_through_fk(self):
+        self.assertSetEqual(set(Person.collection(prefered_group__status='admins')), {'p1', 'p3'})
+        self.assertSetEqual(set(Person.collection(prefered_group__status='foo')), set())
+        self.assertSetEqual(set(Group.collection(owner__age=20)), {'g1'})
+        self.assertSetEqual(set(Person.collection(prefered_group__pk='g2')), {'p2'})
+
+    def test_filter_through_m2m(self):
+        self.assertSetEqual(set(Group.collection(members__age=20)), {'g1', 'g2'})
+        self.assertSetEqual(set(Group.collection(members__age=30)), {'g1'})
+
+    def test_filter_through_many_relations(self):
+        self.assertSetEqual(set(Group.collection(parent__owner__age=20)), {'g3'})
+        self.assertSetEqual(set(Person.collection(prefered_group__owner__name='p1')), {'p1'})
+
+    def test_filter_with_other_filters(self):
+        self.assertSetEqual(set(Person.collection(prefered_group__status__in=['admins', 'users'], age=20)),
+                            {'p1', 'p3'})
+        self.assertSetEqual(set(Person.collection(Q(prefered_group__status='users') | Q(age=20))),
+                            {'p1', 'p2', 'p3'})
+        self.assertSetEqual(set(Person.collection().exclude(prefered_group__status='admins')), {'p2'})
+
+    def test_index_suffixes_of_related_field_should_still_work(self):
+        self.assertSetEqual(set(Person.collection(prefered_group__in=['g1', 'g2'])), {'p1', 'p2'})
+        self.assertSetEqual(set(Person.collection(prefered_group__eq='g2')), {'p2'})
+
+    def test_join_should_be_done_in_redis(self):
+        collection = Person.collection(prefered_group__status='admins')
+        # exists for the tmp key, the script and its 4 commands, smembers, del
+        with self.assertNumCommands(1 + 1 + 4 + 1 + 1):
+            self.assertSetEqual(set(collection), {'p1', 'p3'})
+        nb_keys = self.count_keys()
+        list(Person.collection(prefered_group__status__in=['admins', 'users'], age=20))
+        self.assertEqual(self.count_keys(), nb_keys)
+
+    def test_invalid_filter_should_raise(self):
+        with self.assertRaises(ImplementationError):
+            Person.collection(prefered_group__foo='bar')
+
+
 class DatabaseTest(LimpydBaseTest):
     def test_database_could_transfer_its_models_and_relations_to_another(self):
         """
@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+from datetime import datetime, timedelta, tzinfo
+
+from limpyd import fields
+from limpyd.contrib.collection import ExtendedCollectionManager
+from limpyd.contrib.typed import (IntegerStringField, IntegerInstanceHashField,
+                                  FloatStringField, FloatInstanceHashField,
+                                  DateTimeStringField, DateTimeInstanceHashField,
+                                  JSONStringField, JSONInstanceHashField)
+from limpyd.indexes import EqualIndex, NumberRangeIndex, TextRangeIndex
+
+from ..base import LimpydBaseTest
+from ..model import TestRedisModel
+
+
+class TypedModel(TestRedisModel):
+    collection_manager = ExtendedCollectionManager
+
+    count = IntegerStringField(indexable=True)
+    size = IntegerInstanceHashField(indexable=True)
+    ratio = FloatStringField()
+    price = FloatInstanceHashField(indexable=True)
+    created = DateTimeStringField(indexable=True, indexes=[TextRangeIndex])
+    updated = DateTimeInstanceHashField()
+    data = JSONStringField(indexable=True)
+    extra = JSONInstanceHashField()
+
+
+class UTC2(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(hours=2)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class TypedFieldsTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(TypedFieldsTest, self).setUp()
+        self.obj1 = TypedModel(count=10, size=3, ratio=0.5, price='9.99',
+                               created=datetime(2020, 1, 2, 3, 4, 5, 6),
+                               data={'b': [1, 2], 'a': None}, extra=['x', 1])
+        self.obj2 = TypedModel(count='2', size=30, price=100,
+                               created=datetime(2021, 6, 1), data='foo')
+
+    def test_values_should_be_converted_when_read(self):
+        obj = TypedModel.get(self.obj1.pk.get())
+        self.assertEqual(obj.count.get(), 10)
+        self.assertEqual(obj.size.hget(), 3)
+        self.assertEqual(obj.ratio.get(), 0.5)
+        self.assertEqual(obj.price.hget(), 9.99)
+        self.assertEqual(obj.created.get(), datetime(2020, 1, 2, 3, 4, 5, 6))
+        self.assertEqual(obj.data.get(), {'a': None, 'b': [1, 2]})
+        self.assertEqual(obj.extra.hget(), ['x', 1])
+        self.assertIsNone(obj.updated.hget())
+        self.assertEqual(self.obj2.data.get(), 'foo')
+
+    def test_values_should_be_stored_as_strings(self):
+        self.assertEqual(self.connection.get(self.obj1.count.key), '10')
+        self.assertEqual(self.connection.hget(self.obj1.key, 'price'), '9.99')
+        self.assertEqual(self.connection.get(self.obj1.created.key), '2020-01-02T03:04:05.000006')
+        self.assertEqual(self.connection.get(self.obj1.data.key), '{"a":null,"b":[1,2]}')
+
+    def test_aware_datetimes_should_be_stored_in_utc(self):
+        self.obj1.updated.hset(datetime(2020, 1, 1, 12, tzinfo=UTC2()))
+        self.assertEqual(self.obj1.updated.hget(), datetime(2020, 1, 1, 10))
+
+    def test_getset_and_model_hmget_hmset(self):
+        self.assertEqual(self.obj1.count.getset(11), 10)
+        self.assertEqual(self.obj1.count.get(), 11)
+        self.obj1.hmset(size=4, updated=datetime(2022, 2, 2), extra={'y': 2})
+        self.assertEqual(self.obj1.hmget('size', 'updated', 'extra'),
+                         [4, datetime(2022, 2, 2), {'y': 2}])
+
+    def test_numeric_fields_should_use_number_range_index(self):
+        self.assertEqual(TypedModel.get_field('count').index_classes, [EqualIndex, NumberRangeIndex])
+        collection = TypedModel.collection
+        self.assertSetEqual(set(collection(count__gt=5)), {self.obj1.pk.get()})
+        self.assertSetEqual(set(collection(size__lte=30, price__gte=10)), {self.obj2.pk.get()})
+        self.assertSetEqual(set(collection(count=2)), {self.obj2.pk.get()})
+        self.obj2.count.set(20)
+        self.assertSetEqual(set(collection(count__gt=5)), {self.obj1.pk.get(), self.obj2.pk.get()})
+
+    def test_filters_should_use_converted_values(self):
+        collection = TypedModel.collection
+        self.assertSetEqual(set(collection(created__gte=datetime(2021, 1, 1))), {self.obj2.pk.get()})
+        self.assertSetEqual(set(collection(created__lt='2021')), {self.obj1.pk.get()})
+        self.assertSetEqual(set(collection(data={'b': [1, 2], 'a': None})), {self.obj1.pk.get()})
+        self.assertSetEqual(set(collection(data='foo')), {self.obj2.pk.get()})
+        self.obj1.data.set({'c': 3})
+        self.assertSetEqual(set(collection(data={'c': 3})), {self.obj1.pk.get()})
+        self.assertSetEqual(set(collection(data={'b': [1, 2], 'a': None})), set())
+
+    def test_values_and_values_list_should_convert_values(self):
+        collection = TypedModel.collection().sort(by='count')
+        self.assertListEqual(list(collection.values_list('count', 'price', 'created', 'data')), [
+            (2, 100.0, datetime(2021, 6, 1), 'foo'),
+            (10, 9.99, datetime(2020, 1, 2, 3, 4, 5, 6), {'a': None, 'b': [1, 2]}),
+        ])
+        self.assertListEqual(list(collection.values_list('size', flat=True)), [30, 3])
+        self.assertListEqual(list(collection.values('pk', 'extra', 'updated')), [
+            {'pk': self.obj2.pk.get(), 'extra': None, 'updated': None},
+            {'pk': self.obj1.pk.get(), 'extra': ['x', 1], 'updated': None},
+        ])
+        self.assertListEqual(list(collection.values_list('count', flat=True).iterator(chunk_size=1)), [2, 10])
+
+    def test_conversion_should_be_done_by_field(self):
+        field = TypedModel.get_field('count')
+        self.assertListEqual(field.to_python_many(['1', None, '3']), [1, None, 3])
+        self.assertFalse(fields.StringField.converts_values)
+        self.assertListEqual(fields.StringField().to_python_many(['1', None]), ['1', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
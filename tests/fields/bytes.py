@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import zlib
+
+from limpyd import fields
+from limpyd.contrib.collection import ExtendedCollectionManager
+from limpyd.exceptions import ImplementationError
+
+from ..model import TestRedisModel, BaseModelTest
+
+
+class Attachment(TestRedisModel):
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.StringField(indexable=True)
+    content = fields.BytesField()
+
+
+class BytesFieldTest(BaseModelTest):
+
+    model = Attachment
+
+    def test_values_should_be_returned_as_bytes(self):
+        data = zlib.compress(b'foo' * 100) + b'\xff\xfe'
+        attachment = self.model(name='foo.txt', content=data)
+        self.assertEqual(attachment.content.get(), data)
+        self.assertEqual(self.model.get(attachment.pk.get()).content.get(), data)
+        self.assertEqual(attachment.name.get(), 'foo.txt')
+
+    def test_commands_should_work_on_bytes(self):
+        attachment = self.model(name='foo.txt', content=b'\x00\x01')
+        attachment.content.append(b'\xff')
+        self.assertEqual(attachment.content.getrange(1, 2), b'\x01\xff')
+        self.assertEqual(attachment.content.strlen(), 3)
+        self.assertEqual(attachment.content.getset(b'\x02'), b'\x00\x01\xff')
+        attachment.content.delete()
+        self.assertIsNone(attachment.content.get())
+
+    def test_raw_connection_should_not_decode_responses(self):
+        raw_connection = self.model.database.raw_connection
+        self.assertIs(raw_connection, self.model.database.raw_connection)
+        self.assertIsNot(raw_connection, self.connection)
+        self.connection.set('foo', 'bar')
+        self.assertEqual(raw_connection.get('foo'), b'bar')
+
+    def test_other_fields_and_collections_should_work_on_text(self):
+        attachment = self.model(name='foo.txt', content=b'\xff')
+        self.assertCollection([attachment.pk.get()], name='foo.txt')
+        self.assertEqual(list(self.model.collection().values()), [{'pk': attachment.pk.get(), 'name': 'foo.txt'}])
+        with self.assertRaises(ValueError):
+            self.model.collection().values('content')
+
+    def test_delete_instance(self):
+        attachment = self.model(name='foo.txt', content=b'\xff')
+        key = attachment.content.key
+        attachment.delete()
+        self.assertFalse(self.connection.exists(key))
+
+    def test_cannot_be_indexed(self):
+        with self.assertRaises(ImplementationError):
+            fields.BytesField(indexable=True)
+        with self.assertRaises(ImplementationError):
+            fields.BytesField(unique=True)
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+from limpyd import fields
+from limpyd.contrib.collection import ExtendedCollectionManager
+from limpyd.contrib.typed import JSONStringField
+from limpyd.exceptions import ImplementationError
+
+from ..model import TestRedisModel, BaseModelTest
+
+
+class Document(TestRedisModel):
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.InstanceHashField(indexable=True)
+    content = fields.StringField(compress='zlib')
+    summary = fields.InstanceHashField(compress='zlib', compress_threshold=10)
+    data = JSONStringField(compress='zlib', compress_threshold=10)
+
+
+class CompressionTest(BaseModelTest):
+
+    model = Document
+
+    content = 'foo bar baz ' * 1000
+
+    def test_big_values_should_be_compressed(self):
+        document = self.model(name='foo', content=self.content)
+        stored = self.connection.get(document.content.key)
+        self.assertTrue(stored.startswith('\x00z'))
+        self.assertLess(len(stored), 200)
+        self.assertEqual(document.content.get(), self.content)
+        self.assertEqual(self.model.get(document.pk.get()).content.get(), self.content)
+        self.assertEqual(document.content.getset('foo'), self.content)
+        self.assertEqual(self.connection.get(document.content.key), 'foo')
+
+    def test_small_values_should_not_be_compressed(self):
+        document = self.model(name='foo', content='foo', summary='bar')
+        self.assertEqual(self.connection.get(document.content.key), 'foo')
+        self.assertEqual(self.connection.hget(document.key, 'summary'), 'bar')
+        self.assertEqual(document.content.get(), 'foo')
+
+    def test_uncompressed_values_should_be_readable(self):
+        document = self.model(name='foo')
+        self.connection.set(document.content.key, 'foo')
+        self.assertEqual(document.content.get(), 'foo')
+        document.content.set('\x00foo')
+        self.assertEqual(self.connection.get(document.content.key), '\x00-\x00foo')
+        self.assertEqual(document.content.get(), '\x00foo')
+
+    def test_instancehash_fields_and_hmget_hmset(self):
+        summary = 'a summary ' * 10
+        document = self.model(name='foo', summary=summary)
+        self.assertTrue(self.connection.hget(document.key, 'summary').startswith('\x00z'))
+        self.assertEqual(document.summary.hget(), summary)
+        self.assertEqual(document.hmget('name', 'summary'), ['foo', summary])
+        document.hmset(summary=summary * 2)
+        self.assertEqual(document.summary.hget(), summary * 2)
+        self.assertEqual(self.model.collection(name='foo').values_list('summary', flat=True)[0], summary * 2)
+
+    def test_values_should_be_decompressed(self):
+        document = self.model(name='foo', content=self.content, summary='bar')
+        self.assertListEqual(list(self.model.collection(name='foo').values('content', 'summary')), [
+            {'content': self.content, 'summary': 'bar'}
+        ])
+
+    def test_typed_fields_can_be_compressed(self):
+        data = {'values': list(range(100))}
+        document = self.model(name='foo', data=data)
+        self.assertTrue(self.connection.get(document.data.key).startswith('\x00z'))
+        self.assertEqual(document.data.get(), data)
+        self.assertListEqual(list(self.model.collection().values_list('data', flat=True)), [data])
+
+    def test_commands_working_on_stored_value_should_be_denied(self):
+        document = self.model(name='foo', content=self.content)
+        with self.assertRaises(ImplementationError):
+            document.content.append('foo')
+        with self.assertRaises(ImplementationError):
+            document.content.strlen()
+        with self.assertRaises(ImplementationError):
+            document.summary.hincrby(1)
+
+    @unittest.skipIf(fields.lzma is None, 'lzma not available')
+    def test_lzma_compression(self):
+        field = fields.StringField(compress='lzma')
+        stored = field.compress_value(self.content)
+        self.assertTrue(stored.startswith('\x00x'))
+        self.assertEqual(field.decompress_value(stored), self.content)
+
+    def test_invalid_configurations(self):
+        with self.assertRaises(ImplementationError):
+            fields.StringField(compress='foo')
+        with self.assertRaises(ImplementationError):
+            fields.StringField(compress='zlib', indexable=True)
+        with self.assertRaises(ImplementationError):
+            fields.InstanceHashField(compress='zlib', unique=True)
+        with self.assertRaises(ImplementationError):
+            fields.BytesField(compress='zlib')
+
+
+if __name__ == '__main__':
+    unittest.main()
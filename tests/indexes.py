@@ -5,9 +5,10 @@ from __future__ import unicode_literals
 import unittest
 
 from limpyd import fields
+from limpyd.collection import Max, Min
 from limpyd.database import RedisDatabase
 from limpyd.exceptions import ImplementationError, UniquenessError
-from limpyd.indexes import EqualIndex, TextRangeIndex, NumberRangeIndex
+from limpyd.indexes import EqualIndex, TextRangeIndex, NumberRangeIndex, SortIndex, GeoIndex, TokenIndex, PresenceIndex
 
 from .base import LimpydBaseTest, TEST_CONNECTION_SETTINGS
 from .model import Bike, Email, TestRedisModel, Boat
@@ -667,6 +668,674 @@ class NumberRangeIndexTestCase(LimpydBaseTest):
         })
 
 
+class SortIndexTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[SortIndex.configure(alpha=True)])
+    value = fields.StringField(indexable=True, indexes=[EqualIndex, SortIndex])
+
+
+class SortIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(SortIndexTestCase, self).setUp()
+        self.obj1 = SortIndexTestModel(name='foo', value=10)
+        self.obj2 = SortIndexTestModel(name='bar', value=-5.5)
+        self.obj3 = SortIndexTestModel(name='baz', value='not a number')
+
+    def test_stored_data_by_score(self):
+        index = self.obj1.get_field('value')._indexes[1]
+        self.assertEqual(index.ordering, 'score')
+        key = index.get_ordering_key()
+        self.assertEqual(key, 'tests:sortindextestmodel:value:sort')
+        self.assertEqual(self.connection.zrange(key, 0, -1, withscores=True), [
+            ('2', -5.5),
+            ('3', 0.0),
+            ('1', 10.0),
+        ])
+
+    def test_stored_data_lexicographically(self):
+        index = self.obj1.get_field('name').get_index()
+        self.assertEqual(index.ordering, 'lex')
+        key = index.get_ordering_key()
+        self.assertEqual(key, 'tests:sortindextestmodel:name:sort')
+        self.assertEqual(self.connection.zrange(key, 0, -1), [
+            'bar\x002',
+            'baz\x003',
+            'foo\x001',
+        ])
+
+    def test_index_should_be_updated(self):
+        self.obj1.name.set('qux')
+        self.obj2.value.delete()
+        self.assertEqual(self.connection.zrange('tests:sortindextestmodel:name:sort', 0, -1), [
+            'bar\x002',
+            'baz\x003',
+            'qux\x001',
+        ])
+        self.assertEqual(self.connection.zrange('tests:sortindextestmodel:value:sort', 0, -1), ['3', '1'])
+
+    def test_null_byte_cannot_be_indexed_lexicographically(self):
+        with self.assertRaises(ValueError):
+            self.obj1.name.set('foo\x00bar')
+        self.assertEqual(self.obj1.name.get(), 'foo')
+
+    def test_index_cannot_be_used_to_filter(self):
+        with self.assertRaises(ImplementationError):
+            SortIndexTestModel.collection(name='foo')
+        # but other indexes still can
+        self.assertEqual(set(SortIndexTestModel.collection(value=10)), {'1'})
+
+
+class RegistryTestModel(TestRedisModel):
+    name = fields.InstanceHashField(indexable=True)
+    color = fields.InstanceHashField(indexable=True, indexes=[
+        EqualIndex.configure(registry=True, transform=lambda value: value.lower())
+    ])
+
+
+class EqualIndexRegistryTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(EqualIndexRegistryTestCase, self).setUp()
+        self.obj1 = RegistryTestModel(name='foo', color='Red')
+        self.obj2 = RegistryTestModel(name='bar', color='red')
+        self.obj3 = RegistryTestModel(name='baz', color='blue')
+        self.index = RegistryTestModel.get_field('color').get_index()
+
+    def test_registry_key(self):
+        self.assertEqual(self.index.get_registry_key(), 'tests:registrytestmodel:__index__:registry:color')
+        self.assertFalse(RegistryTestModel.get_field('name').get_index().registry)
+
+    def test_stored_data(self):
+        self.assertEqual(self.connection.zrange(self.index.get_registry_key(), 0, -1, withscores=True), [
+            ('blue', 1.0),
+            ('red', 2.0),
+        ])
+
+    def test_registry_should_be_updated(self):
+        self.obj1.color.hset('blue')
+        self.assertEqual(self.index.get_values_counts(), {'red': 1, 'blue': 2})
+        self.obj2.delete()
+        self.assertEqual(self.index.get_values_counts(), {'blue': 2})
+        self.obj3.color.hdel()
+        self.assertEqual(self.index.get_values_counts(), {'blue': 1})
+        # setting the same value does not count it twice
+        self.obj1.color.hset('Blue')
+        self.assertEqual(self.index.get_values_counts(), {'blue': 1})
+
+    def test_values_should_be_read_from_the_registry(self):
+        with self.assertNumCommands(1):
+            self.assertEqual(self.index.get_all_values_keys(), {
+                'red': 'tests:registrytestmodel:color:red',
+                'blue': 'tests:registrytestmodel:color:blue',
+            })
+        with self.assertNumCommands(1):
+            self.assertEqual(self.index.get_values_counts(), {'red': 2, 'blue': 1})
+
+    def test_values_counts_without_registry(self):
+        index = RegistryTestModel.get_field('name').get_index()
+        self.assertEqual(index.get_values_counts(), {'foo': 1, 'bar': 1, 'baz': 1})
+
+    def test_clear_and_rebuild(self):
+        self.index.clear()
+        self.assertEqual(self.index.get_values_counts(), {})
+        self.index.rebuild()
+        self.assertEqual(self.index.get_values_counts(), {'red': 2, 'blue': 1})
+        self.index.clear(aggressive=True)
+        self.assertFalse(self.connection.exists(self.index.get_registry_key()))
+        self.index.rebuild()
+        self.assertEqual(self.index.get_values_counts(), {'red': 2, 'blue': 1})
+
+    def test_registry_cannot_be_used_for_hash_fields(self):
+        with self.assertRaises(ImplementationError):
+            class RegistryHashModel(TestRedisModel):
+                data = fields.HashField(indexable=True, indexes=[EqualIndex.configure(registry=True)])
+
+
+class ChunkedRangeIndexTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[TextRangeIndex.configure(chunk_size=2)])
+    value = fields.StringField(indexable=True, indexes=[NumberRangeIndex.configure(chunk_size=2)])
+
+
+class ChunkedRangeIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(ChunkedRangeIndexTestCase, self).setUp()
+        self.pks = {}
+        for name, value in [('bar', 5), ('baz', 10), ('foo', 10), ('foo', 10),
+                            ('foo', 10), ('foobar', 20), ('qux', 30)]:
+            obj = ChunkedRangeIndexTestModel(name=name, value=value)
+            self.pks.setdefault(name, set()).add(obj.pk.get())
+            self.pks.setdefault(value, set()).add(obj.pk.get())
+
+    def test_chunk_size_must_be_a_positive_integer(self):
+        self.assertEqual(TextRangeIndex.chunk_size, None)
+        self.assertEqual(NumberRangeIndex.configure(chunk_size='3').chunk_size, 3)
+        for chunk_size in (0, -1, 'foo'):
+            with self.assertRaises(ValueError):
+                NumberRangeIndex.configure(chunk_size=chunk_size)
+        with self.assertRaises(TypeError):
+            SortIndex.configure(chunk_size=2)
+
+    def test_text_filters(self):
+        collection = ChunkedRangeIndexTestModel.collection
+        self.assertSetEqual(set(collection(name='foo')), self.pks['foo'])
+        self.assertSetEqual(set(collection(name__gt='baz')), self.pks['foo'] | self.pks['foobar'] | self.pks['qux'])
+        self.assertSetEqual(set(collection(name__gte='baz')),
+                            self.pks['baz'] | self.pks['foo'] | self.pks['foobar'] | self.pks['qux'])
+        self.assertSetEqual(set(collection(name__lt='foobar')), self.pks['bar'] | self.pks['baz'] | self.pks['foo'])
+        self.assertSetEqual(set(collection(name__startswith='foo')), self.pks['foo'] | self.pks['foobar'])
+        self.assertSetEqual(set(collection(name__in=['bar', 'foo'])), self.pks['bar'] | self.pks['foo'])
+        self.assertSetEqual(set(collection(name__gt='qux')), set())
+
+    def test_number_filters(self):
+        collection = ChunkedRangeIndexTestModel.collection
+        self.assertSetEqual(set(collection(value=10)), self.pks[10])
+        self.assertSetEqual(set(collection(value__gt=5)), self.pks[10] | self.pks[20] | self.pks[30])
+        self.assertSetEqual(set(collection(value__gte=10)), self.pks[10] | self.pks[20] | self.pks[30])
+        self.assertSetEqual(set(collection(value__lte=20)), self.pks[5] | self.pks[10] | self.pks[20])
+        self.assertSetEqual(set(collection(value__lt=10)), self.pks[5])
+        self.assertSetEqual(set(collection(value__gt=30)), set())
+
+    def test_zset_scores_should_follow_the_order(self):
+        index = ChunkedRangeIndexTestModel.get_field('value').get_index()
+        index_key, key_type, is_tmp = index.get_filtered_keys('gte', 10, accepted_key_types={'zset'})[0]
+        self.assertEqual(key_type, 'zset')
+        data = self.connection.zrange(index_key, 0, -1, withscores=True)
+        self.assertEqual([score for pk, score in data], [0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertSetEqual({pk for pk, score in data[:4]}, self.pks[10])
+
+        index = ChunkedRangeIndexTestModel.get_field('name').get_index()
+        index_key, key_type, is_tmp = index.get_filtered_keys('gt', 'baz', accepted_key_types={'zset'})[0]
+        data = self.connection.zrange(index_key, 0, -1, withscores=True)
+        self.assertEqual([score for pk, score in data], [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(data[-1][0], list(self.pks['qux'])[0])
+
+
+class CompactTextRangeIndexTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[TextRangeIndex.configure(compact=True)])
+
+
+class CompactTextRangeIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(CompactTextRangeIndexTestCase, self).setUp()
+        self.pks = {}
+        for name in ('bar', 'foo', 'foo!', 'foobar', 'foobar', 'qux'):
+            obj = CompactTextRangeIndexTestModel(name=name)
+            self.pks.setdefault(name, set()).add(obj.pk.get())
+
+    def get_pks(self, *names):
+        return set().union(*(self.pks[name] for name in names))
+
+    def test_configure(self):
+        index_class = TextRangeIndex.configure(compact=True)
+        self.assertTrue(index_class.compact)
+        self.assertEqual(index_class.key, 'text-range-compact')
+        self.assertEqual(index_class.separator, '\x00')
+        self.assertEqual(TextRangeIndex.configure(compact=True, key='names').key, 'names')
+        self.assertEqual(index_class.configure(prefix='foo').key, 'text-range-compact')
+        index_class = index_class.configure(compact=False)
+        self.assertEqual(index_class.separator, TextRangeIndex.separator)
+
+    def test_storage(self):
+        index = CompactTextRangeIndexTestModel.get_field('name').get_index()
+        key = index.get_storage_key('foo')
+        self.assertEqual(key, 'tests:compacttextrangeindextestmodel:name:text-range-compact')
+        pk = list(self.pks['qux'])[0]
+        self.assertEqual(self.connection.zrange(key, -1, -1), ['qux\x00%s' % pk])
+
+    def test_null_byte_cannot_be_indexed(self):
+        with self.assertRaises(ValueError):
+            CompactTextRangeIndexTestModel(name='foo\x00bar')
+        self.assertEqual(len(CompactTextRangeIndexTestModel.collection(name='foo\x00bar')), 0)
+
+    def test_filters(self):
+        collection = CompactTextRangeIndexTestModel.collection
+        self.assertSetEqual(set(collection(name='foo')), self.get_pks('foo'))
+        self.assertSetEqual(set(collection(name='foobar')), self.get_pks('foobar'))
+        self.assertSetEqual(set(collection(name='fo')), set())
+        self.assertSetEqual(set(collection(name__gt='foo')), self.get_pks('foo!', 'foobar', 'qux'))
+        self.assertSetEqual(set(collection(name__gt='foobar')), self.get_pks('qux'))
+        self.assertSetEqual(set(collection(name__gt='qux')), set())
+        self.assertSetEqual(set(collection(name__gte='foo')), self.get_pks('foo', 'foo!', 'foobar', 'qux'))
+        self.assertSetEqual(set(collection(name__lt='foo')), self.get_pks('bar'))
+        self.assertSetEqual(set(collection(name__lt='foobar')), self.get_pks('bar', 'foo', 'foo!'))
+        self.assertSetEqual(set(collection(name__lt='bar')), set())
+        self.assertSetEqual(set(collection(name__lte='foo')), self.get_pks('bar', 'foo'))
+        self.assertSetEqual(set(collection(name__startswith='foo')), self.get_pks('foo', 'foo!', 'foobar'))
+        self.assertSetEqual(set(collection(name__in=['bar', 'qux'])), self.get_pks('bar', 'qux'))
+
+    def test_after_should_use_the_compact_index(self):
+        collection = CompactTextRangeIndexTestModel.collection().sort(by='name', alpha=True)
+        pks = []
+        page = collection.after(limit=4)
+        pks.extend(page.results)
+        while page.cursor:
+            page = collection.after(page.cursor, limit=4)
+            pks.extend(page.results)
+        self.assertEqual(pks, list(collection))
+        self.assertEqual(set(pks[:1]), self.pks['bar'])
+        self.assertEqual(set(pks[-1:]), self.pks['qux'])
+
+    def test_chunked_filters(self):
+        class CompactChunkedModel(TestRedisModel):
+            name = fields.StringField(indexable=True, indexes=[TextRangeIndex.configure(compact=True, chunk_size=2)])
+
+        pks = {name: CompactChunkedModel(name=name).pk.get() for name in ('a', 'b', 'c', 'd', 'e')}
+        self.assertSetEqual(set(CompactChunkedModel.collection(name__gt='a')), {pks[n] for n in 'bcde'})
+        self.assertSetEqual(set(CompactChunkedModel.collection(name__lt='e')), {pks[n] for n in 'abcd'})
+
+    def test_unique(self):
+        class CompactUniqueModel(TestRedisModel):
+            name = fields.StringField(unique=True, indexes=[TextRangeIndex.configure(compact=True)])
+
+        CompactUniqueModel(name='foo')
+        CompactUniqueModel(name='foobar')
+        with self.assertRaises(UniquenessError):
+            CompactUniqueModel(name='foo')
+
+    def test_migration_from_non_compact_index(self):
+        # the compact index is declared next to the old one
+        class MigratedModel(TestRedisModel):
+            name = fields.StringField(indexable=True, indexes=[
+                TextRangeIndex, TextRangeIndex.configure(compact=True)])
+
+        pk = MigratedModel(name='foo').pk.get()
+        field = MigratedModel.get_field('name')
+        old_index = field.get_index(key='text-range')
+        new_index = field.get_index(key='text-range-compact')
+
+        # simulate data indexed before the compact index was declared, then build it
+        new_index.clear()
+        self.assertEqual(new_index.get_pks_for_filter(new_index.get_storage_key('foo'), 'eq', 'foo'), [])
+        new_index.rebuild()
+
+        # both indexes have the data, in different keys
+        self.assertEqual(old_index.get_pks_for_filter(old_index.get_storage_key('foo'), 'eq', 'foo'), [pk])
+        self.assertEqual(new_index.get_pks_for_filter(new_index.get_storage_key('foo'), 'eq', 'foo'), [pk])
+
+        # clear and remove the old one
+        old_index.clear()
+        field._indexes.remove(old_index)
+        self.assertEqual(set(MigratedModel.collection(name__gte='f')), {pk})
+        self.assertFalse(self.connection.exists(old_index.get_storage_key('foo')))
+
+
+class GeoIndexTestModel(TestRedisModel):
+    name = fields.InstanceHashField(indexable=True)
+    location = fields.InstanceHashField(indexable=True, indexes=[GeoIndex])
+
+
+class GeoIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(GeoIndexTestCase, self).setUp()
+        self.paris = GeoIndexTestModel(name='paris', location='2.3522,48.8566').pk.get()
+        self.versailles = GeoIndexTestModel(name='versailles', location='2.1301, 48.8049').pk.get()
+        self.lyon = GeoIndexTestModel(name='lyon', location='4.8357,45.7640').pk.get()
+        self.nowhere = GeoIndexTestModel(name='nowhere', location='foo').pk.get()
+
+    def test_storage(self):
+        index = GeoIndexTestModel.get_field('location').get_index()
+        key = index.get_storage_key('2.3522,48.8566')
+        self.assertEqual(key, 'tests:geoindextestmodel:location:geo')
+        # invalid coordinates are not indexed
+        self.assertEqual(set(self.connection.zrange(key, 0, -1)), {self.paris, self.versailles, self.lyon})
+        self.assertIsNone(index.normalize_value('200,10'))
+        self.assertEqual(index.normalize_value(' 2.5, -10 '), (2.5, -10.0))
+
+    def test_near_filter(self):
+        collection = GeoIndexTestModel.collection
+        self.assertSetEqual(set(collection(location__near=(2.35, 48.85, 5))), {self.paris})
+        self.assertSetEqual(set(collection(location__near=(2.35, 48.85, 30))), {self.paris, self.versailles})
+        self.assertSetEqual(set(collection(location__near=(2.35, 48.85, 30000, 'm'))), {self.paris, self.versailles})
+        self.assertSetEqual(set(collection(location__near=(2.35, 48.85, 500))),
+                            {self.paris, self.versailles, self.lyon})
+        self.assertSetEqual(set(collection(location__near=(-70, 40, 100))), set())
+        self.assertSetEqual(set(collection(location__near=(2.35, 48.85, 500), name='lyon')), {self.lyon})
+
+    def test_index_is_updated(self):
+        obj = GeoIndexTestModel.get(self.lyon)
+        obj.location.hset('2.34,48.86')
+        self.assertSetEqual(set(GeoIndexTestModel.collection(location__near=(2.35, 48.85, 5))),
+                            {self.paris, self.lyon})
+        obj.delete()
+        self.assertSetEqual(set(GeoIndexTestModel.collection(location__near=(2.35, 48.85, 5))), {self.paris})
+
+    def test_invalid_filter_values(self):
+        for value in ((2.35, 48.85), 'foo', (2.35, 48.85, 'foo'), (2.35, 48.85, 5, 'parsec')):
+            with self.assertRaises(ValueError):
+                list(GeoIndexTestModel.collection(location__near=value))
+
+    def test_temporary_keys_should_be_deleted(self):
+        keys_before = self.count_keys()
+        list(GeoIndexTestModel.collection(location__near=(2.35, 48.85, 30)))
+        self.assertEqual(self.count_keys(), keys_before)
+
+
+class TokenIndexTestModel(TestRedisModel):
+    title = fields.InstanceHashField(indexable=True, indexes=[TokenIndex])
+    name = fields.StringField(indexable=True, indexes=[TokenIndex.configure(tokenizer='trigrams')])
+
+
+class TokenIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(TokenIndexTestCase, self).setUp()
+        self.pk1 = TokenIndexTestModel(title='Hello World, the big one', name='John Smith').pk.get()
+        self.pk2 = TokenIndexTestModel(title='hello again', name='Smithson Jr').pk.get()
+        self.pk3 = TokenIndexTestModel(title='World peace', name='abcab').pk.get()
+
+    def test_configure(self):
+        self.assertEqual(TokenIndex.configure(tokenizer='trigrams', lowercase=False).lowercase, False)
+        index_class = TokenIndex.configure(tokenizer=lambda value: value.split(';'))
+        self.assertEqual(index_class.tokenizer('a;b'), ['a', 'b'])
+        with self.assertRaises(ValueError):
+            TokenIndex.configure(tokenizer='letters')
+
+    def test_handled_suffixes(self):
+        self.assertEqual(TokenIndexTestModel.get_field('title').get_index().handled_suffixes, {'search'})
+        self.assertEqual(TokenIndexTestModel.get_field('name').get_index().handled_suffixes,
+                         {'search', 'contains', 'icontains'})
+        with self.assertRaises(ImplementationError):
+            list(TokenIndexTestModel.collection(title__contains='hello'))
+
+    def test_storage(self):
+        index = TokenIndexTestModel.get_field('title').get_index()
+        self.assertEqual(index.get_storage_key('hello'), 'tests:tokenindextestmodel:__index__:token:title:hello')
+        self.assertEqual(index.tokenize('Hello World, the big one'), {'hello', 'world', 'the', 'big', 'one'})
+        self.assertEqual(self.connection.smembers(index.get_storage_key('hello')), {self.pk1, self.pk2})
+        index = TokenIndexTestModel.get_field('name').get_index()
+        self.assertEqual(index.tokenize('Smith'), {'smi', 'mit', 'ith'})
+
+    def test_search(self):
+        collection = TokenIndexTestModel.collection
+        self.assertSetEqual(set(collection(title__search='hello')), {self.pk1, self.pk2})
+        self.assertSetEqual(set(collection(title__search='WORLD, hello!')), {self.pk1})
+        self.assertSetEqual(set(collection(title__search='hell')), set())
+        self.assertSetEqual(set(collection(title__search='world', name__search='smith')), {self.pk1})
+        with self.assertRaises(ValueError):
+            list(collection(title__search='!!'))
+
+    def test_contains(self):
+        collection = TokenIndexTestModel.collection
+        self.assertSetEqual(set(collection(name__contains='Smith')), {self.pk1, self.pk2})
+        self.assertSetEqual(set(collection(name__contains='smith')), set())
+        self.assertSetEqual(set(collection(name__icontains='smith')), {self.pk1, self.pk2})
+        self.assertSetEqual(set(collection(name__contains='Smithson')), {self.pk2})
+        # short values are checked on all entries
+        self.assertSetEqual(set(collection(name__contains='Jr')), {self.pk2})
+        self.assertSetEqual(set(collection(name__icontains='H')), {self.pk1, self.pk2})
+
+    def test_contains_should_verify_values(self):
+        # "abcab" has all the trigrams of "abcabc"
+        self.assertSetEqual(set(TokenIndexTestModel.collection(name__contains='abcabc')), set())
+
+        class TokenIndexNoVerifyTestModel(TestRedisModel):
+            name = fields.StringField(indexable=True, indexes=[
+                TokenIndex.configure(tokenizer='trigrams', verify=False)])
+
+        pk = TokenIndexNoVerifyTestModel(name='abcab').pk.get()
+        self.assertSetEqual(set(TokenIndexNoVerifyTestModel.collection(name__contains='abcabc')), {pk})
+        with self.assertRaises(ValueError):
+            list(TokenIndexNoVerifyTestModel.collection(name__contains='ab'))
+
+    def test_index_is_updated(self):
+        obj = TokenIndexTestModel.get(self.pk1)
+        obj.name.set('Bob')
+        obj.title.hset('goodbye')
+        self.assertSetEqual(set(TokenIndexTestModel.collection(name__icontains='smith')), {self.pk2})
+        self.assertSetEqual(set(TokenIndexTestModel.collection(title__search='hello')), {self.pk2})
+        self.assertSetEqual(set(TokenIndexTestModel.collection(title__search='goodbye')), {self.pk1})
+        index = TokenIndexTestModel.get_field('title').get_index()
+        self.assertFalse(self.connection.exists(index.get_storage_key('big')))
+        obj.delete()
+        self.assertSetEqual(set(TokenIndexTestModel.collection(title__search='goodbye')), set())
+
+    def test_tokens_should_not_collide_with_equal_index_values(self):
+        class TokenAndEqualIndexTestModel(TestRedisModel):
+            name = fields.StringField(indexable=True, indexes=[EqualIndex, TokenIndex])
+
+        pk1 = TokenAndEqualIndexTestModel(name='token:foo').pk.get()
+        pk2 = TokenAndEqualIndexTestModel(name='foo').pk.get()
+        collection = TokenAndEqualIndexTestModel.collection
+        self.assertSetEqual(set(collection(name='token:foo')), {pk1})
+        self.assertSetEqual(set(collection(name='foo')), {pk2})
+        self.assertSetEqual(set(collection(name__search='foo')), {pk1, pk2})
+        self.assertSetEqual(set(collection(name__search='token')), {pk1})
+
+    def test_all_tokens_should_be_stored_in_one_call(self):
+        obj = TokenIndexTestModel.get(self.pk3)
+        with self.assertNumCommands(15):
+            # SET (lock), HGET (old value)
+            # EVALSHA with one SREM for each of the 2 old tokens
+            # EVALSHA with one SADD for each of the 5 new tokens
+            # HSET, EVALSHA + GET + DEL (unlock)
+            obj.title.hset('one two three four five')
+
+    def test_verify_cannot_be_used_with_many_parts(self):
+        with self.assertRaises(ImplementationError):
+            class TokenIndexHashFieldTestModel(TestRedisModel):
+                data = fields.HashField(indexable=True, indexes=[TokenIndex.configure(tokenizer='trigrams')])
+
+    def test_temporary_keys_should_be_deleted(self):
+        keys_before = self.count_keys()
+        list(TokenIndexTestModel.collection(name__icontains='smith', title__search='hello'))
+        self.assertEqual(self.count_keys(), keys_before)
+
+    def test_clear(self):
+        index = TokenIndexTestModel.get_field('name').get_index()
+        self.assertEqual(len(index.get_all_storage_keys()), 17)
+        index.clear(aggressive=True)
+        self.assertEqual(index.get_all_storage_keys(), set())
+
+
+class PartialIndexTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[EqualIndex.configure(only_if={'active': 1})])
+    age = fields.InstanceHashField(indexable=True, indexes=[
+        NumberRangeIndex.configure(only_if={'active': 1, 'kind': 'user'})])
+    active = fields.InstanceHashField()
+    kind = fields.InstanceHashField()
+
+
+class PartialAndFullIndexesTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[
+        EqualIndex.configure(prefix='active', only_if={'active': 1}), EqualIndex])
+    age = fields.InstanceHashField(indexable=True, indexes=[
+        NumberRangeIndex.configure(prefix='active', only_if={'active': 1}), NumberRangeIndex])
+    active = fields.InstanceHashField()
+
+
+class PartialIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(PartialIndexTestCase, self).setUp()
+        self.obj1 = PartialIndexTestModel(name='foo', age=20, active=1, kind='user')
+        self.obj2 = PartialIndexTestModel(name='foo', age=30, active=0, kind='user')
+        self.obj3 = PartialIndexTestModel(name='bar', age=40, active=1, kind='bot')
+
+    def assertIndexed(self, name_pks, age_pks):
+        collection = PartialIndexTestModel.collection
+        self.assertSetEqual(set(collection(name='foo')) | set(collection(name='bar')), name_pks)
+        self.assertSetEqual(set(collection(age__gte=0)), age_pks)
+
+    def test_configure(self):
+        self.assertEqual(EqualIndex.configure(only_if={'active': 1, 'kind': None}).only_if,
+                         {'active': '1', 'kind': None})
+        self.assertIsNone(EqualIndex.configure(only_if=None).only_if)
+        with self.assertRaises(ValueError):
+            EqualIndex.configure(only_if={})
+        with self.assertRaises(ValueError):
+            EqualIndex.configure(only_if=['active'])
+
+    def test_only_matching_instances_should_be_indexed(self):
+        self.assertIndexed({self.obj1.pk.get(), self.obj3.pk.get()}, {self.obj1.pk.get()})
+        index = PartialIndexTestModel.get_field('name').get_index()
+        self.assertEqual(self.connection.smembers(index.get_storage_key('foo')), {self.obj1.pk.get()})
+
+    def test_updating_a_condition_field_should_update_the_index(self):
+        self.obj1.active.hset(0)
+        self.obj2.active.hset(1)
+        self.assertIndexed({self.obj2.pk.get(), self.obj3.pk.get()}, {self.obj2.pk.get()})
+        self.obj3.kind.hset('user')
+        self.assertIndexed({self.obj2.pk.get(), self.obj3.pk.get()}, {self.obj2.pk.get(), self.obj3.pk.get()})
+        self.obj3.hdel('active')
+        self.assertIndexed({self.obj2.pk.get()}, {self.obj2.pk.get()})
+
+    def test_updating_an_indexed_field_should_respect_the_condition(self):
+        self.obj1.name.set('bar')
+        self.obj2.name.set('bar')
+        self.assertSetEqual(set(PartialIndexTestModel.collection(name='bar')),
+                            {self.obj1.pk.get(), self.obj3.pk.get()})
+        self.assertSetEqual(set(PartialIndexTestModel.collection(name='foo')), set())
+
+    def test_hmset_with_condition_and_indexed_fields(self):
+        self.obj1.hmset(active=0, age=25)
+        self.obj2.hmset(active=1, age=35)
+        self.assertIndexed({self.obj2.pk.get(), self.obj3.pk.get()}, {self.obj2.pk.get()})
+        self.assertSetEqual(set(PartialIndexTestModel.collection(age=35)), {self.obj2.pk.get()})
+        self.assertSetEqual(set(PartialIndexTestModel.collection(age=30)), set())
+
+    def test_condition_may_be_set_after_indexed_fields(self):
+        obj = PartialIndexTestModel(name='foo')
+        self.assertNotIn(obj.pk.get(), set(PartialIndexTestModel.collection(name='foo')))
+        obj.active.hset(1)
+        self.assertIn(obj.pk.get(), set(PartialIndexTestModel.collection(name='foo')))
+
+    def test_non_matching_instances_should_not_write_in_the_index(self):
+        keys_before = self.count_keys()
+        self.obj2.name.set('baz')
+        self.assertEqual(self.count_keys(), keys_before)
+        self.assertSetEqual(set(PartialIndexTestModel.collection(name='baz')), set())
+
+    def test_delete(self):
+        self.obj1.delete()
+        self.obj3.delete()
+        self.assertIndexed(set(), set())
+
+    def test_rebuild(self):
+        index = PartialIndexTestModel.get_field('name').get_index()
+        index.clear(aggressive=True)
+        self.assertIndexed(set(), {self.obj1.pk.get()})
+        index.rebuild()
+        self.assertIndexed({self.obj1.pk.get(), self.obj3.pk.get()}, {self.obj1.pk.get()})
+
+    def test_partial_indexes_should_not_be_used_as_data_source(self):
+        collection = PartialIndexTestModel.collection()
+        self.assertDictEqual(collection.aggregate(smallest=Min('age'), biggest=Max('age')),
+                             {'smallest': 20.0, 'biggest': 40.0})
+        with self.assertRaises(ImplementationError):
+            collection.facet_counts('name')
+        with self.assertRaises(ImplementationError):
+            collection.distinct('name')
+        with self.assertRaises(ImplementationError):
+            collection.sort(by='age').after(limit=2)
+
+    def test_full_indexes_should_be_used_instead_of_partial_ones(self):
+        PartialAndFullIndexesTestModel(name='foo', age=20, active=1)
+        PartialAndFullIndexesTestModel(name='foo', age=30, active=0)
+        PartialAndFullIndexesTestModel(name='bar', age=40, active=0)
+        collection = PartialAndFullIndexesTestModel.collection()
+        self.assertDictEqual(collection.aggregate(smallest=Min('age'), biggest=Max('age')),
+                             {'smallest': 20.0, 'biggest': 40.0})
+        self.assertDictEqual(collection.facet_counts('name'), {'name': {'foo': 2, 'bar': 1}})
+        self.assertEqual(collection.distinct('name'), ['bar', 'foo'])
+        page = collection.sort(by='age', desc=True).after(limit=2)
+        self.assertEqual(page.results, ['3', '2'])
+        self.assertEqual(collection.sort(by='age', desc=True).after(page.cursor, limit=2).results, ['1'])
+
+    def test_invalid_conditions(self):
+        with self.assertRaises(ImplementationError):
+            class PartialIndexUniqueTestModel(TestRedisModel):
+                name = fields.StringField(unique=True, indexes=[EqualIndex.configure(only_if={'active': 1})])
+                active = fields.StringField()
+        with self.assertRaises(ImplementationError):
+            class PartialIndexSortTestModel(TestRedisModel):
+                name = fields.StringField(indexable=True, indexes=[SortIndex.configure(only_if={'active': 1})])
+                active = fields.StringField()
+        with self.assertRaises(ImplementationError):
+            class PartialIndexMissingTestModel(TestRedisModel):
+                name = fields.StringField(indexable=True, indexes=[EqualIndex.configure(only_if={'active': 1})])
+        with self.assertRaises(ImplementationError):
+            class PartialIndexSetTestModel(TestRedisModel):
+                name = fields.StringField(indexable=True, indexes=[EqualIndex.configure(only_if={'active': 1})])
+                active = fields.SetField()
+
+
+class PresenceIndexTestModel(TestRedisModel):
+    name = fields.StringField(indexable=True, indexes=[EqualIndex, PresenceIndex])
+    title = fields.InstanceHashField(indexable=True, indexes=[PresenceIndex])
+    data = fields.HashField(indexable=True, indexes=[PresenceIndex])
+
+
+class PresenceIndexTestCase(LimpydBaseTest):
+
+    def setUp(self):
+        super(PresenceIndexTestCase, self).setUp()
+        self.pk1 = PresenceIndexTestModel(name='foo', title='Foo').pk.get()
+        self.pk2 = PresenceIndexTestModel(name='bar').pk.get()
+        self.pk3 = PresenceIndexTestModel(title='Baz').pk.get()
+
+    def test_storage(self):
+        index = PresenceIndexTestModel.get_field('name').get_index(key='presence')
+        self.assertEqual(index.get_storage_key(), 'tests:presenceindextestmodel:__index__:presence:name')
+        self.assertEqual(self.connection.smembers(index.get_storage_key()), {self.pk1, self.pk2})
+
+    def test_presence_should_not_collide_with_equal_index_values(self):
+        pk4 = PresenceIndexTestModel(name='presence').pk.get()
+        collection = PresenceIndexTestModel.collection
+        self.assertSetEqual(set(collection(name='presence')), {pk4})
+        self.assertSetEqual(set(collection(name__isnull=False)), {self.pk1, self.pk2, pk4})
+        PresenceIndexTestModel(pk4).name.delete()
+        self.assertSetEqual(set(collection(name='presence')), set())
+        self.assertSetEqual(set(collection(name__isnull=True)), {self.pk3, pk4})
+
+    def test_isnull(self):
+        collection = PresenceIndexTestModel.collection
+        self.assertSetEqual(set(collection(name__isnull=False)), {self.pk1, self.pk2})
+        self.assertSetEqual(set(collection(name__isnull=True)), {self.pk3})
+        self.assertSetEqual(set(collection(title__isnull=True)), {self.pk2})
+        self.assertSetEqual(set(collection(title__isnull='0', name__isnull='false')), {self.pk1})
+        self.assertSetEqual(set(collection(title__isnull=1, name='bar')), {self.pk2})
+        with self.assertRaises(ValueError):
+            list(collection(name__isnull='maybe'))
+
+    def test_isnull_false_should_not_use_temporary_keys(self):
+        with self.assertNumCommands(1):
+            # SMEMBERS of the set of the index
+            list(PresenceIndexTestModel.collection(name__isnull=False))
+
+    def test_updates(self):
+        obj1 = PresenceIndexTestModel.get(self.pk1)
+        obj1.name.delete()
+        obj1.hdel('title')
+        obj3 = PresenceIndexTestModel.get(self.pk3)
+        obj3.name.set('baz')
+        collection = PresenceIndexTestModel.collection
+        self.assertSetEqual(set(collection(name__isnull=True)), {self.pk1})
+        self.assertSetEqual(set(collection(title__isnull=False)), {self.pk3})
+        obj3.delete()
+        self.assertSetEqual(set(collection(name__isnull=False)), {self.pk2})
+        self.assertSetEqual(set(collection(title__isnull=False)), set())
+
+    def test_hash_field(self):
+        PresenceIndexTestModel.get(self.pk1).data.hmset(a=1, b=2)
+        PresenceIndexTestModel.get(self.pk2).data.hset('a', 3)
+        collection = PresenceIndexTestModel.collection
+        self.assertSetEqual(set(collection(data__a__isnull=False)), {self.pk1, self.pk2})
+        self.assertSetEqual(set(collection(data__b__isnull=True)), {self.pk2, self.pk3})
+
+    def test_temporary_keys_should_be_deleted(self):
+        keys_before = self.count_keys()
+        list(PresenceIndexTestModel.collection(name__isnull=True, title__isnull=True))
+        self.assertEqual(self.count_keys(), keys_before)
+
+    def test_cannot_be_used_with_many_values(self):
+        with self.assertRaises(ImplementationError):
+            class PresenceIndexSetTestModel(TestRedisModel):
+                tags = fields.SetField(indexable=True, indexes=[PresenceIndex])
+
+
 class CleanTestCase(LimpydBaseTest):
 
     def test_equal_index(self):
@@ -11,7 +11,11 @@ import unittest
 
 from limpyd import model, fields
 from limpyd import fields
+from limpyd.collection import Sum
+from limpyd.contrib.collection import ExtendedCollectionManager
 from limpyd.exceptions import *
+from limpyd.indexes import EqualIndex, TokenIndex
+from limpyd.utils import is_bucket_pattern, resolve_pattern
 
 from .base import LimpydBaseTest, TEST_CONNECTION_SETTINGS
 
@@ -864,5 +868,94 @@ class ScanTest(LimpydBaseTest):
         })
 
 
+class BucketPoint(TestRedisModel):
+    bucket_size = 2
+    collection_manager = ExtendedCollectionManager
+
+    name = fields.InstanceHashField(indexable=True, indexes=[EqualIndex, TokenIndex.configure(tokenizer='trigrams')])
+    score = fields.InstanceHashField()
+    label = fields.StringField()
+
+
+class BucketTest(LimpydBaseTest):
+
+    def setUp(self):
+        super(BucketTest, self).setUp()
+        self.point1 = BucketPoint(name='foo', score=10, label='a')
+        self.point2 = BucketPoint(name='bar', score=5)
+        self.point3 = BucketPoint(name='baz', score=20)
+
+    def test_instances_should_share_bucket_hashes(self):
+        self.assertEqual(self.point1.key, 'tests:bucketpoint:bucket:0')
+        self.assertEqual(self.point2.key, 'tests:bucketpoint:bucket:1')
+        self.assertEqual(self.point3.key, 'tests:bucketpoint:bucket:1')
+        self.assertDictEqual(self.connection.hgetall('tests:bucketpoint:bucket:1'), {
+            '2:name': 'bar', '2:score': '5', '3:name': 'baz', '3:score': '20',
+        })
+        self.assertEqual(self.connection.get(self.point1.label.key), 'a')
+
+    def test_instancehash_fields_commands(self):
+        self.assertEqual(BucketPoint(2).name.hget(), 'bar')
+        self.point2.score.hincrby(2)
+        self.assertEqual(self.point2.score.hget(), '7')
+        self.assertTrue(self.point2.score.hexists())
+        self.point2.score.hdel()
+        self.assertFalse(self.point2.score.hexists())
+        self.assertEqual(self.point3.score.hget(), '20')
+
+    def test_model_hash_commands(self):
+        self.assertEqual(self.point3.hmget('name', 'score'), ['baz', '20'])
+        self.point3.hmset(name='qux', score=30)
+        self.assertEqual(self.point3.hmget('name', 'score'), ['qux', '30'])
+        self.assertEqual(self.point2.hmget('name', 'score'), ['bar', '5'])
+        self.point3.hdel('score')
+        self.assertDictEqual(self.point3.hgetall(), {'name': 'qux'})
+        self.assertEqual(self.point3.hkeys(), ['name'])
+        self.assertEqual(self.point3.hvals(), ['qux'])
+        self.assertEqual(self.point3.hlen(), 1)
+        self.assertEqual(self.point2.hlen(), 2)
+        self.assertSetEqual(set(BucketPoint.collection(name='qux')), {self.point3.pk.get()})
+
+    def test_delete_should_only_delete_fields_of_the_instance(self):
+        self.point2.delete()
+        self.assertDictEqual(self.connection.hgetall('tests:bucketpoint:bucket:1'), {
+            '3:name': 'baz', '3:score': '20',
+        })
+        self.assertFalse(BucketPoint.exists(pk=2))
+
+    def test_collections_should_sort_and_return_values(self):
+        collection = BucketPoint.collection()
+        self.assertListEqual(list(collection.sort(by='score')), ['2', '1', '3'])
+        self.assertListEqual(list(collection.sort(by='-score')[:2]), ['3', '1'])
+        self.assertListEqual(list(collection.sort(by='name', alpha=True)), ['2', '3', '1'])
+        self.assertListEqual(list(collection.sort(by='score').values_list('name', 'score')), [
+            ('bar', '5'), ('foo', '10'), ('baz', '20'),
+        ])
+        self.assertListEqual(list(collection.filter(name__contains='ba').sort(by='score').values('pk', 'name', 'label')), [
+            {'pk': '2', 'name': 'bar', 'label': None},
+            {'pk': '3', 'name': 'baz', 'label': None},
+        ])
+        self.assertListEqual(list(collection.sort(by='score').values_list('name', flat=True).iterator(chunk_size=2)),
+                             ['bar', 'foo', 'baz'])
+        self.assertDictEqual(collection.aggregate(total=Sum('score')), {'total': 35.0})
+
+    def test_bucket_patterns(self):
+        pattern = BucketPoint.get_field('name').sort_wildcard
+        self.assertEqual(pattern, 'tests:bucketpoint:bucket:*/2->*:name')
+        self.assertTrue(is_bucket_pattern(pattern))
+        self.assertFalse(is_bucket_pattern(Boat.get_field('power').sort_wildcard))
+        self.assertEqual(resolve_pattern(pattern, '3'), ('tests:bucketpoint:bucket:1', '3:name'))
+
+    def test_bucket_size_needs_an_auto_pk(self):
+        with self.assertRaises(ImplementationError):
+            class BucketWithPK(TestRedisModel):
+                bucket_size = 10
+                id = fields.PKField()
+
+        with self.assertRaises(ImplementationError):
+            class BucketWithInvalidSize(TestRedisModel):
+                bucket_size = 0
+
+
 if __name__ == '__main__':
     unittest.main()